@@ -1,3 +1,3 @@
-poetry run kernprof -l main.py
-poetry run python -m line_profiler main.py.lprof > line_profiler_result.txt
-rm main.py.lprof
+# Line timings of every stage on the scripted workloads, see benchmarks/profile_workloads.py (needs line_profiler)
+poetry run python -m benchmarks.profile_workloads --quick "$@"
+cat profiles/*/*.lines.txt > line_profiler_result.txt
@@ -1,2 +1,5 @@
-poetry run python -m cProfile -o main.prof main.py
-poetry run snakeviz main.prof
+# cProfile of one stage on a scripted workload, e.g. "./analysis_snakeviz.sh hotkey_table matcher"
+WORKLOAD=${1:-typing_storm}
+STAGE=${2:-matcher}
+poetry run python -m benchmarks.profile_workloads "$WORKLOAD" --quick --stages "$STAGE"
+poetry run snakeviz "profiles/$WORKLOAD/$STAGE.prof"
@@ -0,0 +1,610 @@
+"""
+Headless benchmarks: drive 'Manager.keyboard_on_press' with synthetic key presses and run actions against the
+recording backend, so no display and no human is needed. Results are written as JSON to compare runs, e.g.
+
+    python -m benchmarks.benchmark_suite --output bench.json
+    python -m benchmarks.benchmark_suite --quick
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import string
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import deque
+from types import SimpleNamespace
+from typing import List, Dict, Callable, Optional
+
+from loguru import logger
+
+from models.backends import RecordingBackend
+from models.key_codes import KeyHistory, encode, modifier_mask
+from models.keyboard_presser import KeyboardCommand, KeyboardAction, TextAction
+from models.manager import Manager
+from models.mouse_clicker import MouseCommand, MouseAction
+from models.other import KeyInfo, ScriptCommand, MouseInfo, Click, MODIFIERS
+
+BENCHMARKS: Dict[str, Callable[[bool], dict]] = {}
+
+KEYS = list(string.ascii_lowercase + string.digits)
+
+# Key presses of one burst in the hook callback benchmark, each is a press and a release event
+HOOK_BURST_KEYS = 2000
+# The matcher throughput benchmark fails if matching with the most hotkeys is slower than this share of the rate
+# with the fewest hotkeys, once the automaton is warm
+MATCHER_THROUGHPUT_MIN_RATIO = 0.5
+
+# The startup benchmark fails if importing the manager takes longer
+IMPORT_TIME_BUDGET_SECONDS = 0.5
+# Modules that should not be imported before the listener runs
+HEAVY_MODULES = ["numpy", "pyautogui", "pyscreeze", "pymsgbox", "pytweening", "PIL", "Xlib", "http.server"]
+
+# Runs in a fresh interpreter, so modules imported by the benchmark suite itself do not count
+STARTUP_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+from models.manager import Manager
+imported = time.perf_counter()
+heavy_modules = [name for name in HEAVY_MODULES if name in sys.modules]
+# The real listener and backend only on request, e.g. CI machines have no keyboard to hook
+start_listener = bool(os.environ.get("BENCHMARK_START_LISTENER"))
+manager = Manager(backend="pyautogui" if start_listener else "recording", start_listener=start_listener)
+ready = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "listener_ready_seconds": ready - start,
+    "listener_started": start_listener,
+    "heavy_modules_after_import": heavy_modules,
+}))
+os._exit(0)
+"""
+
+
+def benchmark(function: Callable[[bool], dict]) -> Callable[[bool], dict]:
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def create_manager(**kwargs) -> Manager:
+    return Manager(backend=RecordingBackend(clock=time.perf_counter), start_listener=False, **kwargs)
+
+
+def close_manager(manager: Manager):
+    manager.executor.stop()
+    manager.injector.stop()
+
+
+def percentiles(values: List[float]) -> dict:
+    values = sorted(values)
+    return {
+        "min": values[0],
+        "p50": values[len(values) // 2],
+        "p95": values[int(len(values) * 0.95)],
+        "max": values[-1],
+        "mean": statistics.mean(values),
+    }
+
+
+def random_combination(rng: random.Random, length: int) -> str:
+    keys = []
+    for _ in range(length):
+        modifiers = [modifier for modifier in MODIFIERS if rng.random() < 0.3]
+        keys.append("+".join(modifiers + [rng.choice(KEYS)]))
+    return ",".join(keys)
+
+
+def random_key_presses(rng: random.Random, amount: int) -> List[KeyInfo]:
+    return [
+        KeyInfo(rng.choice(KEYS), ctrl=rng.random() < 0.1, alt=rng.random() < 0.1, shift=rng.random() < 0.1)
+        for _ in range(amount)
+    ]
+
+
+@benchmark
+def matcher_throughput(quick: bool) -> dict:
+    """
+    Key presses per second through 'keyboard_on_press' depending on the amount of registered hotkeys.
+    More hotkeys also trigger more commands, so "matching_key_presses_per_second" measures the matcher alone with
+    a warm automaton, which should stay flat.
+    """
+    results = {}
+    key_press_amount = 20000 if quick else 200000
+    hotkey_amounts = [10, 100, 1000, 10000]
+    for hotkey_amount in hotkey_amounts:
+        rng = random.Random(hotkey_amount)
+        manager = create_manager()
+        try:
+            for _ in range(hotkey_amount):
+                manager.add_hotkey(random_combination(rng, rng.randint(2, 4)), ScriptCommand())
+            key_presses = random_key_presses(rng, key_press_amount)
+            start = time.perf_counter()
+            for key_info in key_presses:
+                manager.keyboard_on_press(key_info)
+            elapsed = time.perf_counter() - start
+
+            matcher = manager.hotkey_matcher
+            codes = [key_info.code for key_info in key_presses]
+            # Warm up until the key presses do not add transitions anymore
+            for _ in range(5):
+                transitions = len(matcher._transitions)
+                for code in codes:
+                    matcher.feed_code(code)
+                if len(matcher._transitions) == transitions:
+                    break
+            start = time.perf_counter()
+            for code in codes:
+                matcher.feed_code(code)
+            matching_elapsed = time.perf_counter() - start
+        finally:
+            close_manager(manager)
+        results[str(hotkey_amount)] = {
+            "key_presses_per_second": key_press_amount / elapsed,
+            "matching_key_presses_per_second": key_press_amount / matching_elapsed,
+            "cached_states": len(matcher._states),
+        }
+    fewest, most = results[str(hotkey_amounts[0])], results[str(hotkey_amounts[-1])]
+    ratio = most["matching_key_presses_per_second"] / fewest["matching_key_presses_per_second"]
+    results["matching_ratio"] = ratio
+    results["within_budget"] = ratio >= MATCHER_THROUGHPUT_MIN_RATIO
+    return results
+
+
+@benchmark
+def windowed_matching(quick: bool) -> dict:
+    """
+    Key presses per second with 1000 registered hotkeys, depending on how many of them have a time window.
+    Windows are only checked for the hotkeys whose keys matched, so the rate should barely change.
+    """
+    results = {}
+    hotkey_amount = 1000
+    key_press_amount = 20000 if quick else 200000
+    for windowed_amount in [0, 100, 1000]:
+        rng = random.Random(0)
+        manager = create_manager()
+        try:
+            for index in range(hotkey_amount):
+                window_ms = 500 if index < windowed_amount else 0
+                manager.add_hotkey(random_combination(rng, rng.randint(2, 4)), ScriptCommand(window_ms=window_ms))
+            manager.trigger_command = lambda command: None
+            key_presses = random_key_presses(rng, key_press_amount)
+            start = time.perf_counter()
+            for index, key_info in enumerate(key_presses):
+                # One key press every 100 ms
+                manager.keyboard_on_press(key_info, index * 100_000_000)
+            elapsed = time.perf_counter() - start
+        finally:
+            close_manager(manager)
+        results[str(windowed_amount)] = {"key_presses_per_second": key_press_amount / elapsed}
+    return results
+
+
+def _wait_for_events(backend: RecordingBackend, amount: int, timeout: float = 5):
+    end = time.perf_counter() + timeout
+    while len(backend.events) < amount and time.perf_counter() < end:
+        time.sleep(0.0001)
+
+
+@benchmark
+def trigger_latency(quick: bool) -> dict:
+    """ Milliseconds from the key press that triggers a hotkey until the first injected event. """
+    manager = create_manager()
+    backend: RecordingBackend = manager.backend
+    manager.add_hotkey("alt+1", KeyboardCommand(keyboard_action=KeyboardAction(manager, hotkeys_to_press=[KeyInfo("a")])))
+    trigger = KeyInfo("1", ctrl=False, alt=True, shift=False)
+    try:
+        # Single triggers, one after another
+        sequential = []
+        for _ in range(50 if quick else 500):
+            backend.clear()
+            start = time.perf_counter()
+            manager.keyboard_on_press(trigger)
+            _wait_for_events(backend, 1)
+            sequential.append((backend.events[0].timestamp - start) * 1000)
+            _wait_for_events(backend, 2)
+
+        # Bursts of triggers, latency until each trigger's first event
+        burst_size = 50
+        burst = []
+        for _ in range(5 if quick else 20):
+            time.sleep(0.01)
+            backend.clear()
+            starts = []
+            for _ in range(burst_size):
+                starts.append(time.perf_counter())
+                manager.keyboard_on_press(trigger)
+            # Each action injects key_down and key_up of "a"
+            _wait_for_events(backend, 2 * burst_size)
+            key_downs = [event.timestamp for event in backend.events if event.action == "key_down"]
+            burst.extend((timestamp - start) * 1000 for timestamp, start in zip(key_downs, starts))
+    finally:
+        close_manager(manager)
+    return {"sequential_ms": percentiles(sequential), "burst_ms": percentiles(burst)}
+
+
+@benchmark
+def hook_callback(quick: bool) -> dict:
+    """
+    Microseconds spent in the listener callback per key event, which runs inside the OS keyboard hook.
+    "inline" handles the event in the callback, "queued" only pushes it to the matcher worker.
+    Keys are pressed in bursts of 'HOOK_BURST_KEYS' as fast as possible, the worker catches up between bursts.
+    The benchmark fails if a queued event was dropped or a burst filled more than half of the queue.
+    """
+    rng = random.Random(0)
+    events = 2000 if quick else 20000
+    keys = [SimpleNamespace(char=rng.choice(KEYS)) for _ in range(events)]
+    results = {}
+    for name in ["inline", "queued"]:
+        manager = create_manager()
+        listener = manager.keyboard_listener
+        for _ in range(100):
+            manager.add_hotkey(random_combination(rng, rng.randint(2, 4)), ScriptCommand())
+        if name == "queued":
+            listener.start_worker()
+        durations = []
+        try:
+            for index, key in enumerate(keys):
+                if index % HOOK_BURST_KEYS == 0:
+                    _wait_for_queue(listener)
+                start = time.perf_counter()
+                listener.on_press(key)
+                listener.on_release(key)
+                durations.append((time.perf_counter() - start) / 2 * 1e6)
+            stats = listener.queue_stats
+            listener.stop()
+        finally:
+            close_manager(manager)
+        results[name] = {
+            "callback_us": percentiles(durations),
+            "dropped": stats["dropped"],
+            "high_water": stats["high_water"],
+            "capacity": stats["capacity"],
+        }
+    queued = results["queued"]
+    results["within_budget"] = queued["dropped"] == 0 and queued["high_water"] <= queued["capacity"] // 2
+    return results
+
+
+def _wait_for_queue(listener, timeout: float = 5):
+    end = time.perf_counter() + timeout
+    while len(listener.queue) and time.perf_counter() < end:
+        time.sleep(0.0001)
+
+
+@benchmark
+def click_rate(quick: bool) -> dict:
+    """ Achieved vs. requested click rate of a MouseAction with a large repeat_amount. """
+    results = {}
+    clicks = 200 if quick else 1000
+    for repeat_delay in [5, 10]:
+        manager = create_manager()
+        backend: RecordingBackend = manager.backend
+        action = MouseAction(
+            manager, mouse_actions=[MouseInfo(click=Click.Left)], repeat_amount=clicks - 1, repeat_delay=repeat_delay
+        )
+        try:
+            start = time.perf_counter()
+            manager.trigger_command(MouseCommand(mouse_action=action)).result()
+            elapsed = time.perf_counter() - start
+        finally:
+            close_manager(manager)
+        mouse_downs = [event.timestamp for event in backend.events if event.action == "mouse_down"]
+        intervals = [(b - a) * 1000 for a, b in zip(mouse_downs, mouse_downs[1:])]
+        results[f"{clicks}_clicks_{repeat_delay}ms"] = {
+            "requested_seconds": clicks * repeat_delay / 1000,
+            "elapsed_seconds": elapsed,
+            "requested_rate": 1000 / repeat_delay,
+            "achieved_rate": len(mouse_downs) / elapsed,
+            "interval_ms": percentiles(intervals),
+            "jitter_ms": action.timing_stats.jitter,
+        }
+    return results
+
+
+@benchmark
+def action_overhead(quick: bool) -> dict:
+    """ CPU time and memory per repetition of an action without delays (interpreter and injection overhead). """
+    repetitions = 2000 if quick else 20000
+    manager = create_manager()
+    action = MouseAction(manager, mouse_actions=[MouseInfo(click=Click.Left)], repeat_amount=repetitions - 1, repeat_delay=0)
+    try:
+        tracemalloc.start()
+        start = time.perf_counter()
+        manager.trigger_command(MouseCommand(mouse_action=action)).result()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        close_manager(manager)
+    return {
+        "repetitions": repetitions,
+        "microseconds_per_repetition": elapsed / repetitions * 1e6,
+        # The recording backend stores 2 events per click, which is included here
+        "peak_memory_bytes": peak,
+    }
+
+
+@benchmark
+def text_typing(quick: bool) -> dict:
+    """ Characters per second when typing a text as one KeyInfo per character compared to a TextAction. """
+    rng = random.Random(0)
+    length = 2000 if quick else 8000
+    text = "".join(rng.choice(string.ascii_letters + string.digits + " .,!?\n") for _ in range(length))
+    results = {}
+    for name in ["key_info_per_character", "text_action"]:
+        manager = create_manager()
+        if name == "text_action":
+            action = TextAction(manager, text=text, paste_min_length=None)
+        else:
+            action = KeyboardAction(manager, hotkeys_to_press=KeyInfo.from_text(text))
+        try:
+            start = time.perf_counter()
+            manager.trigger_command(KeyboardCommand(keyboard_action=action)).result()
+            elapsed = time.perf_counter() - start
+        finally:
+            close_manager(manager)
+        results[name] = {"characters": length, "seconds": elapsed, "characters_per_second": length / elapsed}
+    return results
+
+
+@benchmark
+def concurrent_macros(quick: bool) -> dict:
+    """
+    Wall time of several macros that hold keys down at the same time, once with a different key per macro and once
+    all with the same key. Independent macros overlap, macros that share a key are serialized by the arbiter.
+    """
+    macros = 4
+    repeats = 5 if quick else 20
+    hold_milliseconds = 10
+    results = {}
+    for name in ["independent", "same_key"]:
+        manager = create_manager()
+        try:
+            keys = KEYS[:macros] if name == "independent" else ["a"] * macros
+            commands = [
+                KeyboardCommand(
+                    keyboard_action=KeyboardAction(
+                        manager,
+                        hotkeys_to_press=[KeyInfo(key, duration=hold_milliseconds)],
+                        repeat_delay=0,
+                        repeat_amount=repeats - 1,
+                    )
+                )
+                for key in keys
+            ]
+            start = time.perf_counter()
+            handles = [manager.trigger_command(command) for command in commands]
+            for handle in handles:
+                handle.result()
+            elapsed = time.perf_counter() - start
+        finally:
+            close_manager(manager)
+        serial_seconds = macros * repeats * hold_milliseconds / 1000
+        results[name] = {"macros": macros, "seconds": elapsed, "speedup_over_serial": serial_seconds / elapsed}
+    return results
+
+
+@benchmark
+def control_requests(quick: bool) -> dict:
+    """
+    Trigger requests per second over the control socket, answered one by one compared to pipelined in batches
+    on one persistent connection. The triggered command does nothing, so this is the overhead per request.
+    """
+    import socket
+    import tempfile
+    from models.control_server import ControlClient
+
+    if not hasattr(socket, "AF_UNIX"):
+        return {"skipped": "no Unix sockets on this platform"}
+    requests = 2000 if quick else 20000
+    batch_size = 100
+    manager = create_manager()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            command = ScriptCommand()
+            command.name = "noop"
+            manager.add_hotkey("alt+n", command)
+            server = manager.serve_control(os.path.join(directory, "control.sock"))
+            with ControlClient(server.path) as client:
+                start = time.perf_counter()
+                for _ in range(requests):
+                    client.request("trigger", name="noop")
+                results["sequential"] = {"requests_per_second": requests / (time.perf_counter() - start)}
+
+                start = time.perf_counter()
+                for _ in range(requests // batch_size):
+                    for request_id in client.send_many([("trigger", {"name": "noop"})] * batch_size):
+                        client.receive(request_id)
+                results["pipelined"] = {
+                    "batch_size": batch_size,
+                    "requests_per_second": requests / (time.perf_counter() - start),
+                }
+        finally:
+            manager.control_server.stop()
+            close_manager(manager)
+    return results
+
+
+@benchmark
+def key_event_representation(quick: bool) -> dict:
+    """ Per key press cost of KeyInfo objects in a deque compared to key codes in a ring buffer. """
+    amount = 50000 if quick else 500000
+    rng = random.Random(0)
+    presses = [(rng.choice(KEYS), rng.random() < 0.1, rng.random() < 0.1, rng.random() < 0.1) for _ in range(amount)]
+    hotkey = KeyInfo("e", False, True, False)
+    hotkey_code = hotkey.code
+
+    def key_infos():
+        history = deque()
+        matches = 0
+        for key, ctrl, alt, shift in presses:
+            key_info = KeyInfo(key, ctrl=ctrl, alt=alt, shift=shift)
+            history.appendleft(key_info)
+            if len(history) > 20:
+                history.pop()
+            matches += hotkey == key_info
+        return history
+
+    def key_codes():
+        history = KeyHistory(20)
+        matches = 0
+        for key, ctrl, alt, shift in presses:
+            code = encode(key, modifier_mask(ctrl, alt, shift))
+            history.push(code)
+            matches += hotkey_code == code
+        return history
+
+    results = {}
+    for name, function in [("key_info_deque", key_infos), ("key_code_ring_buffer", key_codes)]:
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        history = function()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del history
+        results[name] = {
+            "nanoseconds_per_key_press": elapsed / amount * 1e9,
+            "history_bytes": retained,
+            "peak_bytes": peak,
+        }
+    return results
+
+
+@benchmark
+def screen_trigger_cpu(quick: bool) -> dict:
+    """ CPU usage (fraction of one core) while watching regions at 30 Hz that change on every frame (worst case). """
+    import numpy as np
+    from models.screen_trigger import ScreenTrigger, SyntheticFrameSource, PixelColor, RegionChanged, TemplateMatch
+
+    rng = np.random.RandomState(0)
+    screens = [rng.randint(0, 256, size=(1080, 1920, 3), dtype=np.uint8) for _ in range(2)]
+
+    class ChangingFrameSource(SyntheticFrameSource):
+        """ Every grab of a region returns different pixels than the previous grab of the same region. """
+
+        def __init__(self):
+            super().__init__(screens[0])
+            self.region_grabs: Dict[tuple, int] = {}
+
+        def grab(self, region):
+            count = self.region_grabs.get(region, 0)
+            self.region_grabs[region] = count + 1
+            self.screen = screens[count % 2]
+            return super().grab(region)
+
+    results = {}
+    seconds = 1 if quick else 5
+    for downsample in [1, 2, 4]:
+        manager = create_manager()
+        source = ChangingFrameSource()
+        conditions = [
+            PixelColor((255, 0, 255), tolerance=2, min_pixels=100),
+            RegionChanged(min_distance=64),
+            TemplateMatch(screens[1][:32, :32], max_difference=0),
+            RegionChanged(min_distance=64),
+        ]
+        try:
+            for index, condition in enumerate(conditions):
+                region = (index * 300, 100, 200, 200)
+                manager.add_screen_trigger(
+                    ScreenTrigger(region, condition, ScriptCommand(), downsample=downsample, min_interval_ms=1000 / 30),
+                    frame_source=source,
+                )
+            start, start_cpu = time.perf_counter(), time.process_time()
+            time.sleep(seconds)
+            elapsed, cpu = time.perf_counter() - start, time.process_time() - start_cpu
+        finally:
+            manager.screen_watcher.stop()
+            close_manager(manager)
+        results[f"4_regions_200x200_downsample_{downsample}"] = {
+            "polls_per_second": source.grabs / elapsed,
+            "cpu_fraction_of_one_core": cpu / elapsed,
+        }
+    return results
+
+
+@benchmark
+def startup(quick: bool) -> dict:
+    """
+    Seconds from the start of the program until the manager is imported and until the manager is ready,
+    in a fresh interpreter. Fails if the import takes longer than IMPORT_TIME_BUDGET_SECONDS.
+    The manager uses the recording backend without a keyboard listener, set the environment variable
+    BENCHMARK_START_LISTENER=1 to start the real listener with the pyautogui backend.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = STARTUP_SCRIPT.replace("HEAVY_MODULES", repr(HEAVY_MODULES))
+    runs = []
+    for _ in range(3 if quick else 10):
+        output = subprocess.check_output([sys.executable, "-c", script], cwd=root)
+        runs.append(json.loads(output.decode().strip().splitlines()[-1]))
+    import_seconds = [run["import_seconds"] for run in runs]
+    return {
+        "import_seconds": percentiles(import_seconds),
+        "listener_ready_seconds": percentiles([run["listener_ready_seconds"] for run in runs]),
+        "listener_started": runs[0]["listener_started"],
+        # Are loaded in the background after the listener started
+        "heavy_modules_after_import": runs[0]["heavy_modules_after_import"],
+        "import_budget_seconds": IMPORT_TIME_BUDGET_SECONDS,
+        # The median is compared so that a single slow run on a busy machine does not fail the benchmark
+        "within_budget": statistics.median(import_seconds) <= IMPORT_TIME_BUDGET_SECONDS,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names: List[str], quick: bool) -> dict:
+    # Logging is not part of what is measured here
+    logger.disable("models")
+    try:
+        results = {name: BENCHMARKS[name](quick) for name in names}
+    finally:
+        logger.enable("models")
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--quick", action="store_true", help="Smaller workloads, e.g. for CI")
+    parser.add_argument(
+        "benchmarks", nargs="*", default=list(BENCHMARKS), metavar="benchmark", help=f"One of {list(BENCHMARKS)}, default: all"
+    )
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks {unknown}, choose from {list(BENCHMARKS)}")
+
+    report = run_benchmarks(args.benchmarks, args.quick)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    over_budget = [name for name, result in report["results"].items() if result.get("within_budget") is False]
+    if over_budget:
+        logger.error(f"Benchmarks over budget: {over_budget}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
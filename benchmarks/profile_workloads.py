@@ -0,0 +1,443 @@
+"""
+Profiles the stages of the manager on scripted workloads, without a display and without waiting for key strokes.
+A workload replays synthetic key events through the hook callbacks of the real 'KeyboardListener' and 'Manager',
+the actions inject into the recording backend. Each stage runs on its own thread and is profiled on its own:
+
+    listener   the hook callbacks, called by the workload on the main thread
+    matcher    the 'KeyMatcher' worker: modifiers, injection filter, hotkey matching
+    scheduler  the 'ActionExecutor' loop: actions and their 'DeadlineScheduler'
+    injector   the 'Injector' thread: batching and calling the backend
+
+The workload runs once per stage with cProfile, line_profiler (if installed) and a stack sampler attached to that
+stage only, so the overhead of profiling one stage does not distort the others. Artifacts in '<output>/<workload>/':
+
+    <stage>.prof          cProfile stats, e.g. 'snakeviz profiles/typing_storm/matcher.prof'
+    <stage>.lprof         line timings of the stage's functions, also as text in <stage>.lines.txt
+    <stage>.stacks.txt    sampled stacks in collapsed format, e.g. for flamegraph.pl or speedscope
+    summary.json          wall time, hottest functions and frames per stage
+
+    python -m benchmarks.profile_workloads typing_storm --quick
+    python -m benchmarks.profile_workloads --compare old/typing_storm/summary.json profiles/typing_storm/summary.json
+
+On Python 3.12+ cProfile can not be limited to one thread, the .prof files contain all threads there.
+"""
+import argparse
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+from benchmarks.benchmark_suite import KEYS, close_manager, create_manager, git_revision, random_combination
+from models.event_queue import SpscQueue
+from models.injector import Injector
+from models.keyboard_listener import KeyboardListener
+from models.keyboard_presser import KeyboardCommand, KeyboardPresser, TextAction
+from models.manager import Manager
+from models.mouse_clicker import MouseAction, MouseClicker, MouseCommand
+from models.other import Action, Click, MouseInfo, ScriptCommand
+from models.scheduler import DeadlineScheduler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# How many functions and sampled frames per stage are kept in the summary
+SUMMARY_SIZE = 25
+# How long to wait for the actions of a workload to finish
+DRAIN_TIMEOUT_SECONDS = 60
+
+# (pressed, pynput key), modifiers have a 'name', other keys a 'char'
+KeyEvent = Tuple[bool, SimpleNamespace]
+
+
+class Stage(NamedTuple):
+    # 'None': the thread that replays the key events
+    thread_name: Optional[str]
+    # Functions that are line profiled
+    functions: List[Tuple[type, str]]
+
+
+STAGES: Dict[str, Stage] = {
+    "listener": Stage(
+        None,
+        [
+            (KeyboardListener, "on_press"),
+            (KeyboardListener, "on_release"),
+            (KeyboardListener, "_push"),
+            (SpscQueue, "push"),
+        ],
+    ),
+    "matcher": Stage(
+        "KeyMatcher",
+        [
+            (KeyboardListener, "_handle_batch"),
+            (KeyboardListener, "handle_event"),
+            (Manager, "keyboard_on_press_code"),
+            (Manager, "keyboard_on_release_code"),
+            (Manager, "_matched"),
+        ],
+    ),
+    "scheduler": Stage(
+        "ActionExecutor",
+        [
+            (Action, "_run_instructions"),
+            (DeadlineScheduler, "wait"),
+            (KeyboardPresser, "press_hotkey"),
+            (KeyboardPresser, "type_text"),
+            (MouseClicker, "do_mouse_action"),
+        ],
+    ),
+    "injector": Stage("Injector", [(Injector, "_run"), (Injector, "_inject_batch"), (Injector, "_execute")]),
+}
+
+WORKLOADS: Dict[str, Callable[[Manager, bool], List[KeyEvent]]] = {}
+
+
+def workload(function: Callable[[Manager, bool], List[KeyEvent]]) -> Callable[[Manager, bool], List[KeyEvent]]:
+    WORKLOADS[function.__name__] = function
+    return function
+
+
+def key(name: str) -> SimpleNamespace:
+    if len(name) == 1:
+        return SimpleNamespace(char=name)
+    return SimpleNamespace(name=name)
+
+
+def tap(name: str, modifiers: Tuple[str, ...] = ()) -> List[KeyEvent]:
+    events = [(True, key(modifier)) for modifier in modifiers]
+    events += [(True, key(name)), (False, key(name))]
+    events += [(False, key(modifier)) for modifier in reversed(modifiers)]
+    return events
+
+
+@workload
+def typing_storm(manager: Manager, quick: bool) -> List[KeyEvent]:
+    """ Fast typing of random characters, some two key sequences type a short text. """
+    rng = random.Random(0)
+    for _ in range(100):
+        manager.add_hotkey(random_combination(rng, rng.randint(2, 4)), ScriptCommand())
+    for _ in range(20):
+        # The typed keys are not replayed, so the injection filter never mistakes a replayed key for an injected one
+        manager.add_hotkey(
+            f"{rng.choice(KEYS)},{rng.choice(KEYS)}",
+            KeyboardCommand(keyboard_action=TextAction(manager, text="?!", paste_min_length=None)),
+        )
+    events = []
+    for _ in range(20000 if quick else 200000):
+        events += tap(rng.choice(KEYS))
+    return events
+
+
+@workload
+def click_macros(manager: Manager, quick: bool) -> List[KeyEvent]:
+    """ Many click macros that run at the same time and compete for the mouse buttons. """
+    clicks = 50 if quick else 500
+    buttons = [Click.Left, Click.Right, Click.Middle]
+    events = []
+    for index in range(24):
+        manager.add_hotkey(
+            f"ctrl+{KEYS[index]}",
+            MouseCommand(
+                mouse_action=MouseAction(
+                    manager,
+                    mouse_actions=[MouseInfo(click=buttons[index % len(buttons)])],
+                    repeat_amount=clicks - 1,
+                    repeat_delay=1,
+                )
+            ),
+        )
+        events += tap(KEYS[index], ("ctrl_l",))
+    return events
+
+
+@workload
+def hotkey_table(manager: Manager, quick: bool) -> List[KeyEvent]:
+    """ Key presses with modifiers against a large table of hotkeys. """
+    rng = random.Random(0)
+    for _ in range(2000 if quick else 20000):
+        manager.add_hotkey(random_combination(rng, rng.randint(2, 4)), ScriptCommand())
+    modifier_keys = ["ctrl_l", "alt_l", "shift_l"]
+    events = []
+    for _ in range(20000 if quick else 200000):
+        modifiers = tuple(modifier for modifier in modifier_keys if rng.random() < 0.2)
+        events += tap(rng.choice(KEYS), modifiers)
+    return events
+
+
+class StackSampler:
+    """ Samples the stack of one thread with sys._current_frames(), costs the sampled thread nothing but the GIL. """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        # Collapsed stack ("outer;...;inner") -> samples
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="StackSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({relative_path(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def hottest_frames(self, amount: int) -> Dict[str, int]:
+        """ Innermost frames with the most samples. """
+        frames: Counter = Counter()
+        for stack, samples in self.stacks.items():
+            frames[stack.rsplit(";", 1)[-1]] += samples
+        return dict(frames.most_common(amount))
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, samples in sorted(self.stacks.items()):
+                f.write(f"{stack} {samples}\n")
+
+
+def relative_path(filename: str) -> str:
+    if filename.startswith(ROOT + os.sep):
+        return os.path.relpath(filename, ROOT)
+    return os.path.basename(filename)
+
+
+def _profile_new_thread(thread_name: str, profile: cProfile.Profile) -> Callable:
+    """ Installed with threading.setprofile(), enables the profile in the stage's thread once it started. """
+
+    def bootstrap(frame, event, arg):
+        sys.setprofile(None)
+        if threading.current_thread().name == thread_name:
+            profile.enable()
+
+    return bootstrap
+
+
+@lru_cache(maxsize=None)
+def _line_profiler_class() -> Optional[type]:
+    try:
+        from line_profiler import LineProfiler
+    except ImportError:
+        logger.warning("line_profiler is not installed, no line timings are written")
+        return None
+    return LineProfiler
+
+
+def _line_profiler(functions: List[Tuple[type, str]]):
+    """ Wraps the functions with a LineProfiler, returns it and a function that restores them. """
+    line_profiler_class = _line_profiler_class()
+    if line_profiler_class is None:
+        return None, lambda: None
+    line_profiler = line_profiler_class()
+    originals = [(cls, name, cls.__dict__[name]) for cls, name in functions]
+    for cls, name, function in originals:
+        setattr(cls, name, line_profiler(function))
+
+    def restore():
+        for cls, name, function in originals:
+            setattr(cls, name, function)
+
+    return line_profiler, restore
+
+
+def _replay(listener: KeyboardListener, events: List[KeyEvent], profile: Optional[cProfile.Profile]) -> float:
+    """
+    Calls the hook callbacks with the events, as fast as the matcher worker takes them off the queue.
+    Returns how many seconds the replay waited for the worker, this is not profiled.
+    """
+    queue = listener.queue
+    throttled = 0.0
+    if profile is not None:
+        profile.enable()
+    for pressed, pynput_key in events:
+        if len(queue) >= queue.capacity:
+            # Faster than any typist, the queue would drop the events
+            if profile is not None:
+                profile.disable()
+            start = time.perf_counter()
+            while len(queue) >= queue.capacity:
+                time.sleep(0.0001)
+            throttled += time.perf_counter() - start
+            if profile is not None:
+                profile.enable()
+        if pressed:
+            listener.on_press(pynput_key)
+        else:
+            listener.on_release(pynput_key)
+    if profile is not None:
+        profile.disable()
+    return throttled
+
+
+def _wait_until_idle(manager: Manager, timeout: float):
+    end = time.perf_counter() + timeout
+    # Stopping the listener lets the matcher worker handle all queued events first
+    manager.keyboard_listener.stop(timeout)
+    while manager.executor.running and time.perf_counter() < end:
+        time.sleep(0.001)
+
+
+def profile_stage(workload_name: str, stage_name: str, quick: bool, output_dir: str, sample_interval: float) -> dict:
+    stage = STAGES[stage_name]
+    profile = cProfile.Profile()
+    line_profiler, restore = _line_profiler(stage.functions)
+    try:
+        if stage.thread_name is not None:
+            threading.setprofile(_profile_new_thread(stage.thread_name, profile))
+        try:
+            manager = create_manager()
+            listener = manager.keyboard_listener
+            listener.start_worker()
+        finally:
+            threading.setprofile(None)
+        try:
+            events = WORKLOADS[workload_name](manager, quick)
+            thread = threading.current_thread() if stage.thread_name is None else None
+            for candidate in threading.enumerate():
+                if candidate.name == stage.thread_name:
+                    thread = candidate
+            sampler = StackSampler(thread.ident, sample_interval)
+            sampler.start()
+            start = time.perf_counter()
+            throttled = _replay(listener, events, profile if stage.thread_name is None else None)
+            queue_stats = listener.queue_stats
+            if stage.thread_name is None:
+                # The hook callbacks are done, waiting for the other stages is not part of this stage
+                sampler.stop()
+                elapsed = time.perf_counter() - start
+            _wait_until_idle(manager, DRAIN_TIMEOUT_SECONDS)
+            if stage.thread_name is not None:
+                sampler.stop()
+                elapsed = time.perf_counter() - start
+            injected_events = len(manager.backend.events)
+        finally:
+            # Ends the stage threads, nothing is recorded anymore while the results are written
+            close_manager(manager)
+    finally:
+        restore()
+
+    path = os.path.join(output_dir, stage_name)
+    profile.dump_stats(f"{path}.prof")
+    sampler.write(f"{path}.stacks.txt")
+    if line_profiler is not None:
+        line_profiler.dump_stats(f"{path}.lprof")
+        with open(f"{path}.lines.txt", "w") as f:
+            line_profiler.print_stats(stream=f)
+    return {
+        "wall_seconds": elapsed,
+        "key_events": len(events),
+        "dropped_key_events": queue_stats["dropped"],
+        "throttled_seconds": throttled,
+        "injected_events": injected_events,
+        "functions": hottest_functions(profile, SUMMARY_SIZE),
+        "samples": sum(sampler.stacks.values()),
+        "hottest_frames": sampler.hottest_frames(SUMMARY_SIZE),
+        "line_profiled": line_profiler is not None,
+    }
+
+
+def hottest_functions(profile: cProfile.Profile, amount: int) -> Dict[str, dict]:
+    """ Functions with the most own time, keyed by 'path:line(name)' so that they can be compared between runs. """
+    stats = pstats.Stats(profile, stream=io.StringIO()).stats
+    hottest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:amount]
+    return {
+        f"{relative_path(filename)}:{line}({name})": {
+            "calls": calls,
+            "own_seconds": own,
+            "cumulative_seconds": cumulative,
+        }
+        for (filename, line, name), (_, calls, own, cumulative, _) in hottest
+    }
+
+
+def profile_workload(workload_name: str, stages: List[str], quick: bool, output: str, sample_interval: float) -> dict:
+    output_dir = os.path.join(output, workload_name)
+    os.makedirs(output_dir, exist_ok=True)
+    # Logging is not part of what is profiled here
+    logger.disable("models")
+    try:
+        results = {
+            stage_name: profile_stage(workload_name, stage_name, quick, output_dir, sample_interval)
+            for stage_name in stages
+        }
+    finally:
+        logger.enable("models")
+    summary = {
+        "workload": workload_name,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": quick,
+        "stages": results,
+    }
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def compare(old: dict, new: dict) -> dict:
+    """ Wall time per stage and own time of the hottest functions of two summaries, new relative to old. """
+    comparison = {}
+    for stage_name in sorted(set(old["stages"]) & set(new["stages"])):
+        old_stage, new_stage = old["stages"][stage_name], new["stages"][stage_name]
+        functions = {}
+        for function in set(old_stage["functions"]) | set(new_stage["functions"]):
+            old_seconds = old_stage["functions"].get(function, {}).get("own_seconds", 0)
+            new_seconds = new_stage["functions"].get(function, {}).get("own_seconds", 0)
+            functions[function] = {"old": old_seconds, "new": new_seconds, "difference": new_seconds - old_seconds}
+        comparison[stage_name] = {
+            "wall_seconds": {
+                "old": old_stage["wall_seconds"],
+                "new": new_stage["wall_seconds"],
+                "ratio": new_stage["wall_seconds"] / old_stage["wall_seconds"],
+            },
+            # Largest changes first
+            "functions": dict(sorted(functions.items(), key=lambda item: abs(item[1]["difference"]), reverse=True)),
+        }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workloads", nargs="*", choices=[[]] + list(WORKLOADS), help="Default: all")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--quick", action="store_true", help="Smaller workloads")
+    parser.add_argument("--output", default="profiles", help="Directory of the artifacts")
+    parser.add_argument("--sample-interval-ms", type=float, default=1.0, help="Interval of the stack sampler")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two summary.json files")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            print(json.dumps(compare(json.load(old), json.load(new)), indent=2))
+        return
+    for workload_name in args.workloads or list(WORKLOADS):
+        summary = profile_workload(workload_name, args.stages, args.quick, args.output, args.sample_interval_ms / 1000)
+        for stage_name, result in summary["stages"].items():
+            logger.info(f"{workload_name} {stage_name}: {result['wall_seconds']:.3f} s, {result['samples']} samples")
+    logger.info(f"Profiles written to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
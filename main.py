@@ -1,20 +1,18 @@
 # Other
 # Coroutines and multiprocessing
 import asyncio
-import sys
+import os
 
 # Simple logging https://github.com/Delgan/loguru
 from loguru import logger
 
-# Remove previous default handlers
 from models.keyboard_presser import KeyboardAction, KeyboardCommand
+from models.logging_setup import configure_logging
 from models.mouse_clicker import MouseCommand, MouseAction
 
-logger.remove()
-# Log to console
-logger.add(sys.stdout, level="INFO")
-# Log to file, max size 1 mb
-logger.add("main.log", retention="10 days", level="INFO")
+# Replace the default handler: log to console and to file without blocking the keyboard hook
+# Use level="DEBUG" to also log every key press and injected key, sample_every / max_events_per_second limit these
+configure_logging(level="INFO", log_file="main.log")
 
 from models.manager import Manager
 from models.other import KeyInfo, ScriptCommand, MouseInfo, Click
@@ -83,12 +81,20 @@ async def main():
     # Can also be "async def my_exit()"
     def my_exit():
         logger.info(f"Ending program, escape was pressed!")
-        manager.exit = True
+        manager.request_exit()
 
     manager.add_hotkey(
         "alt+q", ScriptCommand(functions=[my_exit], start_delay=0),
     )
 
+    # Hotkeys can also be configured in a config file, see 'models/config.py' for the format
+    # Changes to the file are applied while the program is running
+    if os.path.isfile("hotkeys.toml"):
+        manager.load_config("hotkeys.toml", watch=True)
+
+    # Other programs can trigger the commands by name over a Unix socket, see 'models/control_server.py'
+    # manager.serve_control()
+
     logger.info(f"Hotkey manager started")
     await manager.run()
 
@@ -0,0 +1,153 @@
+import asyncio
+import itertools
+from concurrent.futures import Future
+from threading import Thread, Event, Lock
+from typing import Dict, Optional, Coroutine, List, Set
+
+from loguru import logger
+
+
+class ActionHandle:
+    """ Handle of a submitted action, can be used to monitor or cancel it from any thread. """
+
+    def __init__(self, action_id: int, name: str, future: Future):
+        self.action_id = action_id
+        self.name = name
+        self.future = future
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    def cancel(self) -> bool:
+        # Cancelling the concurrent future also cancels the task on the executor loop
+        return self.future.cancel()
+
+    def result(self, timeout: Optional[float] = None):
+        return self.future.result(timeout)
+
+    def __repr__(self):
+        return f"ActionHandle(action_id={self.action_id}, name={self.name!r}, done={self.done})"
+
+
+class ActionExecutor:
+    """
+    Owns one long-lived asyncio event loop on a background thread.
+    Listener threads submit coroutines (e.g. Action.execute()) thread-safely, instead of starting a new thread
+    and event loop per trigger.
+    """
+
+    def __init__(self, max_concurrent_actions: Optional[int] = None, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """
+        loop: run the actions on this event loop instead of on an own thread, e.g. on the virtual clock loop of
+        'models.simulation'. The loop is not stopped by 'stop'.
+        """
+        assert max_concurrent_actions is None or max_concurrent_actions > 0, f"{max_concurrent_actions}"
+        self.max_concurrent_actions = max_concurrent_actions
+        self.loop: Optional[asyncio.AbstractEventLoop] = loop
+        self._owns_loop = loop is None
+        self._thread: Optional[Thread] = None
+        self._ready = Event()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._ids = itertools.count(1)
+        self._lock = Lock()
+        self._running: Dict[int, ActionHandle] = {}
+        # Tasks of the submitted actions, on a loop that is not owned only these are cancelled by 'stop'
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self):
+        if self._thread is not None or not self._owns_loop:
+            return
+        self._thread = Thread(target=self._run_loop, name="ActionExecutor", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """
+        Cancels all running actions, waits up to 'timeout' seconds until they finished (e.g. released the keys
+        they hold in 'finally' blocks) and stops the event loop. Returns whether all actions finished in time.
+        """
+        if not self._owns_loop:
+            if self.loop.is_closed():
+                return True
+            if not self.loop.is_running():
+                return self.loop.run_until_complete(self._cancel_tasks(timeout))
+            # Has to be called from another thread than the one running the loop
+            return asyncio.run_coroutine_threadsafe(self._cancel_tasks(timeout), self.loop).result()
+        if self._thread is None:
+            return True
+        drained = asyncio.run_coroutine_threadsafe(self._cancel_tasks(timeout), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+        return drained
+
+    async def _cancel_tasks(self, timeout: Optional[float] = None) -> bool:
+        if self._owns_loop:
+            # Also cancels tasks that were started by actions, e.g. with asyncio.create_task()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        else:
+            tasks = list(self._tasks)
+        if not tasks:
+            return True
+        for task in tasks:
+            task.cancel()
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning(f"{len(pending)} actions did not finish within {timeout} seconds after being cancelled")
+        return not pending
+
+    async def _limited(self, coroutine: Coroutine):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            if self.max_concurrent_actions is None:
+                return await coroutine
+            if self._semaphore is None:
+                # Created on the loop that runs the actions
+                self._semaphore = asyncio.Semaphore(self.max_concurrent_actions)
+            async with self._semaphore:
+                return await coroutine
+        finally:
+            self._tasks.discard(task)
+
+    def submit(self, coroutine: Coroutine, name: str = "") -> ActionHandle:
+        """ Schedules the coroutine on the executor loop. Can be called from any thread. """
+        assert self.loop is not None, f"Executor was not started"
+        future = asyncio.run_coroutine_threadsafe(self._limited(coroutine), self.loop)
+        handle = ActionHandle(next(self._ids), name, future)
+        with self._lock:
+            self._running[handle.action_id] = handle
+        future.add_done_callback(lambda _: self._on_done(handle))
+        return handle
+
+    def _on_done(self, handle: ActionHandle):
+        with self._lock:
+            self._running.pop(handle.action_id, None)
+        if handle.future.cancelled():
+            logger.info(f"Action was cancelled: {handle.name}")
+        elif handle.future.exception() is not None:
+            logger.opt(exception=handle.future.exception()).error(f"Action failed: {handle.name}")
+
+    @property
+    def running(self) -> List[ActionHandle]:
+        with self._lock:
+            return list(self._running.values())
+
+    def cancel(self, action_id: int) -> bool:
+        with self._lock:
+            handle = self._running.get(action_id)
+        return handle is not None and handle.cancel()
+
+    def cancel_all(self):
+        for handle in self.running:
+            handle.cancel()
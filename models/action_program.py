@@ -0,0 +1,63 @@
+from array import array
+from typing import List, Union, Iterator, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from models.keyboard_presser import TextAction
+    from models.other import KeyInfo, MouseInfo
+
+# Opcodes, every instruction is a pair of (opcode, operand) in an int array
+# Operand: milliseconds to wait
+SLEEP = 0
+# Operand: index into 'operands', press the KeyInfo as hotkey
+PRESS = 1
+# Operand: index into 'operands', hold the KeyInfo down for its duration
+HOLD = 2
+# Operand: index into 'operands', execute the MouseInfo
+MOUSE = 3
+# Operand: index into 'operands', type the text of the TextAction
+TYPE = 4
+
+# Repeat count of a program that runs until it is cancelled
+REPEAT_FOREVER = -1
+
+
+class ActionProgram:
+    """
+    Flat instruction form of an Action: the 'prelude' runs once, then the 'body' runs 'repeat' times.
+    Repetitions are stored as a count instead of being unrolled, so memory does not depend on the repeat amount.
+    """
+
+    __slots__ = ["prelude", "body", "repeat", "operands"]
+
+    def __init__(self):
+        self.prelude = array("i")
+        self.body = array("i")
+        self.repeat = 1
+        self.operands: List[Union["KeyInfo", "MouseInfo", "TextAction"]] = []
+
+    def add_operand(self, operand: Union["KeyInfo", "MouseInfo", "TextAction"]) -> int:
+        self.operands.append(operand)
+        return len(self.operands) - 1
+
+    @staticmethod
+    def emit(code: array, opcode: int, operand: int):
+        if opcode == SLEEP:
+            if operand == 0:
+                return
+            # Merge consecutive waits into one
+            if code and code[-2] == SLEEP:
+                code[-1] += operand
+                return
+        code.append(opcode)
+        code.append(operand)
+
+    @staticmethod
+    def instructions(code: array) -> Iterator[Tuple[int, int]]:
+        iterator = iter(code)
+        return zip(iterator, iterator)
+
+    def __repr__(self):
+        return (
+            f"ActionProgram(prelude={list(self.instructions(self.prelude))}, "
+            f"body={list(self.instructions(self.body))}, repeat={self.repeat})"
+        )
@@ -0,0 +1,527 @@
+"""
+Input injection backends.
+KeyboardPresser and MouseClicker do not talk to an input library directly but dispatch through the backend
+of the Manager, so the fastest backend can be chosen per deployment and the hot path can run headless.
+
+Key names are the ones used by 'KeyInfo' and pyautogui (e.g. "a", "ctrl", "space", "esc", "f1"),
+mouse buttons are "left", "middle" and "right".
+
+Input libraries are only imported when a backend is created. Backends that are created by name for the Manager
+are wrapped in a 'LazyBackend', which creates them on the injector thread once the keyboard listener is running.
+"""
+import sys
+import time
+from threading import Lock
+from typing import Optional, Tuple, List, Dict, Callable, Union, Type, NamedTuple
+
+MOUSE_BUTTONS = ["left", "middle", "right"]
+# Characters of a text that are typed with a named key
+TEXT_KEYS = {"\n": "enter", "\t": "tab", " ": "space"}
+PASTE_MODIFIER = "command" if sys.platform == "darwin" else "ctrl"
+# pyautogui key name -> name of the key in 'pynput.keyboard.Key' where they differ
+PYNPUT_KEY_NAMES = {
+    "command": "cmd",
+    "win": "cmd",
+    "winleft": "cmd_l",
+    "winright": "cmd_r",
+    "option": "alt",
+    "optionleft": "alt_l",
+    "optionright": "alt_r",
+    "altleft": "alt_l",
+    "altright": "alt_r",
+    "ctrlleft": "ctrl_l",
+    "ctrlright": "ctrl_r",
+    "shiftleft": "shift_l",
+    "shiftright": "shift_r",
+    "escape": "esc",
+    "return": "enter",
+    "del": "delete",
+    "pageup": "page_up",
+    "pgup": "page_up",
+    "pagedown": "page_down",
+    "pgdn": "page_down",
+    "capslock": "caps_lock",
+    "numlock": "num_lock",
+    "scrolllock": "scroll_lock",
+    "printscreen": "print_screen",
+    "prtsc": "print_screen",
+}
+# pynput key name -> pyautogui key name where they differ, for keys that were received by the keyboard listener
+PYAUTOGUI_KEY_NAMES = {
+    "cmd": PASTE_MODIFIER if PASTE_MODIFIER == "command" else "win",
+    "cmd_l": PASTE_MODIFIER if PASTE_MODIFIER == "command" else "winleft",
+    "cmd_r": PASTE_MODIFIER if PASTE_MODIFIER == "command" else "winright",
+    "alt_gr": "altright",
+    "page_up": "pageup",
+    "page_down": "pagedown",
+    "caps_lock": "capslock",
+    "num_lock": "numlock",
+    "scroll_lock": "scrolllock",
+    "print_screen": "printscreen",
+    "menu": "apps",
+    "media_play_pause": "playpause",
+    "media_next": "nexttrack",
+    "media_previous": "prevtrack",
+    "media_volume_up": "volumeup",
+    "media_volume_down": "volumedown",
+    "media_volume_mute": "volumemute",
+}
+
+
+def key_name_from_pynput(name: str) -> str:
+    """
+    Name of a key that was received from pynput as it is used by 'KeyInfo' and the backends.
+    Letters are lower case: shift (or caps lock) is a key event of its own.
+    """
+    if len(name) == 1:
+        return name.lower()
+    return PYAUTOGUI_KEY_NAMES.get(name, name)
+
+
+class InjectionBackend:
+    """ Base class of all backends. Subclasses have to implement key_down, key_up, mouse_down, mouse_up, move_to and position. """
+
+    name = ""
+
+    def load(self):
+        """ Imports and initializes everything that is needed to inject, called before the first injection. """
+
+    def key_down(self, key: str):
+        raise NotImplementedError
+
+    def key_up(self, key: str):
+        raise NotImplementedError
+
+    def mouse_down(self, button: str = "left"):
+        raise NotImplementedError
+
+    def mouse_up(self, button: str = "left"):
+        raise NotImplementedError
+
+    def move_to(self, x: int, y: int):
+        raise NotImplementedError
+
+    def position(self) -> Tuple[int, int]:
+        raise NotImplementedError
+
+    def scroll(self, dx: int, dy: int):
+        """ Scrolls dx steps to the right and dy steps up (negative values: left / down). """
+        raise NotImplementedError
+
+    def execute_batch(self, events: List[Tuple[str, tuple]]) -> list:
+        """
+        Executes events of the form (function name, arguments), e.g. ("key_down", ("ctrl",)), and returns their results.
+        Backends that can send multiple events at once override this.
+        """
+        return [getattr(self, function_name)(*args) for function_name, args in events]
+
+    def hotkey(self, *keys: str):
+        """ Presses the keys in order and releases them in reverse order. """
+        for key in keys:
+            self.key_down(key)
+        for key in reversed(keys):
+            self.key_up(key)
+
+    def click(self, button: str = "left", x: Optional[int] = None, y: Optional[int] = None, clicks: int = 1):
+        """ Clicks at the given coordinates, a coordinate that is 'None' stays at the current position. """
+        if x is not None or y is not None:
+            current_x, current_y = self.position()
+            self.move_to(current_x if x is None else x, current_y if y is None else y)
+        for _ in range(clicks):
+            self.mouse_down(button)
+            self.mouse_up(button)
+
+    def type_text(self, text: str):
+        """
+        Types the text as fast as the backend can. Backends that can not type every character (e.g. unicode)
+        paste those characters instead.
+        """
+        for char in text:
+            key = TEXT_KEYS.get(char, char)
+            self.key_down(key)
+            self.key_up(key)
+
+    def paste_text(self, text: str):
+        """ Puts the text on the clipboard and pastes it. """
+        import pyperclip
+
+        pyperclip.copy(text)
+        self.hotkey(PASTE_MODIFIER, "v")
+
+
+class PyAutoGuiBackend(InjectionBackend):
+    """
+    Uses pyautogui. pyautogui sleeps 'pyautogui.PAUSE' seconds after every call, this backend sets it to 'pause'.
+    'failsafe' keeps pyautogui's fail-safe: moving the mouse to a corner of the screen aborts the injection.
+    """
+
+    name = "pyautogui"
+
+    def __init__(self, pause: float = 0, failsafe: bool = True):
+        import pyautogui
+
+        self.pyautogui = pyautogui
+        pyautogui.PAUSE = pause
+        pyautogui.FAILSAFE = failsafe
+
+    def key_down(self, key: str):
+        self.pyautogui.keyDown(key)
+
+    def key_up(self, key: str):
+        self.pyautogui.keyUp(key)
+
+    def hotkey(self, *keys: str):
+        self.pyautogui.hotkey(*keys)
+
+    def mouse_down(self, button: str = "left"):
+        self.pyautogui.mouseDown(button=button)
+
+    def mouse_up(self, button: str = "left"):
+        self.pyautogui.mouseUp(button=button)
+
+    def move_to(self, x: int, y: int):
+        self.pyautogui.moveTo(x, y)
+
+    def position(self) -> Tuple[int, int]:
+        x, y = self.pyautogui.position()
+        return x, y
+
+    def scroll(self, dx: int, dy: int):
+        if dy:
+            self.pyautogui.scroll(dy)
+        if dx:
+            self.pyautogui.hscroll(dx)
+
+    def click(self, button: str = "left", x: Optional[int] = None, y: Optional[int] = None, clicks: int = 1):
+        self.pyautogui.click(x, y, clicks=clicks, button=button)
+
+    def type_text(self, text: str):
+        # pyautogui presses shift itself for upper case letters and symbols, but skips characters it does not know
+        for typeable, run in split_runs(text, self.pyautogui.isValidKey):
+            if typeable:
+                self.pyautogui.write(run)
+            else:
+                self.paste_text(run)
+
+
+class PynputBackend(InjectionBackend):
+    """ Uses the keyboard and mouse controllers of pynput, which does not sleep between events. """
+
+    name = "pynput"
+
+    def __init__(self):
+        from pynput import keyboard, mouse
+
+        self.keyboard = keyboard
+        self.keyboard_controller = keyboard.Controller()
+        self.mouse_controller = mouse.Controller()
+        self.buttons = {button: getattr(mouse.Button, button) for button in MOUSE_BUTTONS}
+        self._keys: Dict[str, object] = {}
+
+    def _key(self, key: str):
+        resolved = self._keys.get(key)
+        if resolved is None:
+            if len(key) == 1:
+                resolved = self.keyboard.KeyCode.from_char(key)
+            else:
+                resolved = self.keyboard.Key[PYNPUT_KEY_NAMES.get(key, key)]
+            self._keys[key] = resolved
+        return resolved
+
+    def key_down(self, key: str):
+        self.keyboard_controller.press(self._key(key))
+
+    def key_up(self, key: str):
+        self.keyboard_controller.release(self._key(key))
+
+    def mouse_down(self, button: str = "left"):
+        self.mouse_controller.press(self.buttons[button])
+
+    def mouse_up(self, button: str = "left"):
+        self.mouse_controller.release(self.buttons[button])
+
+    def move_to(self, x: int, y: int):
+        self.mouse_controller.position = (x, y)
+
+    def position(self) -> Tuple[int, int]:
+        x, y = self.mouse_controller.position
+        return int(x), int(y)
+
+    def scroll(self, dx: int, dy: int):
+        self.mouse_controller.scroll(dx, dy)
+
+    def type_text(self, text: str):
+        # Also types unicode characters
+        self.keyboard_controller.type(text)
+
+
+class XTestBackend(InjectionBackend):
+    """
+    Sends events directly to the X server with the XTest extension (Linux / X11 only).
+    This is the lowest level backend: there is no library in between that sleeps or checks anything.
+    """
+
+    name = "xtest"
+
+    KEYSYM_NAMES = {
+        "ctrl": "Control_L",
+        "alt": "Alt_L",
+        "shift": "Shift_L",
+        "esc": "Escape",
+        "enter": "Return",
+        "backspace": "BackSpace",
+        "tab": "Tab",
+    }
+    BUTTONS = {"left": 1, "middle": 2, "right": 3}
+    # Scroll directions are buttons in X11: (up, down, left, right)
+    SCROLL_BUTTONS = (4, 5, 6, 7)
+
+    def __init__(self, display_name: Optional[str] = None):
+        from Xlib import X, XK, display
+        from Xlib.ext import xtest
+
+        self.X = X
+        self.XK = XK
+        self.xtest = xtest
+        self.display = display.Display(display_name)
+        # While a batch is executed, events are only sent to the X server once at the end of the batch
+        self._batching = False
+        # key -> (keycode, needs shift)
+        self._keycodes: Dict[str, Tuple[int, bool]] = {}
+        self._shift_keycode = self._keycode("shift")[0]
+
+    def _keycode(self, key: str) -> Tuple[int, bool]:
+        resolved = self._keycodes.get(key)
+        if resolved is None:
+            if key.startswith("f") and key[1:].isdigit():
+                keysym_name = key.upper()
+            else:
+                keysym_name = self.KEYSYM_NAMES.get(key, key)
+            keysym = self.XK.string_to_keysym(keysym_name)
+            if keysym == 0 and len(key) == 1:
+                keysym = ord(key)
+            keycode = self.display.keysym_to_keycode(keysym)
+            assert keycode, f"Key can not be typed with the current keyboard layout: {key}"
+            # Upper case letters and symbols are on the second level of the key
+            needs_shift = self.display.keycode_to_keysym(keycode, 0) != keysym
+            resolved = keycode, needs_shift
+            self._keycodes[key] = resolved
+        return resolved
+
+    def flush(self):
+        if not self._batching:
+            self.display.sync()
+
+    def execute_batch(self, events: List[Tuple[str, tuple]]) -> list:
+        self._batching = True
+        try:
+            return super().execute_batch(events)
+        finally:
+            self._batching = False
+            self.display.sync()
+
+    def key_down(self, key: str):
+        keycode, needs_shift = self._keycode(key)
+        if needs_shift:
+            self.xtest.fake_input(self.display, self.X.KeyPress, self._shift_keycode)
+        self.xtest.fake_input(self.display, self.X.KeyPress, keycode)
+        self.flush()
+
+    def key_up(self, key: str):
+        keycode, needs_shift = self._keycode(key)
+        self.xtest.fake_input(self.display, self.X.KeyRelease, keycode)
+        if needs_shift:
+            self.xtest.fake_input(self.display, self.X.KeyRelease, self._shift_keycode)
+        self.flush()
+
+    def mouse_down(self, button: str = "left"):
+        self.xtest.fake_input(self.display, self.X.ButtonPress, self.BUTTONS[button])
+        self.flush()
+
+    def mouse_up(self, button: str = "left"):
+        self.xtest.fake_input(self.display, self.X.ButtonRelease, self.BUTTONS[button])
+        self.flush()
+
+    def move_to(self, x: int, y: int):
+        self.xtest.fake_input(self.display, self.X.MotionNotify, x=x, y=y)
+        self.flush()
+
+    def position(self) -> Tuple[int, int]:
+        pointer = self.display.screen().root.query_pointer()
+        return pointer.root_x, pointer.root_y
+
+    def _typeable(self, char: str) -> bool:
+        try:
+            self._keycode(TEXT_KEYS.get(char, char))
+        except AssertionError:
+            return False
+        return True
+
+    def type_text(self, text: str):
+        batching = self._batching
+        self._batching = True
+        try:
+            for typeable, run in split_runs(text, self._typeable):
+                if typeable:
+                    for char in run:
+                        key = TEXT_KEYS.get(char, char)
+                        self.key_down(key)
+                        self.key_up(key)
+                else:
+                    self.display.sync()
+                    self.paste_text(run)
+        finally:
+            self._batching = batching
+            self.flush()
+
+    def scroll(self, dx: int, dy: int):
+        up, down, left, right = self.SCROLL_BUTTONS
+        for button, steps in [(up if dy > 0 else down, abs(dy)), (right if dx > 0 else left, abs(dx))]:
+            for _ in range(steps):
+                self.xtest.fake_input(self.display, self.X.ButtonPress, button)
+                self.xtest.fake_input(self.display, self.X.ButtonRelease, button)
+        self.flush()
+
+
+class InjectedEvent(NamedTuple):
+    timestamp: float
+    # Name of the backend function, e.g. "key_down"
+    action: str
+    args: tuple
+
+
+class RecordingBackend(InjectionBackend):
+    """
+    Does not inject anything but stores every event with a timestamp in memory.
+    Used for tests and benchmarks without a display.
+    """
+
+    name = "recording"
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, screen_size: Tuple[int, int] = (1920, 1080)):
+        self.clock = clock
+        self.screen_size = screen_size
+        self.events: List[InjectedEvent] = []
+        self._position = (0, 0)
+
+    def clear(self):
+        self.events.clear()
+
+    def key_down(self, key: str):
+        self.events.append(InjectedEvent(self.clock(), "key_down", (key,)))
+
+    def key_up(self, key: str):
+        self.events.append(InjectedEvent(self.clock(), "key_up", (key,)))
+
+    def mouse_down(self, button: str = "left"):
+        self.events.append(InjectedEvent(self.clock(), "mouse_down", (button,)))
+
+    def mouse_up(self, button: str = "left"):
+        self.events.append(InjectedEvent(self.clock(), "mouse_up", (button,)))
+
+    def move_to(self, x: int, y: int):
+        self._position = (x, y)
+        self.events.append(InjectedEvent(self.clock(), "move_to", (x, y)))
+
+    def position(self) -> Tuple[int, int]:
+        return self._position
+
+    def scroll(self, dx: int, dy: int):
+        self.events.append(InjectedEvent(self.clock(), "scroll", (dx, dy)))
+
+    def paste_text(self, text: str):
+        self.events.append(InjectedEvent(self.clock(), "paste_text", (text,)))
+
+
+def split_runs(text: str, typeable: Callable[[str], bool]) -> List[Tuple[bool, str]]:
+    """ Splits the text into runs of characters that can be typed and runs that can not: [(typeable, run)]. """
+    flags = [typeable(char) for char in text]
+    runs: List[Tuple[bool, str]] = []
+    start = 0
+    for index in range(1, len(text) + 1):
+        if index == len(text) or flags[index] != flags[start]:
+            runs.append((flags[start], text[start:index]))
+            start = index
+    return runs
+
+
+class LazyBackend(InjectionBackend):
+    """
+    Creates the backend on first use or when 'load' is called, so importing the input library (e.g. pyautogui,
+    which also imports pyscreeze, pymsgbox, pytweening and possibly PIL) does not delay the start of the program.
+    """
+
+    def __init__(self, backend_class: Type[InjectionBackend]):
+        self.backend_class = backend_class
+        self.name = backend_class.name
+        self._backend: Optional[InjectionBackend] = None
+        self._lock = Lock()
+
+    def load(self) -> InjectionBackend:
+        backend = self._backend
+        if backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = self.backend_class()
+                backend = self._backend
+        return backend
+
+    @property
+    def loaded(self) -> bool:
+        return self._backend is not None
+
+    def key_down(self, key: str):
+        self.load().key_down(key)
+
+    def key_up(self, key: str):
+        self.load().key_up(key)
+
+    def mouse_down(self, button: str = "left"):
+        self.load().mouse_down(button)
+
+    def mouse_up(self, button: str = "left"):
+        self.load().mouse_up(button)
+
+    def move_to(self, x: int, y: int):
+        self.load().move_to(x, y)
+
+    def position(self) -> Tuple[int, int]:
+        return self.load().position()
+
+    def scroll(self, dx: int, dy: int):
+        self.load().scroll(dx, dy)
+
+    def execute_batch(self, events: List[Tuple[str, tuple]]) -> list:
+        return self.load().execute_batch(events)
+
+    def hotkey(self, *keys: str):
+        self.load().hotkey(*keys)
+
+    def click(self, button: str = "left", x: Optional[int] = None, y: Optional[int] = None, clicks: int = 1):
+        self.load().click(button, x, y, clicks)
+
+    def type_text(self, text: str):
+        self.load().type_text(text)
+
+    def paste_text(self, text: str):
+        self.load().paste_text(text)
+
+
+BACKENDS: Dict[str, Type[InjectionBackend]] = {
+    backend.name: backend for backend in [PyAutoGuiBackend, PynputBackend, XTestBackend, RecordingBackend]
+}
+
+
+def create_backend(backend: Union[str, InjectionBackend], lazy: bool = False) -> InjectionBackend:
+    """
+    Returns the backend instance, backends can be given by name (see BACKENDS).
+    lazy: a backend given by name is only created on first use, see 'LazyBackend'.
+    """
+    if isinstance(backend, InjectionBackend):
+        return backend
+    assert backend in BACKENDS, f"Unknown backend {backend}, has to be one of: {list(BACKENDS)}"
+    if backend == XTestBackend.name:
+        assert sys.platform.startswith("linux"), f"The xtest backend is only available on Linux"
+    if lazy:
+        return LazyBackend(BACKENDS[backend])
+    return BACKENDS[backend]()
@@ -0,0 +1,294 @@
+"""
+Loads hotkeys from a TOML or JSON config file instead of hard-coding them in 'main.py'.
+
+TOML example, JSON uses the same structure ({"hotkey": [{...}, ...]}):
+
+    [[hotkey]]
+    name = "select line"            # optional, defaults to the hotkey combination
+    hotkey = "alt+1"
+    start_delay = 1000              # optional: start_delay, repeat_delay, repeat_amount, toggled_state, priority, preempt
+    repeat_amount = 2
+    mouse = [{ click = "Left" }]    # fields of MouseInfo, 'click' is the name of a Click
+
+    [[hotkey]]
+    hotkey = "alt+f"
+    keys = [{ key = "f", duration = 10000 }]    # fields of KeyInfo
+    trigger = "long_press"          # optional for every entry: trigger, max_gap_ms, window_ms, hold_ms of Command
+    hold_ms = 800
+
+    [[hotkey]]
+    hotkey = "h,e,l,l,o"
+    text = " whats up buddy"        # typed by a TextAction, options: chars_per_second, paste_min_length
+
+    [[hotkey]]
+    hotkey = "alt+q"
+    script = "my_module:my_function"
+    run_in = "process"              # optional: "loop", "thread" or "process", see 'models.script_runner'
+    timeout = 5000                  # optional: milliseconds
+
+Parsing and validating is done once per config content: the result is written as JSON into a cache file named after
+the hash of the file content, so starting again with an unchanged config only reads it back. The cache holds plain
+data only and is only read if it belongs to the current user and nobody else can write to it.
+A 'ConfigWatcher' polls the file and applies changes while the program runs, see 'Manager.apply_config'.
+"""
+import hashlib
+import importlib
+import json
+import os
+from dataclasses import asdict
+from threading import Thread, Event
+from typing import List, Dict, Optional, Any, NamedTuple, Union, TYPE_CHECKING
+
+from loguru import logger
+
+from models.keyboard_presser import KeyboardAction, KeyboardCommand, TextAction
+from models.mouse_clicker import MouseAction, MouseCommand
+from models.other import KeyInfo, MouseInfo, Click, ScriptCommand, parse_hotkey_combination, TRIGGERS, TRIGGER_PRESS
+from models.script_runner import RUN_IN, LOOP
+
+if TYPE_CHECKING:
+    from models.manager import Manager
+
+# Change when the format of 'CommandSpec' changes, so old cache files are not used anymore
+CACHE_VERSION = b"3"
+ACTION_OPTIONS = {"start_delay", "repeat_delay", "repeat_amount", "toggled_state", "priority", "preempt"}
+TEXT_OPTIONS = {"chars_per_second", "paste_min_length"}
+SCRIPT_OPTIONS = {"start_delay", "run_in", "timeout"}
+# Options of the command instead of the action
+TRIGGER_OPTIONS = {"trigger", "max_gap_ms", "window_ms", "hold_ms"}
+ACTION_KINDS = ["mouse", "keys", "text", "script"]
+
+
+class CommandSpec(NamedTuple):
+    """ Validated form of one config entry, from which the command is built. """
+
+    name: str
+    combination: str
+    hotkeys: List[KeyInfo]
+    # One of ACTION_KINDS
+    kind: str
+    # List of MouseInfo or KeyInfo, the text or the import path of the script
+    actions: Union[List[MouseInfo], List[KeyInfo], str]
+    options: Dict[str, Any]
+    # Hash of the config entry, a command only needs to be rebuilt if this changes
+    fingerprint: str
+
+
+def _load_toml(data: bytes) -> dict:
+    try:
+        import tomllib
+    except ImportError:
+        # Python < 3.11
+        import tomli as tomllib
+    return tomllib.loads(data.decode())
+
+
+def parse_config(data: bytes, path: str) -> dict:
+    if path.endswith(".toml"):
+        return _load_toml(data)
+    return json.loads(data.decode())
+
+
+def compile_entry(entry: Dict[str, Any], require_hotkey: bool = True) -> CommandSpec:
+    """ require_hotkey: 'False' for actions that are only triggered directly, e.g. over 'models.control_server'. """
+    entry = dict(entry)
+    fingerprint = hashlib.sha256(json.dumps(entry, sort_keys=True).encode()).hexdigest()
+    combination = entry.pop("hotkey", None)
+    if require_hotkey or combination is not None:
+        assert isinstance(combination, str), f"Config entry needs a 'hotkey': {entry}"
+        hotkeys = parse_hotkey_combination(combination)
+    else:
+        combination, hotkeys = "", []
+    name = entry.pop("name", combination)
+
+    kinds = [kind for kind in ACTION_KINDS if kind in entry]
+    assert len(kinds) == 1, f"Config entry {name} needs exactly one of {ACTION_KINDS}, got {kinds}"
+    kind = kinds[0]
+    value = entry.pop(kind)
+    if kind == "mouse":
+        actions = [MouseInfo(**dict(info, click=Click[info.get("click", "Left")])) for info in value]
+    elif kind == "keys":
+        actions = [KeyInfo(**info) for info in value]
+        assert all(info.key for info in actions), f"Config entry {name} contains an empty key"
+    elif kind == "text":
+        assert isinstance(value, str) and value, f"Config entry {name} has no text"
+        actions = value
+    else:
+        assert ":" in value, f"Script of config entry {name} has to be given as 'module:function': {value}"
+        actions = value
+    if kind in ("mouse", "keys"):
+        assert actions, f"Config entry {name} has no actions"
+        assert all(info.delay >= 0 and info.duration >= 0 for info in actions), f"{name}: {actions}"
+
+    if kind == "script":
+        allowed = SCRIPT_OPTIONS
+        assert entry.get("run_in", LOOP) in RUN_IN, f"run_in of config entry {name} has to be one of: {RUN_IN}"
+    elif kind == "text":
+        allowed = ACTION_OPTIONS | TEXT_OPTIONS
+    else:
+        allowed = ACTION_OPTIONS
+    unknown = set(entry) - allowed - TRIGGER_OPTIONS
+    assert not unknown, f"Unknown options in config entry {name}: {unknown}"
+    assert entry.get("trigger", TRIGGER_PRESS) in TRIGGERS, f"trigger of config entry {name} has to be one of: {TRIGGERS}"
+    for option in ["start_delay", "repeat_delay", "repeat_amount", "timeout", "max_gap_ms", "window_ms", "hold_ms"]:
+        assert entry.get(option, 0) >= 0, f"{option} of config entry {name} has to be >= 0"
+    return CommandSpec(name, combination, hotkeys, kind, actions, entry, fingerprint)
+
+
+def compile_config(config: dict) -> List[CommandSpec]:
+    unknown = set(config) - {"hotkey"}
+    assert not unknown, f"Unknown sections in config: {unknown}"
+    specs = [compile_entry(entry) for entry in config.get("hotkey", [])]
+    names = [spec.name for spec in specs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    assert not duplicates, f"Command names have to be unique, add a 'name' to: {duplicates}"
+    return specs
+
+
+def _spec_to_json(spec: CommandSpec) -> dict:
+    actions = spec.actions
+    if spec.kind == "mouse":
+        actions = [dict(asdict(info), click=info.click.name) for info in actions]
+    elif spec.kind == "keys":
+        actions = [asdict(info) for info in actions]
+    return dict(spec._asdict(), hotkeys=[asdict(info) for info in spec.hotkeys], actions=actions)
+
+
+def _spec_from_json(data: dict) -> CommandSpec:
+    actions = data["actions"]
+    if data["kind"] == "mouse":
+        actions = [MouseInfo(**dict(info, click=Click[info["click"]])) for info in actions]
+    elif data["kind"] == "keys":
+        actions = [KeyInfo(**info) for info in actions]
+    hotkeys = [KeyInfo(**info) for info in data["hotkeys"]]
+    return CommandSpec(**dict(data, hotkeys=hotkeys, actions=actions))
+
+
+def _is_private(path: str) -> bool:
+    """ Whether the file belongs to the current user and nobody else may change it. """
+    if not hasattr(os, "getuid"):
+        return True
+    stat = os.stat(path)
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+def _read_cache(cache_path: str) -> Optional[List[CommandSpec]]:
+    try:
+        if not _is_private(os.path.dirname(cache_path)) or not _is_private(cache_path):
+            logger.warning(f"Ignoring config cache {cache_path}, it may be changed by other users")
+            return None
+        with open(cache_path, "rb") as f:
+            return [_spec_from_json(data) for data in json.loads(f.read().decode())]
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # Whatever fails to load (a truncated file, an outdated format, ...) is a cache miss,
+        # the config is compiled again and the cache file rewritten
+        return None
+
+
+def _write_cache(cache_dir: str, cache_path: str, specs: List[CommandSpec]):
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        # Write to a temporary file first, a concurrently started process never reads a partial cache file
+        temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(json.dumps([_spec_to_json(spec) for spec in specs]).encode())
+        os.replace(temporary_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write config cache {cache_path}: {e}")
+
+
+def load_config(path: str, cache_dir: Optional[str] = None) -> List[CommandSpec]:
+    """
+    Returns the compiled commands of a config file.
+    cache_dir: where compiled configs are cached, defaults to '.hotkey_cache' next to the config file.
+    Set to an empty string to disable the cache.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), ".hotkey_cache")
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, hashlib.sha256(CACHE_VERSION + data).hexdigest() + ".json")
+        specs = _read_cache(cache_path)
+        if specs is not None:
+            return specs
+
+    specs = compile_config(parse_config(data, path))
+    if cache_path is not None:
+        _write_cache(cache_dir, cache_path, specs)
+    return specs
+
+
+def _import_function(import_path: str):
+    module_name, function_name = import_path.split(":", 1)
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def build_command(manager: "Manager", spec: CommandSpec) -> Union[KeyboardCommand, MouseCommand, ScriptCommand]:
+    """ Creates the command of a compiled config entry, the hotkeys are already parsed. """
+    options = {key: value for key, value in spec.options.items() if key not in TRIGGER_OPTIONS}
+    if spec.kind == "script":
+        command = ScriptCommand(functions=[_import_function(spec.actions)], **options)
+    elif spec.kind == "mouse":
+        action = MouseAction(manager, mouse_actions=list(spec.actions), **options)
+        command = MouseCommand(mouse_action=action)
+    elif spec.kind == "text":
+        command = KeyboardCommand(keyboard_action=TextAction(manager, text=spec.actions, **options))
+    else:
+        action = KeyboardAction(manager, hotkeys_to_press=list(spec.actions), **options)
+        command = KeyboardCommand(keyboard_action=action)
+    command.name = spec.name
+    for option in TRIGGER_OPTIONS & set(spec.options):
+        setattr(command, option, spec.options[option])
+    return command
+
+
+class ConfigWatcher:
+    """ Polls a config file and applies it to the manager when it changed. """
+
+    def __init__(self, manager: "Manager", path: str, interval: float = 1.0, cache_dir: Optional[str] = None):
+        self.manager = manager
+        self.path = path
+        self.interval = interval
+        self.cache_dir = cache_dir
+        self._signature = self._stat()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="ConfigWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self) -> bool:
+        """ Applies the config if the file changed since the last check, returns whether it was applied. """
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            specs = load_config(self.path, self.cache_dir)
+        except Exception as e:
+            # Keep the current hotkeys while the file is being edited
+            logger.error(f"Could not reload config {self.path}: {e!r}")
+            return False
+        self.manager.apply_config(specs)
+        return True
@@ -0,0 +1,433 @@
+"""
+Local control API: other programs trigger and manage actions over a Unix socket instead of synthesizing key strokes.
+
+Every message is a frame: a 4 byte big-endian length, then that many bytes of UTF-8 JSON. A request is an object
+with an "op" and an "id" chosen by the client, the response carries the same id:
+
+    {"id": 1, "op": "trigger", "name": "select line"}   ->  {"id": 1, "ok": true, "result": {"action_id": 7}}
+    {"id": 2, "op": "trigger", "name": "nope"}          ->  {"id": 2, "ok": false, "error": "KeyError: ..."}
+
+    op          fields                                  result
+    ping                                                "pong"
+    list                                                registered commands: name, hotkey, kind, trigger
+    running                                             running actions: action_id, name
+    trigger     name, wait (optional)                   action_id, see below for "wait"
+    submit      actions, wait (optional)                action_ids of the ad-hoc actions, one per entry
+    cancel      action_id, or all = true                whether it was cancelled / how many were cancelled
+    stats       interval_ms (optional)                  metrics snapshot, streamed every interval_ms if given
+    unsubscribe stream                                  whether the stream with that request id was stopped
+
+"submit" takes entries in the config file format without "hotkey" (see 'models.config'), e.g.
+{"keys": [{"key": "c", "ctrl": true}]} or {"text": "hello"}. Scripts are not accepted over the socket.
+With "wait": true the response is sent when the actions are done, with "cancelled" and "error" per action.
+
+Connections are persistent and requests may be pipelined: a client can send many requests without waiting for the
+responses. Responses of requests that do not wait are sent in request order, all responses of the frames that
+arrived in one read are written at once. The server runs on its own thread and event loop, so requests never
+delay the actions. The socket file is only accessible by the user that started the program.
+"""
+import asyncio
+import getpass
+import itertools
+import json
+import os
+import socket
+import stat
+import struct
+import tempfile
+from collections import deque
+from threading import Thread, Event
+from typing import Any, Callable, Deque, Dict, List, Optional, TYPE_CHECKING, Union
+
+from loguru import logger
+
+from models.keyboard_presser import KeyboardCommand
+from models.mouse_clicker import MouseCommand
+from models.other import ScriptCommand
+
+if TYPE_CHECKING:
+    from models.action_executor import ActionHandle
+    from models.manager import Manager
+
+HEADER = struct.Struct(">I")
+# Larger frames close the connection
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+# Returned by a request handler that sends its response later
+DEFERRED = object()
+
+
+def default_socket_path() -> str:
+    # One socket per user, 'os.getuid' does not exist on every platform
+    user = os.getuid() if hasattr(os, "getuid") else getpass.getuser()
+    return os.path.join(tempfile.gettempdir(), f"auto-clicker-{user}.sock")
+
+
+def remove_stale_socket(path: str):
+    """
+    Removes a socket file that was left behind by a crashed run, it would make binding fail.
+    Raises FileExistsError if a running server still accepts connections on it, or if the path is not a socket.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    except FileNotFoundError:
+        return
+    finally:
+        probe.close()
+    raise FileExistsError(f"Another control server is already listening on {path}")
+
+
+def encode_frame(message: dict) -> bytes:
+    body = json.dumps(message, separators=(",", ":")).encode()
+    return HEADER.pack(len(body)) + body
+
+
+class ControlError(Exception):
+    """ The server answered a request with an error. """
+
+
+class _Connection(asyncio.Protocol):
+    def __init__(self, server: "ControlServer"):
+        self.server = server
+        self.transport: Optional[asyncio.Transport] = None
+        self._buffer = bytearray()
+        # Request id -> task that streams stats
+        self.streams: Dict[Any, asyncio.Task] = {}
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.server.connections.add(self)
+
+    def data_received(self, data: bytes):
+        buffer = self._buffer
+        buffer += data
+        responses = []
+        offset = 0
+        while len(buffer) - offset >= HEADER.size:
+            (length,) = HEADER.unpack_from(buffer, offset)
+            if length > MAX_FRAME_BYTES:
+                logger.warning(f"Closing control connection, frame of {length} bytes is too large")
+                self.transport.close()
+                return
+            end = offset + HEADER.size + length
+            if len(buffer) < end:
+                break
+            response = self.server.handle(self, bytes(buffer[offset + HEADER.size : end]))
+            offset = end
+            if response is not None:
+                responses.append(encode_frame(response))
+        del buffer[:offset]
+        if responses:
+            # Pipelined requests are answered with one write
+            self.transport.write(b"".join(responses))
+
+    def send(self, message: dict):
+        if not self.transport.is_closing():
+            self.transport.write(encode_frame(message))
+
+    def connection_lost(self, exc: Optional[Exception]):
+        for task in self.streams.values():
+            task.cancel()
+        self.streams.clear()
+        self.server.connections.discard(self)
+
+
+class ControlServer:
+    def __init__(self, manager: "Manager", path: Optional[str] = None):
+        """ path: of the Unix socket, defaults to 'default_socket_path()'. """
+        assert hasattr(socket, "AF_UNIX"), "The control server needs Unix sockets"
+        self.manager = manager
+        self.path = path or default_socket_path()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connections = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[Thread] = None
+        self._handlers: Dict[str, Callable[[_Connection, dict], Any]] = {
+            "ping": lambda connection, request: "pong",
+            "list": self._list,
+            "running": self._running,
+            "trigger": self._trigger,
+            "submit": self._submit,
+            "cancel": self._cancel,
+            "stats": self._stats,
+            "unsubscribe": self._unsubscribe,
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        started = Event()
+        errors: List[BaseException] = []
+        self._thread = Thread(target=self._run, args=(started, errors), name="ControlServer", daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            self._thread.join()
+            self._thread = None
+            raise errors[0]
+        logger.info(f"Control server listening on {self.path}")
+
+    def _run(self, started: Event, errors: List[BaseException]):
+        self.loop = loop = asyncio.new_event_loop()
+        try:
+            remove_stale_socket(self.path)
+            # Only the user that started the program may connect, the socket file is created with these permissions
+            umask = os.umask(0o077)
+            try:
+                self._server = loop.run_until_complete(loop.create_unix_server(lambda: _Connection(self), self.path))
+            finally:
+                os.umask(umask)
+        except BaseException as e:
+            errors.append(e)
+            loop.close()
+            started.set()
+            return
+        started.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def stop(self, timeout: Optional[float] = 1):
+        if self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    async def _close(self):
+        self._server.close()
+        streams = []
+        for connection in list(self.connections):
+            streams.extend(connection.streams.values())
+            connection.transport.close()
+        for task in streams:
+            task.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
+        # Lets the transports call 'connection_lost'
+        await asyncio.sleep(0)
+
+    def handle(self, connection: _Connection, body: bytes) -> Optional[dict]:
+        """ Answers one request, returns 'None' if the response is sent later. """
+        request_id = None
+        try:
+            request = json.loads(body)
+            request_id = request.get("id")
+            handler = self._handlers.get(request.get("op"))
+            if handler is None:
+                raise ValueError(f"Unknown op {request.get('op')!r}, has to be one of: {sorted(self._handlers)}")
+            result = handler(connection, request)
+        except Exception as e:
+            return {"id": request_id, "ok": False, "error": f"{type(e).__name__}: {e}"}
+        if result is DEFERRED:
+            return None
+        return {"id": request_id, "ok": True, "result": result}
+
+    def _list(self, connection: _Connection, request: dict) -> List[dict]:
+        with self.manager.lock:
+            commands = list(self.manager.commands)
+        return [
+            {
+                "name": command.name,
+                "hotkey": ",".join("+".join(hotkey.to_hotkey_list) for hotkey in command.hotkeys),
+                "kind": _kind(command),
+                "trigger": command.trigger,
+            }
+            for command in commands
+        ]
+
+    def _running(self, connection: _Connection, request: dict) -> List[dict]:
+        return [{"action_id": handle.action_id, "name": handle.name} for handle in self.manager.executor.running]
+
+    def _trigger(self, connection: _Connection, request: dict):
+        command = self.manager.find_command(request["name"])
+        if command is None:
+            raise KeyError(f"No command named {request['name']!r}")
+        handle = self.manager.trigger_command(command)
+        if request.get("wait"):
+            self._respond_when_done(connection, request.get("id"), [handle])
+            return DEFERRED
+        return {"action_id": handle.action_id}
+
+    def _submit(self, connection: _Connection, request: dict):
+        from models.config import build_command, compile_entry
+
+        # Requests come from outside the process: checked explicitly, asserts are removed by 'python -O'
+        entries = request["actions"]
+        if not isinstance(entries, list) or not entries:
+            raise ValueError(f"'actions' has to be a non-empty list of config entries: {entries!r}")
+        commands = []
+        for entry in entries:
+            if not isinstance(entry, dict):
+                raise ValueError(f"Submitted actions have to be config entries: {entry!r}")
+            if "script" in entry:
+                raise ValueError("Scripts can not be submitted over the control socket")
+            if "hotkey" in entry:
+                raise ValueError("Submitted actions have no hotkey, register them in the config instead")
+            spec = compile_entry(dict(entry), require_hotkey=False)
+            if spec.kind == "script":
+                raise ValueError("Scripts can not be submitted over the control socket")
+            commands.append(build_command(self.manager, spec))
+        # Validated before anything runs, a batch is submitted completely or not at all
+        handles = [self.manager.trigger_command(command) for command in commands]
+        if request.get("wait"):
+            self._respond_when_done(connection, request.get("id"), handles)
+            return DEFERRED
+        return {"action_ids": [handle.action_id for handle in handles]}
+
+    def _respond_when_done(self, connection: _Connection, request_id: Any, handles: List["ActionHandle"]):
+        futures = [asyncio.wrap_future(handle.future, loop=self.loop) for handle in handles]
+
+        def done(_):
+            results = []
+            for handle, future in zip(handles, futures):
+                cancelled = future.cancelled()
+                error = None if cancelled or future.exception() is None else repr(future.exception())
+                results.append({"action_id": handle.action_id, "cancelled": cancelled, "error": error})
+            connection.send({"id": request_id, "ok": True, "result": results})
+
+        asyncio.gather(*futures, return_exceptions=True).add_done_callback(done)
+
+    def _cancel(self, connection: _Connection, request: dict) -> Union[bool, int]:
+        executor = self.manager.executor
+        if request.get("all"):
+            running = executor.running
+            executor.cancel_all()
+            return len(running)
+        return executor.cancel(request["action_id"])
+
+    def stats(self) -> dict:
+        manager = self.manager
+        snapshot = manager.metrics.snapshot()
+        snapshot["running_actions"] = len(manager.executor.running)
+        snapshot["arbiter_waiting"] = manager.arbiter.waiting
+        snapshot["key_queue"] = manager.keyboard_listener.queue_stats
+        return snapshot
+
+    def _stats(self, connection: _Connection, request: dict):
+        interval_ms = request.get("interval_ms")
+        if interval_ms is None:
+            return self.stats()
+        if not isinstance(interval_ms, (int, float)) or interval_ms <= 0:
+            raise ValueError(f"'interval_ms' has to be a positive number: {interval_ms!r}")
+        request_id = request.get("id")
+        if request_id in connection.streams:
+            raise ValueError(f"Stream {request_id} already exists")
+        connection.streams[request_id] = self.loop.create_task(self._stream(connection, request_id, interval_ms / 1000))
+        return DEFERRED
+
+    async def _stream(self, connection: _Connection, request_id: Any, interval: float):
+        while True:
+            connection.send({"id": request_id, "ok": True, "stream": True, "result": self.stats()})
+            await asyncio.sleep(interval)
+
+    def _unsubscribe(self, connection: _Connection, request: dict) -> bool:
+        task = connection.streams.pop(request["stream"], None)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+
+def _kind(command: Union[KeyboardCommand, MouseCommand, ScriptCommand]) -> str:
+    if isinstance(command, KeyboardCommand):
+        return "keyboard"
+    if isinstance(command, MouseCommand):
+        return "mouse"
+    return "script"
+
+
+class ControlClient:
+    """
+    Blocking client of the control server, e.g. for orchestration scripts:
+
+        with ControlClient(path) as client:
+            client.request("trigger", name="select line")
+            # Pipelined: send everything, then collect the responses
+            request_ids = client.send_many([("trigger", {"name": "click"})] * 1000)
+            responses = [client.receive(request_id) for request_id in request_ids]
+    """
+
+    def __init__(self, path: Optional[str] = None, timeout: Optional[float] = 10):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(path or default_socket_path())
+        self._ids = itertools.count(1)
+        self._buffer = bytearray()
+        # Messages that arrived while waiting for the message of another request, by request id
+        self._received: Dict[Any, Deque[dict]] = {}
+
+    def send(self, op: str, **fields) -> int:
+        """ Sends a request without waiting for the response, returns its id. """
+        return self.send_many([(op, fields)])[0]
+
+    def send_many(self, requests: List[tuple]) -> List[int]:
+        """ Sends (op, fields) requests with one write, returns their ids. """
+        request_ids = []
+        frames = []
+        for op, fields in requests:
+            request_id = next(self._ids)
+            request_ids.append(request_id)
+            frames.append(encode_frame(dict(fields, id=request_id, op=op)))
+        self.socket.sendall(b"".join(frames))
+        return request_ids
+
+    def receive(self, request_id: Optional[int] = None) -> dict:
+        """ Returns the next message, or the next message of the request 'request_id' (e.g. of a stats stream). """
+        if request_id is None:
+            for request_id, messages in self._received.items():
+                if messages:
+                    return messages.popleft()
+            return self._read_message()
+        messages = self._received.get(request_id)
+        if messages:
+            return messages.popleft()
+        while True:
+            message = self._read_message()
+            if message.get("id") == request_id:
+                return message
+            self._received.setdefault(message.get("id"), deque()).append(message)
+
+    def request(self, op: str, **fields) -> Any:
+        """ Sends a request and returns its result, raises ControlError if the server answered with an error. """
+        message = self.receive(self.send(op, **fields))
+        if not message["ok"]:
+            raise ControlError(message["error"])
+        return message["result"]
+
+    def _read_message(self) -> dict:
+        while True:
+            if len(self._buffer) >= HEADER.size:
+                (length,) = HEADER.unpack_from(self._buffer)
+                end = HEADER.size + length
+                if len(self._buffer) >= end:
+                    message = json.loads(bytes(self._buffer[HEADER.size : end]))
+                    del self._buffer[:end]
+                    return message
+            data = self.socket.recv(65536)
+            if not data:
+                raise ConnectionError("Control server closed the connection")
+            self._buffer += data
+
+    def close(self):
+        self.socket.close()
+
+    def __enter__(self) -> "ControlClient":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,151 @@
+"""
+Compact binary journal of key and injection events.
+Every event is one fixed size record, so a journal can be read by offset (e.g. memory-mapped) without parsing.
+
+File layout: HEADER (magic, record size) followed by records of RECORD:
+    timestamp   int64   time.perf_counter_ns(), the clock of the key event queue (see 'models.event_queue')
+    kind        uint8   one of the EventKind values, INJECTED is set for events sent by this program
+    modifiers   uint8   bitmask of 'models.key_codes.MODIFIER_BITS'
+    x, y        int32   mouse coordinates (or scroll amount), 0 for key events
+    key         16s     utf-8 key name or mouse button, zero padded
+"""
+import enum
+import mmap
+import struct
+import time
+from queue import SimpleQueue
+from threading import Thread
+from typing import Callable, Optional, Iterator, NamedTuple
+
+from models.key_codes import modifier_mask, key_name, MODIFIER_MASK
+
+MAGIC = b"ACJ1"
+HEADER = struct.Struct("<4sI")
+RECORD = struct.Struct("<qBBxxii16s")
+
+INJECTED = 0x80
+
+
+class EventKind(enum.IntEnum):
+    KeyPress = 1
+    KeyRelease = 2
+    MouseMove = 3
+    MouseDown = 4
+    MouseUp = 5
+    MouseScroll = 6
+    # A whole hotkey was injected (key contains e.g. "ctrl+v")
+    Hotkey = 7
+    Click = 8
+    # A text was typed or pasted (key contains the start of the text, x its length)
+    Text = 9
+
+
+# Injection backend function -> kind of the journal record
+INJECTION_KINDS = {
+    "key_down": EventKind.KeyPress,
+    "key_up": EventKind.KeyRelease,
+    "move_to": EventKind.MouseMove,
+    "mouse_down": EventKind.MouseDown,
+    "mouse_up": EventKind.MouseUp,
+    "hotkey": EventKind.Hotkey,
+    "click": EventKind.Click,
+    "scroll": EventKind.MouseScroll,
+    "type_text": EventKind.Text,
+    "paste_text": EventKind.Text,
+}
+
+
+class JournalRecord(NamedTuple):
+    timestamp: int
+    kind: int
+    modifiers: int
+    x: int
+    y: int
+    key: str
+
+    @property
+    def injected(self) -> bool:
+        return bool(self.kind & INJECTED)
+
+    @property
+    def event_kind(self) -> EventKind:
+        return EventKind(self.kind & ~INJECTED)
+
+
+def pack_record(kind: int, key: str = "", modifiers: int = 0, x: int = 0, y: int = 0, timestamp: Optional[int] = None) -> bytes:
+    if timestamp is None:
+        timestamp = time.perf_counter_ns()
+    # Truncated to whole utf-8 characters
+    encoded = key.encode()[:16].decode(errors="ignore").encode()
+    return RECORD.pack(timestamp, kind, modifiers, x, y, encoded)
+
+
+class EventJournal:
+    """
+    Appends records to a journal file. Writing happens on a background thread, callers only pack the record
+    and put it on a queue, so journaling does not block the keyboard hook or the injector.
+    """
+
+    def __init__(self, path: str, clock: Callable[[], int] = time.perf_counter_ns):
+        """ clock: nanoseconds of the records that are written without a timestamp, e.g. 'Manager.clock_ns'. """
+        self.path = path
+        self.clock = clock
+        self._queue: SimpleQueue = SimpleQueue()
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, RECORD.size))
+        self._thread = Thread(target=self._write, name="EventJournal", daemon=True)
+        self._thread.start()
+
+    def _write(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            self._file.write(record)
+        self._file.close()
+
+    def write(self, kind: int, key: str = "", modifiers: int = 0, x: int = 0, y: int = 0, timestamp: Optional[int] = None):
+        self._queue.put(pack_record(kind, key, modifiers, x, y, self.clock() if timestamp is None else timestamp))
+
+    def write_key(self, kind: EventKind, key: str, ctrl: Optional[bool], alt: Optional[bool], shift: Optional[bool]):
+        self._queue.put(pack_record(kind, key, modifier_mask(ctrl, alt, shift), timestamp=self.clock()))
+
+    def write_code(self, kind: EventKind, code: int, timestamp: Optional[int] = None):
+        """ Journals a key event given as key code (see 'models.key_codes'). """
+        if timestamp is None:
+            timestamp = self.clock()
+        self._queue.put(pack_record(kind, key_name(code), code & MODIFIER_MASK, timestamp=timestamp))
+
+    def write_injection(self, function_name: str, args: tuple):
+        """ Journals one event of the Injector, e.g. ("key_down", ("ctrl",)). """
+        kind = INJECTION_KINDS.get(function_name)
+        if kind is None:
+            return
+        timestamp = self.clock()
+        if kind in (EventKind.MouseMove, EventKind.MouseScroll):
+            self._queue.put(pack_record(kind | INJECTED, x=args[0], y=args[1], timestamp=timestamp))
+        elif kind == EventKind.Text:
+            self._queue.put(pack_record(kind | INJECTED, args[0][:16], x=len(args[0]), timestamp=timestamp))
+        elif kind == EventKind.Hotkey:
+            self._queue.put(pack_record(kind | INJECTED, "+".join(args), timestamp=timestamp))
+        elif kind == EventKind.Click:
+            button, x, y = (list(args) + ["left", None, None])[:3]
+            self._queue.put(pack_record(kind | INJECTED, button, x=x or 0, y=y or 0, timestamp=timestamp))
+        else:
+            self._queue.put(pack_record(kind | INJECTED, args[0] if args else "left", timestamp=timestamp))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+def read_journal(path: str) -> Iterator[JournalRecord]:
+    """ Iterates the records of a journal file, the file is memory-mapped and not loaded into memory. """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, record_size = HEADER.unpack_from(data, 0)
+            assert magic == MAGIC, f"Not an event journal: {path}"
+            assert record_size == RECORD.size, f"Unsupported record size {record_size}"
+            for offset in range(HEADER.size, len(data) - record_size + 1, record_size):
+                timestamp, kind, modifiers, x, y, key = RECORD.unpack_from(data, offset)
+                yield JournalRecord(timestamp, kind, modifiers, x, y, key.rstrip(b"\0").decode())
@@ -0,0 +1,98 @@
+"""
+Bounded single-producer single-consumer queue of integer events, used to hand key events from the OS hook thread
+over to the matcher worker (see 'models.keyboard_listener').
+
+The slots are preallocated arrays, pushing an event only writes two slots and moves the tail index, no lock is taken
+and nothing is allocated. The producer only writes the tail, the consumer only writes the head, so with one thread on
+each side the indices need no lock (assignments of ints are atomic in CPython).
+The consumer is only woken up with an Event when it actually sleeps, a busy consumer costs the producer nothing.
+
+Overflow policy: when the queue is full, the newest event is dropped and counted in 'dropped'. The hook callback
+must never block, and the events already queued are older and have to be handled first.
+"""
+import time
+from array import array
+from threading import Event
+from typing import List, Optional, Tuple
+
+
+class SpscQueue:
+    def __init__(self, capacity: int = 4096):
+        assert capacity > 0 and capacity & (capacity - 1) == 0, f"Capacity has to be a power of two: {capacity}"
+        self.capacity = capacity
+        self._mask = capacity - 1
+        self._events = array("q", [0] * capacity)
+        # time.perf_counter_ns() of each event
+        self._timestamps = array("q", [0] * capacity)
+        # Index of the next event to read, only written by the consumer
+        self._head = 0
+        # Index of the next free slot, only written by the producer
+        self._tail = 0
+        self._wakeup = Event()
+        self._consumer_waiting = False
+        self.closed = False
+        # Statistics
+        self.pushed = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def push(self, event: int, timestamp: Optional[int] = None) -> bool:
+        """ Called by the producer. Returns 'False' if the event was dropped because the queue is full. """
+        tail = self._tail
+        depth = tail - self._head
+        if depth >= self.capacity:
+            self.dropped += 1
+            return False
+        index = tail & self._mask
+        self._events[index] = event
+        self._timestamps[index] = time.perf_counter_ns() if timestamp is None else timestamp
+        # Publish the slot only after it was written
+        self._tail = tail + 1
+        self.pushed += 1
+        if depth >= self.high_water:
+            self.high_water = depth + 1
+        if self._consumer_waiting:
+            self._wakeup.set()
+        return True
+
+    def pop_batch(self, max_events: int = 256) -> Tuple[List[int], List[int]]:
+        """ Called by the consumer. Returns up to 'max_events' events and their timestamps, oldest first. """
+        head = self._head
+        amount = min(self._tail - head, max_events)
+        if amount <= 0:
+            return [], []
+        start = head & self._mask
+        end = start + amount
+        if end <= self.capacity:
+            events = self._events[start:end].tolist()
+            timestamps = self._timestamps[start:end].tolist()
+        else:
+            # The batch wraps around the end of the slots
+            end -= self.capacity
+            events = self._events[start:].tolist() + self._events[:end].tolist()
+            timestamps = self._timestamps[start:].tolist() + self._timestamps[:end].tolist()
+        # Free the slots only after they were read
+        self._head = head + amount
+        return events, timestamps
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """ Called by the consumer. Sleeps until an event arrives or the queue is closed. """
+        if self._tail != self._head:
+            return True
+        self._wakeup.clear()
+        self._consumer_waiting = True
+        try:
+            # An event that was pushed before the flag was set did not wake us up, check again
+            if self._tail == self._head and not self.closed:
+                self._wakeup.wait(timeout)
+        finally:
+            self._consumer_waiting = False
+        return self._tail != self._head
+
+    def close(self):
+        """ Wakes up the consumer, it drains the remaining events and stops. """
+        self.closed = True
+        self._wakeup.set()
+
+    def __len__(self) -> int:
+        return self._tail - self._head
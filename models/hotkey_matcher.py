@@ -0,0 +1,203 @@
+from collections import deque
+from itertools import product
+from typing import Deque, Dict, List, Optional, Tuple, FrozenSet, TYPE_CHECKING
+
+from loguru import logger
+
+from models import key_codes
+from models.other import KeyInfo
+
+if TYPE_CHECKING:
+    from models.other import Command
+
+# A symbol of a registered hotkey: (key, ctrl, alt, shift), a modifier of 'None' matches both states
+PatternSymbol = Tuple[str, Optional[bool], Optional[bool], Optional[bool]]
+# A symbol of a pressed key: (key, ctrl, alt, shift), modifiers are always set. Pressed keys are fed to the matcher
+# as key codes (see 'models.key_codes') and only decoded to symbols when a transition is computed for the first time
+EventSymbol = Tuple[str, bool, bool, bool]
+# The automaton may cache this many states per trie node before it is reset. A state is mostly determined by its
+# deepest trie node, so the reachable states grow with the trie and a fixed limit would reset it over and over
+STATES_PER_TRIE_NODE = 2
+
+
+def pattern_symbol(key_info: KeyInfo) -> PatternSymbol:
+    return key_info.key, key_info.ctrl, key_info.alt, key_info.shift
+
+
+def matching_pattern_symbols(symbol: EventSymbol) -> List[PatternSymbol]:
+    """ All pattern symbols that a pressed key can match: every modifier may also be the wildcard 'None'. """
+    key, ctrl, alt, shift = symbol
+    return [(key, c, a, s) for c, a, s in product((ctrl, None), (alt, None), (shift, None))]
+
+
+class _TrieNode:
+    def __init__(self, node_id: int, depth: int):
+        self.node_id = node_id
+        self.depth = depth
+        self.children: Dict[PatternSymbol, "_TrieNode"] = {}
+        # Commands whose hotkey combination ends in this node
+        self.commands: List["Command"] = []
+
+
+class HotkeyMatcher:
+    """
+    Matches pressed keys against all registered hotkey combinations at once.
+
+    The hotkey combinations are stored in a trie. Because modifiers of a hotkey may be 'None' (wildcard),
+    a pressed key can advance several partial matches at the same time, so the matcher state is the set of
+    trie nodes that are currently reached. These sets are interned as states of a lazily built DFA: the
+    transition for a (state, pressed key) pair is computed once and then cached, so every further key press
+    is a single dict lookup.
+
+    The amount of cached states is bounded by 'max_cached_states' or 'STATES_PER_TRIE_NODE' per trie node,
+    whichever is larger, so registering many hotkeys does not make the automaton reset on every few key presses.
+    """
+
+    def __init__(self, max_cached_states: int = 10000):
+        self.max_cached_states = max_cached_states
+        self._nodes: List[_TrieNode] = []
+        # Nodes that were pruned by 'remove' stay in '_nodes', only the others count for the state limit
+        self._live_nodes = 0
+        self._root = self._new_node(0)
+        # Registration order of commands, used to trigger commands in the order they were added
+        self._command_order: Dict[int, int] = {}
+        # Registered combinations by their last key, only these can overlap with each other
+        self._patterns: Dict[str, List[Tuple[List[KeyInfo], "Command"]]] = {}
+        # The last key codes that were fed, as many as the longest combination has keys. The state is re-derived from
+        # them when the automaton was rebuilt, so partially typed combinations survive adding and removing commands
+        self._recent_codes: Deque[int] = deque(maxlen=1)
+        self._stale = False
+        self._reset_automaton()
+
+    def _new_node(self, depth: int) -> _TrieNode:
+        node = _TrieNode(len(self._nodes), depth)
+        self._nodes.append(node)
+        self._live_nodes += 1
+        return node
+
+    @property
+    def state_limit(self) -> int:
+        return max(self.max_cached_states, STATES_PER_TRIE_NODE * self._live_nodes)
+
+    def _reset_automaton(self):
+        # DFA states: each state is a set of trie node ids, the root is always part of a state
+        self._state_ids: Dict[FrozenSet[int], int] = {}
+        self._states: List[FrozenSet[int]] = []
+        # (state, key code) -> next state
+        self._transitions: Dict[Tuple[int, int], int] = {}
+        self._matches: List[List["Command"]] = []
+        self.state = self._intern_state(frozenset([self._root.node_id]))
+
+    def _intern_state(self, nodes: FrozenSet[int]) -> int:
+        state = self._state_ids.get(nodes)
+        if state is None:
+            state = len(self._states)
+            self._state_ids[nodes] = state
+            self._states.append(nodes)
+            commands = [command for node_id in nodes for command in self._nodes[node_id].commands]
+            commands.sort(key=lambda command: self._command_order[id(command)])
+            self._matches.append(commands)
+        return state
+
+    def _compute_transition(self, state: int, code: int) -> int:
+        next_nodes = {self._root.node_id}
+        candidates = matching_pattern_symbols(key_codes.decode(code))
+        for node_id in self._states[state]:
+            children = self._nodes[node_id].children
+            for candidate in candidates:
+                child = children.get(candidate)
+                if child is not None:
+                    next_nodes.add(child.node_id)
+        return self._intern_state(frozenset(next_nodes))
+
+    def add(self, hotkeys: List[KeyInfo], command: "Command"):
+        """ Registers a parsed hotkey combination and warns about duplicate or overlapping combinations. """
+        assert hotkeys, f"Hotkey combination is empty"
+        self._report_conflicts(hotkeys, command)
+        node = self._root
+        for depth, key_info in enumerate(hotkeys, start=1):
+            symbol = pattern_symbol(key_info)
+            child = node.children.get(symbol)
+            if child is None:
+                child = self._new_node(depth)
+                node.children[symbol] = child
+            node = child
+        node.commands.append(command)
+        self._command_order[id(command)] = len(self._command_order)
+        self._patterns.setdefault(hotkeys[-1].key, []).append((hotkeys, command))
+        if len(hotkeys) > self._recent_codes.maxlen:
+            self._recent_codes = deque(self._recent_codes, maxlen=len(hotkeys))
+        # New combinations change the transitions, the automaton will be rebuilt lazily
+        self._stale = True
+
+    def remove(self, command: "Command"):
+        """ Unregisters a command that was added with 'add'. """
+        hotkeys = command.hotkeys
+        path = [self._root]
+        for key_info in hotkeys:
+            path.append(path[-1].children[pattern_symbol(key_info)])
+        path[-1].commands.remove(command)
+        del self._command_order[id(command)]
+        patterns = self._patterns[hotkeys[-1].key]
+        patterns[:] = [(other_hotkeys, other) for other_hotkeys, other in patterns if other is not command]
+        # Prune trie nodes that no longer lead to any command
+        for depth in range(len(hotkeys), 0, -1):
+            node = path[depth]
+            if node.commands or node.children:
+                break
+            del path[depth - 1].children[pattern_symbol(hotkeys[depth - 1])]
+            self._live_nodes -= 1
+        self._stale = True
+
+    def _rebuild(self):
+        """ Rebuilds the automaton after commands changed and re-derives the state from the recently fed keys. """
+        self._stale = False
+        self._reset_automaton()
+        for code in self._recent_codes:
+            self.state = self._transition(self.state, code)
+
+    def _report_conflicts(self, hotkeys: List[KeyInfo], command: "Command"):
+        for other_hotkeys, other_command in self._patterns.get(hotkeys[-1].key, []):
+            # Two combinations overlap if the shorter one matches the end of the longer one
+            if not all(a == b for a, b in zip(reversed(hotkeys), reversed(other_hotkeys))):
+                continue
+            if len(hotkeys) == len(other_hotkeys):
+                logger.warning(f"Duplicate hotkey combination {hotkeys}: already used by {other_command}")
+            else:
+                logger.warning(
+                    f"Hotkey combination {hotkeys} overlaps with {other_hotkeys} of {other_command}, both may trigger on the same key press"
+                )
+
+    def feed(self, key_info: KeyInfo) -> List["Command"]:
+        """ Advances the matcher by one pressed key and returns the commands that were triggered by it. """
+        return self.feed_code(key_info.code)
+
+    def feed_code(self, code: int) -> List["Command"]:
+        """ Same as 'feed' for a key code (see 'models.key_codes'). """
+        if self._stale:
+            self._rebuild()
+        self._recent_codes.append(code)
+        next_state = self._transitions.get((self.state, code))
+        if next_state is None:
+            next_state = self._transition(self.state, code)
+        self.state = next_state
+        return self._matches[next_state]
+
+    def _transition(self, state: int, code: int) -> int:
+        next_state = self._transitions.get((state, code))
+        if next_state is None:
+            if len(self._states) > self.state_limit:
+                # Keep memory bounded if many different keys were pressed
+                current_nodes = self._states[state]
+                self._reset_automaton()
+                state = self._intern_state(current_nodes)
+            next_state = self._compute_transition(state, code)
+            self._transitions[(state, code)] = next_state
+        return next_state
+
+    def reset(self):
+        """ Forgets all partially typed hotkey combinations. """
+        self._recent_codes.clear()
+        if self._stale:
+            self._rebuild()
+        self.state = self._intern_state(frozenset([self._root.node_id]))
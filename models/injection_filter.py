@@ -0,0 +1,147 @@
+"""
+Tells apart key events that were injected by this program from the user's key events.
+
+The injector registers every key event right before it is sent to the backend as expected, by key and direction.
+When the listener receives a key event that is expected, the expectation is consumed and the event is ignored.
+Expectations expire after 'ttl_ms', e.g. if the listener does not see injected events (no listener running,
+key was remapped), so they can not swallow a later key press of the user.
+Key presses of the user are only mistaken for injected ones if the same key is pressed in the same direction
+while an injected event of that key is still on its way.
+
+Where the listener tells whether an event was injected (pynput passes 'injected' on some platforms),
+that information is used instead of the expectations.
+"""
+import time
+from collections import OrderedDict, deque
+from threading import Lock
+from typing import Callable, Deque, Dict, List, Tuple
+
+from models.backends import PASTE_MODIFIER, TEXT_KEYS
+from models.key_codes import MODIFIER_BITS
+
+# (pressed, key name)
+ExpectedEvent = Tuple[bool, str]
+# Characters that are typed with shift on a US keyboard layout
+SHIFTED_CHARS = set('~!@#$%^&*()_+{}|:"<>?')
+
+
+def normalize_key(key: str) -> str:
+    """
+    Key names of the listener and of the backends differ in case and in modifier names, e.g. "Ctrl_L" and "ctrl".
+    Characters keep their case: an injected "A" is received as "A", a user's "a" must not be mistaken for it.
+    """
+    if len(key) > 1:
+        key = key.lower()
+    if key.startswith("cmd"):
+        return "command"
+    for modifier in MODIFIER_BITS:
+        if key.startswith(modifier):
+            return modifier
+    return key
+
+
+class SelfInjectionFilter:
+    def __init__(self, ttl_ms: float = 1000, max_expected: int = 10000, clock: Callable[[], float] = time.monotonic):
+        assert ttl_ms > 0, f"{ttl_ms}"
+        assert max_expected > 0, f"{max_expected}"
+        self.ttl = ttl_ms / 1000
+        self.max_expected = max_expected
+        self.clock = clock
+        # Expected event -> ids of its expectations, oldest first
+        self._expected: Dict[ExpectedEvent, Deque[int]] = {}
+        # Id -> (expected event, expiry time) of all expectations, oldest first. All expectations live for the same
+        # time, so this is also ordered by expiry and expired or evicted expectations are always taken from the front
+        self._order: "OrderedDict[int, Tuple[ExpectedEvent, float]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = Lock()
+        # Statistics
+        self.consumed = 0
+        # Expectations that were dropped after 'ttl_ms'
+        self.expired = 0
+        # Expectations that were dropped because there were more than 'max_expected'
+        self.evicted = 0
+
+    def expect(self, events: List[ExpectedEvent]):
+        """ Registers key events that are about to be injected. """
+        now = self.clock()
+        expiry = now + self.ttl
+        with self._lock:
+            self._expire(now)
+            for event in events:
+                expectation_id = self._next_id
+                self._next_id += 1
+                self._order[expectation_id] = (event, expiry)
+                expectation_ids = self._expected.get(event)
+                if expectation_ids is None:
+                    expectation_ids = self._expected[event] = deque()
+                expectation_ids.append(expectation_id)
+            # Too many: drop the oldest expectations, they are the most likely to never arrive
+            if len(self._order) > self.max_expected:
+                evicted = len(self._order) - self.max_expected
+                self._drop_oldest(evicted)
+                self.evicted += evicted
+
+    def expect_injection(self, injection_events: List[Tuple[str, tuple]]):
+        """ Registers the key events that the injection events (see 'models.injector') will cause. """
+        events = []
+        for function_name, args in injection_events:
+            if function_name == "key_down":
+                events.append((True, normalize_key(args[0])))
+            elif function_name == "key_up":
+                events.append((False, normalize_key(args[0])))
+            elif function_name == "hotkey":
+                keys = [normalize_key(key) for key in args]
+                events.extend((True, key) for key in keys)
+                events.extend((False, key) for key in reversed(keys))
+            elif function_name == "type_text":
+                for char in args[0]:
+                    key = normalize_key(TEXT_KEYS.get(char, char))
+                    if char in SHIFTED_CHARS or char != char.lower():
+                        events.extend([(True, "shift"), (True, key), (False, key), (False, "shift")])
+                    else:
+                        events.extend([(True, key), (False, key)])
+            elif function_name == "paste_text":
+                modifier = normalize_key(PASTE_MODIFIER)
+                events.extend([(True, modifier), (True, "v"), (False, "v"), (False, modifier)])
+        if events:
+            self.expect(events)
+
+    def consume(self, pressed: bool, key: str) -> bool:
+        """ Returns whether the key event that the listener received was injected. """
+        event = (pressed, normalize_key(key))
+        with self._lock:
+            if event not in self._expected:
+                return False
+            self._expire(self.clock())
+            expectation_ids = self._expected.get(event)
+            if expectation_ids is None:
+                return False
+            del self._order[expectation_ids.popleft()]
+            if not expectation_ids:
+                del self._expected[event]
+            self.consumed += 1
+            return True
+
+    def _expire(self, now: float):
+        order = self._order
+        expired = 0
+        for event, expiry in order.values():
+            if expiry >= now:
+                break
+            expired += 1
+        if expired:
+            self._drop_oldest(expired)
+            self.expired += expired
+
+    def _drop_oldest(self, amount: int):
+        order = self._order
+        for _ in range(amount):
+            _, (event, _) = order.popitem(last=False)
+            # The oldest expectation is also the oldest of its event
+            expectation_ids = self._expected[event]
+            expectation_ids.popleft()
+            if not expectation_ids:
+                del self._expected[event]
+
+    def __len__(self) -> int:
+        return len(self._order)
@@ -0,0 +1,185 @@
+import asyncio
+from queue import SimpleQueue, Empty
+from threading import Thread, Lock
+from typing import List, Tuple, Optional, Any, Dict
+
+from models.backends import InjectionBackend
+from models.event_journal import EventJournal
+from models.injection_filter import SelfInjectionFilter
+from models.metrics import Metrics
+
+# One injection event: name of the backend function and its arguments, e.g. ("key_down", ("ctrl",))
+InjectionEvent = Tuple[str, tuple]
+
+# Functions that press a key or button down -> the function that releases it
+RELEASE_FUNCTIONS = {"key_down": "key_up", "mouse_down": "mouse_up"}
+
+
+def _resolve(future: asyncio.Future, result: Any, error: Optional[BaseException]):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class Injector:
+    """
+    Runs all calls to the injection backend on one dedicated worker thread.
+    Actions submit events and await a future that is resolved once the events were injected, so a slow
+    injection never blocks the event loop. Submissions that are waiting when the worker becomes free are
+    taken off the queue at once. Each submission is injected as its own batch (see
+    'InjectionBackend.execute_batch'), so an error only fails the submission it came from.
+
+    With 'threaded=False' events are injected immediately on submission, which is useful for tests.
+    """
+
+    def __init__(
+        self,
+        backend: InjectionBackend,
+        threaded: bool = True,
+        metrics: Optional[Metrics] = None,
+        journal: Optional[EventJournal] = None,
+        injection_filter: Optional[SelfInjectionFilter] = None,
+    ):
+        self.backend = backend
+        self.journal = journal
+        self.injection_filter = injection_filter
+        self.metrics = metrics or Metrics()
+        self.threaded = threaded
+        self._queue: SimpleQueue = SimpleQueue()
+        self._thread: Optional[Thread] = None
+        # Keys and buttons that were pressed down and not released yet: (release function, argument) in press order,
+        # with how many presses are still outstanding, e.g. two overlapping actions that hold 'shift'
+        self._held: Dict[Tuple[str, Any], int] = {}
+        self._held_lock = Lock()
+
+    def start(self):
+        if not self.threaded or self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name="Injector", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, events: List[InjectionEvent]) -> asyncio.Future:
+        """
+        Queues the events to be injected in order. Has to be called from a running event loop.
+        The returned future resolves to the return value of the last event.
+        """
+        assert events, f"Nothing to inject"
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        if self.threaded:
+            self._queue.put((events, loop, future))
+        else:
+            try:
+                future.set_result(self._execute(events)[-1])
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    async def inject(self, *events: InjectionEvent) -> Any:
+        return await self.submit(list(events))
+
+    async def call(self, function_name: str, *args) -> Any:
+        """ Calls one backend function on the injector thread, e.g. 'await injector.call("position")'. """
+        return await self.submit([(function_name, args)])
+
+    @property
+    def held(self) -> List[InjectionEvent]:
+        """ Events that release everything that is currently held down, most recently pressed first. """
+        with self._held_lock:
+            return [(function_name, (argument,)) for function_name, argument in reversed(list(self._held))]
+
+    async def release_held(self):
+        """ Releases all keys and mouse buttons that were pressed down and not released, e.g. on shutdown. """
+        with self._held_lock:
+            events = [(function_name, (argument,)) for function_name, argument in reversed(list(self._held))]
+            # One release lifts a key no matter how often it was pressed by overlapping actions
+            self._held.clear()
+        if events:
+            await self.submit(events)
+
+    def _track_held(self, events: List[InjectionEvent]):
+        with self._held_lock:
+            for function_name, args in events:
+                release_function = RELEASE_FUNCTIONS.get(function_name)
+                if release_function is not None:
+                    key = (release_function, args[0] if args else "left")
+                    self._held[key] = self._held.get(key, 0) + 1
+                elif function_name in ("key_up", "mouse_up"):
+                    key = (function_name, args[0] if args else "left")
+                    count = self._held.get(key)
+                    if count is None:
+                        continue
+                    if count > 1:
+                        self._held[key] = count - 1
+                    else:
+                        del self._held[key]
+
+    def _run(self):
+        try:
+            # Warm up: import the input library in the background instead of on the first injection
+            self.backend.load()
+        except Exception:
+            # The error is raised again to the action that injects first
+            pass
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            # Coalesce everything that was submitted while the previous batch was injected
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._inject_batch(batch)
+            if stop:
+                return
+
+    def _execute(self, events: List[InjectionEvent]) -> list:
+        if self.journal is not None:
+            for function_name, args in events:
+                self.journal.write_injection(function_name, args)
+        if self.injection_filter is not None:
+            # Before injecting, the listener may receive the events before the backend returns
+            self.injection_filter.expect_injection(events)
+        try:
+            results = self.backend.execute_batch(events)
+        except Exception:
+            if self.metrics.enabled:
+                self.metrics.increment("dropped_events", len(events))
+            raise
+        # Only keys that were actually pressed are released later
+        self._track_held(events)
+        if self.metrics.enabled:
+            self.metrics.increment("injected_events", len(events))
+        return results
+
+    def _inject_batch(self, batch: List[Tuple[List[InjectionEvent], asyncio.AbstractEventLoop, asyncio.Future]]):
+        for submitted_events, loop, future in batch:
+            try:
+                result = self._execute(submitted_events)[-1]
+                error = None
+            except Exception as e:
+                result = None
+                error = e
+            try:
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+            except RuntimeError:
+                # The loop of the action was closed in the meantime, nobody waits for the result
+                pass
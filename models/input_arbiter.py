@@ -0,0 +1,239 @@
+"""
+Decides which action may use which part of the input devices, so actions that run at the same time do not corrupt
+each other's input, while actions that use unrelated keys or devices still run concurrently.
+
+Resources are single keys ("key:a", "key:shift"), mouse buttons ("button:left"), the pointer position ("pointer") and
+the scroll wheel ("wheel"). An action leases the resources of one step, e.g. the keys of a hotkey while it is pressed
+or the pointer while the mouse moves along a path, exclusively:
+
+    async with arbiter.keys(["ctrl", "c"]):
+        ...
+
+Modifiers are global, a held down shift changes every other key press. So key leases also take the modifiers they do
+not press as shared: any amount of plain key presses run concurrently, but they wait while another action holds a
+modifier down, and a modifier is only pressed while no other action presses keys.
+Leases are granted all at once (no action holds half of its keys while waiting for the rest) and in order of
+priority, then of arrival. A waiting lease is not overtaken by a later lease that conflicts with it.
+
+The priority of the running action is taken from the context, see 'action_priority'. A lease that may preempt
+cancels the actions with a lower priority that own resources it waits for, they release their keys in 'finally'.
+Leases of the same task are reentrant.
+"""
+import asyncio
+import itertools
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple, TYPE_CHECKING
+
+from models.injection_filter import normalize_key
+from models.key_codes import MODIFIER_BITS
+
+if TYPE_CHECKING:
+    from models.metrics import Metrics
+
+POINTER = "pointer"
+WHEEL = "wheel"
+MODIFIER_RESOURCES = frozenset(f"key:{modifier}" for modifier in MODIFIER_BITS)
+
+# (priority, preempt) of the action that runs in the current task, set by 'Action.execute'
+action_priority = ContextVar("action_priority", default=(0, False))
+
+
+def key_resource(key: str) -> str:
+    # "A" and "a" are the same key
+    return f"key:{normalize_key(key).lower()}"
+
+
+def button_resource(button: str) -> str:
+    return f"button:{button.lower()}"
+
+
+class _Owner:
+    """ Resources that one task holds. """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, priority: int):
+        self.loop = loop
+        self.priority = priority
+        self.leases = 0
+
+
+class Lease:
+    def __init__(self, arbiter: "InputArbiter", exclusive: Iterable[str], shared: Iterable[str] = ()):
+        self.arbiter = arbiter
+        self.exclusive: FrozenSet[str] = frozenset(exclusive)
+        self.shared: FrozenSet[str] = frozenset(shared) - self.exclusive
+        self.priority, self.preempt = action_priority.get()
+        self.task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.future: Optional[asyncio.Future] = None
+        self.granted = False
+        self.order = (0, 0)
+
+    def conflicts(self, other: "Lease") -> bool:
+        if self.task is other.task:
+            return False
+        return bool(self.exclusive & (other.exclusive | other.shared) or self.shared & other.exclusive)
+
+    async def __aenter__(self) -> "Lease":
+        await self.arbiter.acquire(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.arbiter.release(self)
+
+    def __repr__(self):
+        return f"Lease(exclusive={sorted(self.exclusive)}, priority={self.priority}, granted={self.granted})"
+
+
+class InputArbiter:
+    def __init__(self, metrics: Optional["Metrics"] = None):
+        self.metrics = metrics
+        self._lock = Lock()
+        # Resource -> {task: depth}, a resource has either one exclusive owner or any amount of shared owners
+        self._exclusive: Dict[str, Dict[asyncio.Task, int]] = {}
+        self._shared: Dict[str, Dict[asyncio.Task, int]] = {}
+        self._owners: Dict[asyncio.Task, _Owner] = {}
+        # Ordered by priority (highest first), then by arrival
+        self._waiting: List[Lease] = []
+        self._sequence = itertools.count()
+
+    def acquire_resources(self, exclusive: Iterable[str], shared: Iterable[str] = ()) -> Lease:
+        return Lease(self, exclusive, shared)
+
+    def keys(self, keys: Iterable[str]) -> Lease:
+        """ Lease to press the keys, the other modifiers must not be pressed meanwhile. """
+        exclusive = {key_resource(key) for key in keys}
+        return Lease(self, exclusive, MODIFIER_RESOURCES - exclusive)
+
+    def mouse(self, button: Optional[str] = None, move: bool = False) -> Lease:
+        """ Lease to press a mouse button, to move the pointer or both. Clicks without moving keep the pointer still. """
+        exclusive = [button_resource(button)] if button is not None else []
+        if move:
+            return Lease(self, exclusive + [POINTER])
+        return Lease(self, exclusive, [POINTER])
+
+    def _available(self, lease: Lease) -> bool:
+        for resource in lease.exclusive:
+            for owners in (self._exclusive.get(resource), self._shared.get(resource)):
+                if owners and any(task is not lease.task for task in owners):
+                    return False
+        for resource in lease.shared:
+            owners = self._exclusive.get(resource)
+            if owners and any(task is not lease.task for task in owners):
+                return False
+        return True
+
+    def _blocked_by_waiting(self, lease: Lease, waiting: Iterable[Lease]) -> bool:
+        return any(other.order < lease.order and other.conflicts(lease) for other in waiting)
+
+    def _grant(self, lease: Lease):
+        for resource in lease.exclusive:
+            owners = self._exclusive.setdefault(resource, {})
+            owners[lease.task] = owners.get(lease.task, 0) + 1
+        for resource in lease.shared:
+            owners = self._shared.setdefault(resource, {})
+            owners[lease.task] = owners.get(lease.task, 0) + 1
+        owner = self._owners.get(lease.task)
+        if owner is None:
+            owner = self._owners[lease.task] = _Owner(lease.loop, lease.priority)
+        owner.leases += 1
+        lease.granted = True
+
+    async def acquire(self, lease: Lease):
+        lease.task = asyncio.current_task()
+        lease.loop = asyncio.get_event_loop()
+        lease.order = (-lease.priority, next(self._sequence))
+        with self._lock:
+            # A task that already owns resources does not queue behind others, they may wait for it
+            nested = lease.task in self._owners
+            if self._available(lease) and (nested or not self._blocked_by_waiting(lease, self._waiting)):
+                self._grant(lease)
+                return
+            lease.future = lease.loop.create_future()
+            self._waiting.append(lease)
+            self._waiting.sort(key=lambda waiting: waiting.order)
+            preempted = self._preempted_by(lease) if lease.preempt else []
+        if self.metrics is not None and self.metrics.enabled:
+            self.metrics.increment("arbiter_conflicts")
+        for owner_task, owner in preempted:
+            if self.metrics is not None and self.metrics.enabled:
+                self.metrics.increment("arbiter_preemptions")
+            owner.loop.call_soon_threadsafe(owner_task.cancel)
+        try:
+            await lease.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if lease in self._waiting:
+                    self._waiting.remove(lease)
+            if lease.granted:
+                # Granted right before the cancellation arrived
+                self.release(lease)
+            else:
+                self._wake()
+            raise
+
+    def _preempted_by(self, lease: Lease) -> List[Tuple[asyncio.Task, _Owner]]:
+        """ Owners with a lower priority of the resources that the lease waits for. """
+        tasks = set()
+        for resource in lease.exclusive:
+            tasks.update(self._exclusive.get(resource, ()))
+            tasks.update(self._shared.get(resource, ()))
+        for resource in lease.shared:
+            tasks.update(self._exclusive.get(resource, ()))
+        tasks.discard(lease.task)
+        return [
+            (task, self._owners[task]) for task in tasks if self._owners[task].priority < lease.priority
+        ]
+
+    def release(self, lease: Lease):
+        with self._lock:
+            if not lease.granted:
+                return
+            lease.granted = False
+            for resources, owners_by_resource in ((lease.exclusive, self._exclusive), (lease.shared, self._shared)):
+                for resource in resources:
+                    owners = owners_by_resource[resource]
+                    owners[lease.task] -= 1
+                    if not owners[lease.task]:
+                        del owners[lease.task]
+                        if not owners:
+                            del owners_by_resource[resource]
+            owner = self._owners[lease.task]
+            owner.leases -= 1
+            if not owner.leases:
+                del self._owners[lease.task]
+        self._wake()
+
+    def _wake(self):
+        """ Grants waiting leases in order, as long as they do not conflict with an earlier waiting lease. """
+        woken = []
+        with self._lock:
+            still_waiting = []
+            for lease in self._waiting:
+                if self._available(lease) and not self._blocked_by_waiting(lease, still_waiting):
+                    self._grant(lease)
+                    woken.append(lease)
+                else:
+                    still_waiting.append(lease)
+            self._waiting = still_waiting
+        for lease in woken:
+            lease.loop.call_soon_threadsafe(_set_granted, lease.future)
+
+    @property
+    def owned(self) -> Dict[str, int]:
+        """ Resource -> how many tasks own it, for monitoring. """
+        with self._lock:
+            owned = {resource: len(owners) for resource, owners in self._shared.items()}
+            owned.update((resource, len(owners)) for resource, owners in self._exclusive.items())
+            return owned
+
+    @property
+    def waiting(self) -> int:
+        with self._lock:
+            return len(self._waiting)
+
+
+def _set_granted(future: asyncio.Future):
+    # The waiting task may have been cancelled meanwhile, it releases the lease itself
+    if not future.done():
+        future.set_result(None)
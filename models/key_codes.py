@@ -0,0 +1,167 @@
+"""
+Compact representation of pressed keys: the interned key name and the modifier bitmask packed into one int.
+Key codes are used on the hot path (listener, history, matcher) instead of allocating a KeyInfo per key press.
+KeyInfo stays the type for configuring hotkeys and actions.
+
+    code = key_id << MODIFIER_BITS_COUNT | modifier bits
+"""
+from array import array
+from threading import Lock
+from typing import Dict, List, Optional, Tuple, Iterator
+
+CTRL = 1
+ALT = 2
+SHIFT = 4
+MODIFIER_BITS = {"ctrl": CTRL, "alt": ALT, "shift": SHIFT}
+MODIFIER_BITS_COUNT = 3
+MODIFIER_MASK = (1 << MODIFIER_BITS_COUNT) - 1
+
+_key_ids: Dict[str, int] = {}
+_key_names: List[str] = []
+_intern_lock = Lock()
+
+
+def intern_key(key: str) -> int:
+    key_id = _key_ids.get(key)
+    if key_id is None:
+        with _intern_lock:
+            key_id = _key_ids.get(key)
+            if key_id is None:
+                key_id = len(_key_names)
+                _key_names.append(key)
+                _key_ids[key] = key_id
+    return key_id
+
+
+def modifier_mask(ctrl: Optional[bool], alt: Optional[bool], shift: Optional[bool]) -> int:
+    return (CTRL if ctrl else 0) | (ALT if alt else 0) | (SHIFT if shift else 0)
+
+
+def encode(key: str, modifiers: int = 0) -> int:
+    return intern_key(key) << MODIFIER_BITS_COUNT | modifiers
+
+
+def key_name(code: int) -> str:
+    return _key_names[code >> MODIFIER_BITS_COUNT]
+
+
+def decode(code: int) -> Tuple[str, bool, bool, bool]:
+    """ Returns (key, ctrl, alt, shift). """
+    return key_name(code), bool(code & CTRL), bool(code & ALT), bool(code & SHIFT)
+
+
+def describe(code: int) -> str:
+    """ Human readable form, e.g. "ctrl+alt+e". """
+    key, ctrl, alt, shift = decode(code)
+    modifiers = [name for name, pressed in zip(["ctrl", "alt", "shift"], [ctrl, alt, shift]) if pressed]
+    return "+".join(modifiers + [key])
+
+
+class KeyHistory:
+    """
+    Fixed size ring buffer of the most recently pressed key codes and their timestamps (nanoseconds),
+    preallocated once.
+    """
+
+    def __init__(self, size: int = 20):
+        assert size > 0, f"{size}"
+        self.size = size
+        self._codes = array("q", [0] * size)
+        self._timestamps = array("q", [0] * size)
+        # Position where the next code is written
+        self._next = 0
+        self._count = 0
+
+    def push(self, code: int, timestamp: int = 0):
+        self._codes[self._next] = code
+        self._timestamps[self._next] = timestamp
+        self._next = (self._next + 1) % self.size
+        if self._count < self.size:
+            self._count += 1
+
+    def timestamp(self, age: int) -> int:
+        """ Timestamp of the key press that happened 'age' presses ago, 0 is the newest. """
+        assert 0 <= age < self._count, f"{age}"
+        return self._timestamps[(self._next - 1 - age) % self.size]
+
+    def expire(self, cutoff: int):
+        """ Forgets the presses older than 'cutoff'. Amortized O(1): every press is only expired once. """
+        timestamps = self._timestamps
+        while self._count and timestamps[(self._next - self._count) % self.size] < cutoff:
+            self._count -= 1
+
+    def sequence_fits(self, length: int, max_gap: int = 0, window: int = 0) -> bool:
+        """
+        Whether the newest 'length' presses happened within 'window' nanoseconds from the first to the last one,
+        and no two consecutive presses were more than 'max_gap' nanoseconds apart. 0 means no limit.
+        """
+        if length > self._count:
+            return False
+        timestamps = self._timestamps
+        newest = (self._next - 1) % self.size
+        if window and timestamps[newest] - timestamps[(newest - length + 1) % self.size] > window:
+            return False
+        if max_gap:
+            for age in range(length - 1):
+                index = (newest - age) % self.size
+                if timestamps[index] - timestamps[(index - 1) % self.size] > max_gap:
+                    return False
+        return True
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[int]:
+        """ Newest code first. """
+        codes = self._codes
+        index = self._next
+        for _ in range(self._count):
+            index = (index - 1) % self.size
+            yield codes[index]
+
+    def clear(self):
+        self._count = 0
+
+
+class HeldKeys:
+    """ Which keys are held down right now, by key id (see 'intern_key'). Repeated presses of a held key are ignored. """
+
+    def __init__(self):
+        # Key id -> (timestamp, serial number) of the press
+        self._pressed: Dict[int, Tuple[int, int]] = {}
+        # Key id -> (serial number, nanoseconds held down) of the last release
+        self._released: Dict[int, Tuple[int, int]] = {}
+        self._serial = 0
+
+    def press(self, key_id: int, timestamp: int) -> bool:
+        """ Returns whether this is a new press, 'False' for a repeat of the operating system's key repeat. """
+        if key_id in self._pressed:
+            return False
+        self._serial += 1
+        self._pressed[key_id] = (timestamp, self._serial)
+        return True
+
+    def release(self, key_id: int, timestamp: Optional[int] = None) -> Optional[int]:
+        """
+        Returns the timestamp of the press, 'None' if the key was not held down.
+        timestamp: of the release, how long the key was held down is kept until its next release, see 'held_duration'.
+        """
+        pressed = self._pressed.pop(key_id, None)
+        if pressed is None:
+            return None
+        if timestamp is not None:
+            self._released[key_id] = (pressed[1], timestamp - pressed[0])
+        return pressed[0]
+
+    def held_duration(self, key_id: int, serial: int) -> Optional[int]:
+        """ Nanoseconds that the press with this serial was held down, 'None' if it was not released (yet). """
+        released = self._released.get(key_id)
+        return None if released is None or released[0] != serial else released[1]
+
+    def serial(self, key_id: int) -> Optional[int]:
+        """ Identifies the press of a held key, a key that was released and pressed again gets a new serial. """
+        pressed = self._pressed.get(key_id)
+        return None if pressed is None else pressed[1]
+
+    def __contains__(self, key_id: int) -> bool:
+        return key_id in self._pressed
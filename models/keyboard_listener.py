@@ -1,25 +1,144 @@
+"""
+The OS hook callbacks of pynput ('on_press', 'on_release') only encode the key event into one int and push it onto a
+preallocated queue (see 'models.event_queue'), slow hook callbacks would delay every key stroke of the system.
+A matcher worker thread takes the events off the queue in batches and does the rest: tracking the modifiers,
+filtering injected keys, notifying observers and matching hotkeys.
+Without a running worker (e.g. in tests), the callbacks handle the events directly.
+"""
 import asyncio
-from typing import TYPE_CHECKING
+import time
+from threading import Thread
+from typing import TYPE_CHECKING, List, Callable, Optional
 
-from pynput import keyboard
-from pynput.keyboard import KeyCode
+from loguru import logger
 
 if TYPE_CHECKING:
+    from pynput.keyboard import KeyCode
     from .manager import Manager
 
-from models.other import KeyInfo, MODIFIERS
+from models.event_queue import SpscQueue
+from models.key_codes import encode, key_name, CTRL, ALT, SHIFT, MODIFIER_BITS
+
+# pynput key name -> modifier bit
+MODIFIER_KEYS = {
+    "ctrl": CTRL,
+    "ctrl_l": CTRL,
+    "ctrl_r": CTRL,
+    "alt": ALT,
+    "alt_l": ALT,
+    "alt_r": ALT,
+    "shift": SHIFT,
+    "shift_l": SHIFT,
+    "shift_r": SHIFT,
+}
+MODIFIER_NAMES = {bit: name for name, bit in MODIFIER_BITS.items()}
+
+# Flags of a queued key event, stored in the modifier bits of its key code (see 'models.key_codes')
+PRESSED = 1
+# The platform tagged the event as injected or as not injected
+INJECTED = 2
+NOT_INJECTED = 4
 
 
 class KeyboardListener:
-    def __init__(self, manager: "Manager"):
+    def __init__(self, manager: "Manager", queue_capacity: int = 16384, batch_size: int = 256):
+        """
+        queue_capacity: how many key events may wait for the matcher worker, further events are dropped. The default
+        leaves headroom for bursts of several thousand events while the worker is busy, e.g. with slow observers.
+        batch_size: how many events the worker takes off the queue at once.
+        """
         self.manager = manager
-        self.listener = keyboard.Listener(on_press=self.on_press, on_release=self.on_release)
-        self.modifiers = KeyInfo("", False, False, False)
+        self.listener = None
+        self.queue = SpscQueue(queue_capacity)
+        self.batch_size = batch_size
+        self._worker: Optional[Thread] = None
+        # Bitmask of the modifiers that are currently held down, see 'models.key_codes'
+        self.modifiers = 0
+        # Called with (pressed, key name, timestamp) for every key press and release, including modifiers,
+        # e.g. by the macro recorder. The timestamp is 'manager.clock_ns()' of when the hook received the event
+        self.observers: List[Callable[[bool, str, int], None]] = []
+        manager.metrics.gauges["key_queue_depth"] = self.queue.__len__
 
     def start(self):
+        # pynput needs a display, it is only imported when the listener is actually used
+        from pynput import keyboard
+
+        self.start_worker()
+        self.listener = keyboard.Listener(on_press=self.on_press, on_release=self.on_release)
         self.listener.start()
 
-    def on_press(self, key: KeyCode):
+    def start_worker(self):
+        """ From now on the callbacks only queue the events, the worker thread handles them. """
+        if self._worker is not None:
+            return
+        self._worker = Thread(target=self._run, name="KeyMatcher", daemon=True)
+        self._worker.start()
+
+    def stop(self, timeout: Optional[float] = 1):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener.join(timeout)
+            self.listener = None
+        if self._worker is not None:
+            # The worker handles the remaining events before it stops
+            self.queue.close()
+            self._worker.join(timeout)
+            self._worker = None
+            self.queue = SpscQueue(self.queue.capacity)
+            self.manager.metrics.gauges["key_queue_depth"] = self.queue.__len__
+
+    @property
+    def queue_stats(self) -> dict:
+        queue = self.queue
+        return {
+            "depth": len(queue),
+            "capacity": queue.capacity,
+            "high_water": queue.high_water,
+            "pushed": queue.pushed,
+            "dropped": queue.dropped,
+        }
+
+    def _run(self):
+        queue = self.queue
+        reported_drops = 0
+        while True:
+            events, timestamps = queue.pop_batch(self.batch_size)
+            if events:
+                self._handle_batch(events, timestamps)
+                # Reported here and not in the hook callback, which has to stay short
+                if queue.dropped != reported_drops:
+                    logger.warning(f"Key event queue was full, dropped {queue.dropped - reported_drops} key events")
+                    reported_drops = queue.dropped
+            elif queue.closed:
+                return
+            else:
+                queue.wait()
+
+    def _handle_batch(self, events: List[int], timestamps: List[int]):
+        metrics = self.manager.metrics
+        for event, timestamp in zip(events, timestamps):
+            if metrics.enabled:
+                metrics.record("key_queue_latency", (time.perf_counter_ns() - timestamp) / 1000)
+            try:
+                self.handle_event(event, timestamp)
+            except Exception:
+                # The worker has to keep running, the next key press may work
+                logger.exception(f"Could not handle key event {key_name(event)}")
+
+    def _injected(self, pressed: bool, key_name: str, injected: Optional[bool]) -> bool:
+        """ Whether this program injected the key event, see 'models.injection_filter'. """
+        injection_filter = self.manager.injection_filter
+        if injected is None:
+            injected = injection_filter.consume(pressed, key_name)
+        elif injected:
+            # The platform tagged the event, the expectation is not needed anymore
+            injection_filter.consume(pressed, key_name)
+        if injected and pressed and self.manager.metrics.enabled:
+            self.manager.metrics.increment("key_events")
+            self.manager.metrics.increment("ignored_events")
+        return injected
+
+    def on_press(self, key: "KeyCode", injected: Optional[bool] = None):
         """
         key.char: str
         key.combining: None
@@ -29,46 +148,80 @@ class KeyboardListener:
         if it was a modifier (ctrl, alt, shift):
         key.name: str
         key.value: KeyCode
+
+        Pressed keys are passed on as key code, no objects are created per key press.
+        injected: passed by pynput on platforms that can tell whether a key event was injected.
         """
-        if hasattr(key, "char"):
-            self.manager.keyboard_on_press(
-                KeyInfo(ctrl=self.modifiers.ctrl, alt=self.modifiers.alt, shift=self.modifiers.shift, key=key.char,)
-            )
-        elif hasattr(key, "name"):
-            # Handle modifier keys
-            if key.name == "ctrl":
-                self.modifiers.ctrl = True
-            elif key.name == "alt":
-                self.modifiers.alt = True
-            elif key.name == "shift":
-                self.modifiers.shift = True
-            if key.name in MODIFIERS:
-                return
-            # Just pressing a modifier (ctrl, alt or shift) does not trigger a hotkey
-            self.manager.keyboard_on_press(
-                KeyInfo(ctrl=self.modifiers.ctrl, alt=self.modifiers.alt, shift=self.modifiers.shift, key=key.name,)
-            )
+        self._push(key, PRESSED, injected)
 
-    def on_release(self, key: KeyCode):
+    def on_release(self, key: "KeyCode", injected: Optional[bool] = None):
+        self._push(key, 0, injected)
+
+    def _push(self, key: "KeyCode", flags: int, injected: Optional[bool]):
+        # Runs in the OS hook, keep it short
         if hasattr(key, "char"):
-            pass
-        elif hasattr(key, "name"):
-            # Handle modifier keys
-            if key.name == "ctrl":
-                self.modifiers.ctrl = False
-            elif key.name == "alt":
-                self.modifiers.alt = False
-            elif key.name == "shift":
-                self.modifiers.shift = False
+            name = key.char
+        else:
+            name = getattr(key, "name", None)
+        if name is None:
+            return
+        if injected is not None:
+            flags |= INJECTED if injected else NOT_INJECTED
+        event = encode(name, flags)
+        if self._worker is None:
+            self.handle_event(event)
+        elif not self.queue.push(event) and self.manager.metrics.enabled:
+            self.manager.metrics.increment("dropped_key_events")
+
+    def handle_event(self, event: int, timestamp: Optional[int] = None):
+        """
+        Handles a key event that was encoded by '_push'.
+        timestamp: time.perf_counter_ns() of when the event was queued (the manager's clock), defaults to now.
+        """
+        if timestamp is None:
+            timestamp = self.manager.clock_ns()
+        name = key_name(event)
+        pressed = bool(event & PRESSED)
+        injected = True if event & INJECTED else False if event & NOT_INJECTED else None
+        # Handle modifier keys
+        modifier = MODIFIER_KEYS.get(name)
+        if modifier is not None:
+            name = MODIFIER_NAMES[modifier]
+            # Injected modifiers are held down as well, a key pressed by the user is combined with them
+            if pressed:
+                self.modifiers |= modifier
+            else:
+                self.modifiers &= ~modifier
+        if self._injected(pressed, name, injected):
+            return
+        self._notify(pressed, name, timestamp)
+        # Just pressing a modifier (ctrl, alt or shift) does not trigger a hotkey
+        if modifier is not None:
+            return
+        if pressed:
+            self.manager.keyboard_on_press_code(encode(name, self.modifiers), timestamp)
+        else:
+            self.manager.keyboard_on_release_code(encode(name, self.modifiers), timestamp)
+
+    def _notify(self, pressed: bool, key: str, timestamp: int):
+        for observer in self.observers:
+            observer(pressed, key, timestamp)
 
 
 if __name__ == "__main__":
     # Local testing
+    from models.injection_filter import SelfInjectionFilter
+    from models.metrics import Metrics
+
     class FakeManager:
-        def keyboard_on_press(self, _):
+        injection_filter = SelfInjectionFilter()
+        metrics = Metrics()
+        clock_ns = staticmethod(time.perf_counter_ns)
+
+        def keyboard_on_press_code(self, code, timestamp=None):
             return
 
-        def keyboard_on_release(self, _):
+        def keyboard_on_release_code(self, code, timestamp=None):
             return
 
     async def main():
@@ -1,15 +1,21 @@
+from array import array
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, List, Optional
 
 if TYPE_CHECKING:
     from .manager import Manager
 
-import pyautogui
 import asyncio
-from loguru import logger
+from models.action_program import ActionProgram, TYPE
+from models.backends import PASTE_MODIFIER, TEXT_KEYS
+from models.logging_setup import event_logger
+from models.scheduler import DeadlineScheduler
 
 from models.other import KeyInfo, Command, MODIFIERS, Action
 
+# Texts are sent to the injector in chunks of this many characters, a running text can be cancelled between chunks
+TEXT_CHUNK_SIZE = 64
+
 
 class KeyboardPresser:
     def __init__(self, manager: "Manager"):
@@ -18,48 +24,92 @@ class KeyboardPresser:
     async def press_hotkey(self, key_info: KeyInfo, verbose=True):
         """ Presses a hotkey combination. """
         if verbose:
-            logger.info(f"Pressing hotkey: {key_info.to_hotkey_list}")
-        with self.manager.lock:
-            pyautogui.hotkey(*key_info.to_hotkey_list)
+            event_logger.opt(lazy=True).debug("Pressing hotkey: {}", lambda: key_info.to_hotkey_list)
+        keys = key_info.to_hotkey_list
+        async with self.manager.arbiter.keys(keys):
+            await self.manager.injector.submit([("hotkey", tuple(keys))])
 
     async def press_hotkeys(self, keys: List[KeyInfo]):
         """ Uses the function above to hit multilpe hotkeys while being able to sleep between action. """
         for index, key_info in enumerate(keys):
-            logger.info(f"Pressing hotkey [{index+1} / {len(keys)}]: {key_info.to_hotkey_list}")
+            event_logger.opt(lazy=True).debug(
+                "Pressing hotkey [{} / {}]: {}", lambda: index + 1, lambda: len(keys), lambda: key_info.to_hotkey_list
+            )
             await self.press_hotkey(key_info, verbose=False)
             await asyncio.sleep(key_info.delay / 1000)
 
+    async def type_text(
+        self, text: str, chars_per_second: Optional[float] = None, paste_min_length: Optional[int] = 2000
+    ):
+        """
+        Types a text with the backend's 'type_text', which is much faster than pressing one KeyInfo per character.
+        chars_per_second: limits the typing speed, 'None' types as fast as the backend can.
+        paste_min_length: texts of at least this length are pasted from the clipboard instead, 'None' never pastes.
+        """
+        if not text:
+            return
+        injector = self.manager.injector
+        event_logger.debug("Typing text of length {}", len(text))
+        if paste_min_length is not None and len(text) >= paste_min_length:
+            async with self.manager.arbiter.keys([PASTE_MODIFIER, "v"]):
+                await injector.submit([("paste_text", (text,))])
+            return
+        # Other actions must not hold a modifier down while the text is typed
+        async with self.manager.arbiter.keys({TEXT_KEYS.get(char, char) for char in text} | {"shift"}):
+            if chars_per_second is None:
+                for index in range(0, len(text), TEXT_CHUNK_SIZE):
+                    # Awaiting every chunk is a cancellation point, at most one chunk is typed after cancelling
+                    await injector.submit([("type_text", (text[index : index + TEXT_CHUNK_SIZE],))])
+                return
+            assert chars_per_second > 0, f"{chars_per_second}"
+            # Smaller chunks for slow typing, so the characters are spread evenly
+            chunk_size = max(1, min(TEXT_CHUNK_SIZE, int(chars_per_second // 20)))
+            scheduler = DeadlineScheduler(spin_threshold_ms=0)
+            scheduler.start()
+            for index in range(0, len(text), chunk_size):
+                chunk = text[index : index + chunk_size]
+                await injector.submit([("type_text", (chunk,))])
+                await scheduler.wait(len(chunk) / chars_per_second * 1000)
+
+    async def key_down(self, key: str):
+        """ Presses a single key without releasing it. """
+        async with self.manager.arbiter.keys([key]):
+            await self.manager.injector.submit([("key_down", (key,))])
+
+    async def key_up(self, key: str):
+        async with self.manager.arbiter.keys([key]):
+            await self.manager.injector.submit([("key_up", (key,))])
+
     async def hold_down_button(self, key_info: KeyInfo):
         """ Hold down a button for X milliseconds. """
         key = key_info.key
-        # Hold down MODIFIERS
-        with self.manager.lock:
-            for modifier_str, should_press in zip(MODIFIERS, [key_info.ctrl, key_info.alt, key_info.shift]):
-                if should_press:
-                    logger.info(f"Holding down modifier: {modifier_str}")
-                    pyautogui.keyDown(f"{modifier_str}")
-
-            # Hold down key
-            self.manager.ignore_next_key_press += 1
-            logger.info(f"Holding down button: {key_info.key}")
-            pyautogui.keyDown(f"{key}")
-
-        # Wait time
-        await asyncio.sleep(key_info.duration / 1000)
-
-        # Release key
-        with self.manager.lock:
-            logger.info(f"Releasing button: {key}")
-            self.manager.ignore_next_key_release += 1
-            pyautogui.keyUp(f"{key}")
-
-            # Release MODIFIERS
-            for modifier_str, should_release in zip(
-                reversed(MODIFIERS), reversed([key_info.ctrl, key_info.alt, key_info.shift])
-            ):
-                if should_release:
-                    logger.info(f"Releasing modifier: {key_info.key}")
-                    pyautogui.keyDown(f"{modifier_str}")
+        modifiers = [
+            modifier_str
+            for modifier_str, should_press in zip(MODIFIERS, [key_info.ctrl, key_info.alt, key_info.shift])
+            if should_press
+        ]
+        # The keys belong to this action until they are released again
+        async with self.manager.arbiter.keys(modifiers + [key]):
+            # Hold down MODIFIERS and key, they are submitted together so they are injected in one batch
+            for modifier_str in modifiers:
+                event_logger.debug("Holding down modifier: {}", modifier_str)
+            event_logger.debug("Holding down button: {}", key)
+            injected = self.manager.injector.submit(
+                [("key_down", (modifier_str,)) for modifier_str in modifiers] + [("key_down", (key,))]
+            )
+            try:
+                await injected
+
+                # Wait time
+                await asyncio.sleep(key_info.duration / 1000)
+            finally:
+                # Release key and MODIFIERS, also if the action was cancelled while holding them down
+                event_logger.debug("Releasing button: {}", key)
+                for modifier_str in reversed(modifiers):
+                    event_logger.debug("Releasing modifier: {}", modifier_str)
+                await self.manager.injector.submit(
+                    [("key_up", (key,))] + [("key_up", (modifier_str,)) for modifier_str in reversed(modifiers)]
+                )
 
 
 @dataclass
@@ -68,6 +118,28 @@ class KeyboardAction(Action):
         assert self.hotkeys_to_press, f"Action field is empty"
 
 
+@dataclass
+class TextAction(KeyboardAction):
+    """ Types a text, see 'KeyboardPresser.type_text'. Can be used as 'keyboard_action' of a KeyboardCommand. """
+
+    text: str = ""
+    # 'None': as fast as possible
+    chars_per_second: Optional[float] = None
+    # Longer texts are pasted from the clipboard, 'None': never paste
+    paste_min_length: Optional[int] = 2000
+
+    def __post_init__(self):
+        # Not KeyboardAction's validation, a text action has no 'hotkeys_to_press'
+        Action.__post_init__(self)
+        assert self.text, f"Text is empty"
+        assert self.chars_per_second is None or self.chars_per_second > 0, f"{self.chars_per_second}"
+
+    def compile(self) -> ActionProgram:
+        program = super().compile()
+        program.body[0:0] = array("i", [TYPE, program.add_operand(self)])
+        return program
+
+
 @dataclass
 class KeyboardCommand(Command):
     keyboard_action: KeyboardAction = None
@@ -78,9 +150,17 @@ class KeyboardCommand(Command):
 
 if __name__ == "__main__":
     # Local testing
+    from types import SimpleNamespace
+
+    from models.backends import PyAutoGuiBackend
+    from models.injector import Injector
+    from models.input_arbiter import InputArbiter
 
     async def main():
-        presser = KeyboardPresser(None)
+        injector = Injector(PyAutoGuiBackend(), threaded=False)
+        presser = KeyboardPresser(
+            SimpleNamespace(injector=injector, arbiter=InputArbiter())
+        )
 
         key_info_ctrl_v = KeyInfo(key="v", ctrl=True)
         # Press hotkey (paste)
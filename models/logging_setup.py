@@ -0,0 +1,88 @@
+"""
+Logging configuration.
+
+Messages that are logged per key press or per injected event go through 'event_logger'. They are logged at
+DEBUG level with loguru's deferred formatting ('event_logger.debug("Key pressed: {}", key_info)'), so nothing is
+formatted if the level is filtered out. Handlers use loguru's queue ('enqueue=True'): the calling thread only
+puts the message on a queue and a background thread writes it to stdout / the log file.
+Per-event messages can additionally be sampled and rate limited with 'EventLogFilter'.
+"""
+import sys
+import time
+from typing import Dict, Optional
+
+from loguru import logger
+
+# Bound logger for per-event messages, see EventLogFilter
+event_logger = logger.bind(event_log=True)
+
+
+class EventLogFilter:
+    """
+    Lets all regular messages pass. Of the per-event messages, only every 'sample_every'th message passes and at most
+    'max_per_second' per source location. The amount of dropped messages is appended to the next message that passes.
+    """
+
+    def __init__(self, level: str = "INFO", sample_every: int = 1, max_per_second: Optional[float] = 50):
+        assert sample_every >= 1, f"{sample_every}"
+        self.level_no = logger.level(level).no
+        self.sample_every = sample_every
+        self.max_per_second = max_per_second
+        # Token buckets per source location: (tokens, last update)
+        self._buckets: Dict[tuple, list] = {}
+        self._seen: Dict[tuple, int] = {}
+        self._dropped: Dict[tuple, int] = {}
+
+    def __call__(self, record: dict) -> bool:
+        if record["level"].no < self.level_no:
+            return False
+        if not record["extra"].get("event_log"):
+            return True
+        source = (record["name"], record["line"])
+        seen = self._seen.get(source, 0)
+        self._seen[source] = seen + 1
+        if seen % self.sample_every != 0 or not self._take_token(source):
+            self._dropped[source] = self._dropped.get(source, 0) + 1
+            return False
+        dropped = self._dropped.pop(source, 0)
+        if dropped:
+            record["message"] += f" ({dropped} similar messages dropped)"
+        return True
+
+    def _take_token(self, source: tuple) -> bool:
+        if self.max_per_second is None:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(source)
+        if bucket is None:
+            bucket = self._buckets[source] = [self.max_per_second, now]
+        tokens = min(self.max_per_second, bucket[0] + (now - bucket[1]) * self.max_per_second)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+
+def configure_logging(
+    level: str = "INFO",
+    log_file: Optional[str] = "main.log",
+    sample_every: int = 1,
+    max_events_per_second: Optional[float] = 50,
+):
+    """ Replaces the default handler with non-blocking console and file handlers. """
+    logger.remove()
+    # Log to console
+    logger.add(
+        sys.stdout, level=level, enqueue=True, filter=EventLogFilter(level, sample_every, max_events_per_second)
+    )
+    if log_file:
+        # Log to file, max size 1 mb
+        logger.add(
+            log_file,
+            retention="10 days",
+            level=level,
+            enqueue=True,
+            filter=EventLogFilter(level, sample_every, max_events_per_second),
+        )
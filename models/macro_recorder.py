@@ -0,0 +1,117 @@
+"""
+Records keyboard and mouse input into an event journal (see 'models.event_journal') and replays it.
+Recording streams every event straight to the file, replay reads the memory-mapped file record by record,
+so neither depends on the length of the recording.
+Keys are recorded with the names of 'KeyInfo' and the backends (e.g. "pageup" instead of pynput's "page_up"), so a
+recording can be replayed with any backend.
+"""
+from typing import Optional, TYPE_CHECKING
+
+from loguru import logger
+
+from models.backends import key_name_from_pynput
+from models.event_journal import EventJournal, EventKind, read_journal
+from models.scheduler import DeadlineScheduler, TimingStats
+
+if TYPE_CHECKING:
+    from models.manager import Manager
+
+
+class MacroRecorder:
+    """ Streams the user's key presses and mouse events into a journal file while it is started. """
+
+    def __init__(self, manager: "Manager", path: str):
+        self.manager = manager
+        self.path = path
+        self.journal: Optional[EventJournal] = None
+        self._mouse_listener = None
+
+    @property
+    def recording(self) -> bool:
+        return self.journal is not None
+
+    def start(self, record_mouse: bool = True):
+        assert not self.recording, "Already recording"
+        # Key events carry the time they were queued by the keyboard hook, mouse events are stamped with the same clock
+        self.journal = EventJournal(self.path, self.manager.clock_ns)
+        self.manager.keyboard_listener.observers.append(self.on_key)
+        if record_mouse:
+            from pynput import mouse
+
+            self._mouse_listener = mouse.Listener(on_move=self.on_move, on_click=self.on_click, on_scroll=self.on_scroll)
+            self._mouse_listener.start()
+        logger.info("Recording macro to {}", self.path)
+
+    def stop(self):
+        if not self.recording:
+            return
+        self.manager.keyboard_listener.observers.remove(self.on_key)
+        if self._mouse_listener is not None:
+            self._mouse_listener.stop()
+            self._mouse_listener = None
+        self.journal.close()
+        self.journal = None
+        logger.info("Recorded macro to {}", self.path)
+
+    def on_key(self, pressed: bool, key: str, timestamp: int):
+        key = key_name_from_pynput(key)
+        self.journal.write(EventKind.KeyPress if pressed else EventKind.KeyRelease, key, timestamp=timestamp)
+
+    def on_move(self, x: int, y: int):
+        self.journal.write(EventKind.MouseMove, x=int(x), y=int(y))
+
+    def on_click(self, x: int, y: int, button, pressed: bool):
+        self.journal.write(EventKind.MouseDown if pressed else EventKind.MouseUp, button.name, x=int(x), y=int(y))
+
+    def on_scroll(self, x: int, y: int, dx: int, dy: int):
+        self.journal.write(EventKind.MouseScroll, x=int(dx), y=int(dy))
+
+
+class MacroReplayer:
+    """
+    Replays a recorded journal through the keyboard presser and mouse clicker.
+    Events keep their recorded offsets to each other, divided by 'speed'.
+    Events that were injected by this program while recording are skipped.
+    """
+
+    def __init__(self, manager: "Manager", path: str, speed: float = 1.0):
+        assert speed > 0, f"{speed}"
+        self.manager = manager
+        self.path = path
+        self.speed = speed
+
+    async def replay(self) -> TimingStats:
+        keyboard_presser = self.manager.keyboard_presser
+        mouse_clicker = self.manager.mouse_clicker
+        scheduler = DeadlineScheduler(spin_threshold_ms=self.manager.spin_threshold_ms, metrics=self.manager.metrics)
+        first_timestamp = None
+        for record in read_journal(self.path):
+            if record.injected:
+                continue
+            if first_timestamp is None:
+                first_timestamp = record.timestamp
+                scheduler.start()
+            else:
+                # Absolute deadlines: a late step does not delay all following steps
+                await scheduler.wait_until((record.timestamp - first_timestamp) / 1_000_000_000 / self.speed)
+
+            kind = record.event_kind
+            if kind == EventKind.KeyPress:
+                await keyboard_presser.key_down(record.key)
+            elif kind == EventKind.KeyRelease:
+                await keyboard_presser.key_up(record.key)
+            elif kind == EventKind.MouseMove:
+                await mouse_clicker.move_to(record.x, record.y)
+            elif kind == EventKind.MouseDown:
+                await mouse_clicker.move_to(record.x, record.y)
+                await mouse_clicker.mouse_down(record.key)
+            elif kind == EventKind.MouseUp:
+                await mouse_clicker.move_to(record.x, record.y)
+                await mouse_clicker.mouse_up(record.key)
+            elif kind == EventKind.MouseScroll:
+                await mouse_clicker.scroll(record.x, record.y)
+            else:
+                continue
+            scheduler.event_done()
+        logger.info("Macro replay finished: {}", scheduler.stats)
+        return scheduler.stats
@@ -1,15 +1,41 @@
 import asyncio
-import sys
-from collections import deque
-from threading import Thread, RLock
-from typing import List, Union, Deque
+import time
+from collections import Counter
+from threading import RLock
+from typing import Callable, List, Union, Optional, Coroutine, Dict, Tuple, TYPE_CHECKING
 
 from loguru import logger
 
+from models.action_executor import ActionExecutor, ActionHandle
+from models.backends import InjectionBackend, create_backend
+from models.hotkey_matcher import HotkeyMatcher
+from models.injection_filter import SelfInjectionFilter
+from models.injector import Injector
+from models.input_arbiter import InputArbiter
 from models.keyboard_listener import KeyboardListener
+from models.event_journal import EventJournal, EventKind
+from models.key_codes import KeyHistory, HeldKeys, MODIFIER_BITS_COUNT, describe
 from models.keyboard_presser import KeyboardPresser, KeyboardCommand
+from models.logging_setup import event_logger
+from models.metrics import Metrics
 from models.mouse_clicker import MouseClicker, MouseCommand
-from models.other import KeyInfo, VALID_KEYS, KEYS_WITH_MODIFIERS, ScriptCommand
+from models.other import (
+    KeyInfo,
+    ScriptCommand,
+    parse_hotkey_combination,
+    TRIGGERS,
+    TRIGGER_PRESS,
+    TRIGGER_RELEASE,
+    TRIGGER_LONG_PRESS,
+    TRIGGER_DOUBLE_TAP,
+    DOUBLE_TAP_WINDOW_MS,
+)
+from models.script_runner import ScriptRunner, PROCESS
+
+if TYPE_CHECKING:
+    from models.config import CommandSpec, ConfigWatcher
+    from models.control_server import ControlServer
+    from models.screen_trigger import ScreenTrigger, ScreenWatcher, FrameSource
 
 """
 Need to be able to apply commands like:
@@ -18,96 +44,412 @@ on alt = 9 -> left click 90 times after some seconds delay with click-repeat-del
 
 
 class Manager:
-    def __init__(self):
+    def __init__(
+        self,
+        max_concurrent_actions: Optional[int] = None,
+        spin_threshold_ms: float = 1.0,
+        backend: Union[str, InjectionBackend] = "pyautogui",
+        start_listener: bool = True,
+        metrics: bool = False,
+        journal_path: Optional[str] = None,
+        script_threads: int = 4,
+        script_processes: Optional[int] = None,
+        max_pending_scripts: int = 32,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ):
+        """
+        max_concurrent_actions: how many triggered actions may run at the same time, further triggered actions
+        wait until a running action is done. 'None' means no limit.
+        spin_threshold_ms: how long before a deadline actions stop sleeping and start spinning on the event loop,
+        higher values are more accurate but use more CPU. Increase it on systems with a coarse sleep timer.
+        backend: how keys and mouse clicks are injected, one of the names in 'models.backends.BACKENDS'
+        ("pyautogui", "pynput", "xtest", "recording") or a backend instance. A backend given by name is created
+        in the background after the listener started, so the input library does not delay the start.
+        start_listener: set to 'False' to not listen to the real keyboard, e.g. to feed key presses to
+        'keyboard_on_press' in tests and benchmarks.
+        metrics: collect counters and latency histograms, see 'self.metrics.snapshot()',
+        'self.metrics.serve_prometheus()' and 'self.metrics.start_periodic_dump()'.
+        journal_path: write key presses and injected events to this binary event journal (see 'models.event_journal').
+        script_threads, script_processes, max_pending_scripts: size and limit of the pools that script commands
+        run in, see 'models.script_runner'. The process pool is only started when a script needs it.
+        loop: run actions and injections on this event loop instead of on own threads, and take the time from it.
+        Used by 'models.simulation' to run on a virtual clock.
+        """
+        self.metrics = Metrics(enabled=metrics)
+        # Nanoseconds of a monotonic clock, timestamps of key presses are compared against it
+        self.clock_ns: Callable[[], int] = time.perf_counter_ns
+        if loop is not None:
+            self.clock_ns = lambda: int(loop.time() * 1e9)
+        self.journal: Optional[EventJournal] = EventJournal(journal_path, self.clock_ns) if journal_path else None
+        self.backend = create_backend(backend, lazy=True)
+        # Recognizes the key events injected by this program when the listener receives them
+        self.injection_filter = SelfInjectionFilter()
+        # All injections run on the injector thread
+        self.injector = Injector(
+            self.backend,
+            threaded=loop is None,
+            metrics=self.metrics,
+            journal=self.journal,
+            injection_filter=self.injection_filter,
+        )
+        # Which action currently uses which key, mouse button or the pointer
+        self.arbiter = InputArbiter(metrics=self.metrics)
+        self.spin_threshold_ms = spin_threshold_ms
+        self.executor = ActionExecutor(max_concurrent_actions=max_concurrent_actions, loop=loop)
+        self.executor.start()
+        self.script_runner = ScriptRunner(script_threads, script_processes, max_pending_scripts, metrics=self.metrics)
         self.mouse_clicker = MouseClicker(self)
         self.keyboard_presser = KeyboardPresser(self)
         self.keyboard_listener = KeyboardListener(self)
 
         self.commands: List[Union[KeyboardCommand, MouseCommand, ScriptCommand]] = []
+        # Commands loaded from a config file by name: (fingerprint of the config entry, command)
+        self.config_commands: Dict[str, Tuple[str, Union[KeyboardCommand, MouseCommand, ScriptCommand]]] = {}
+        self.config_watcher: Optional["ConfigWatcher"] = None
+        # Polls the regions of screen triggers, created by the first 'add_screen_trigger'
+        self.screen_watcher: Optional["ScreenWatcher"] = None
+        # Lets other programs trigger and manage actions, started by 'serve_control'
+        self.control_server: Optional["ControlServer"] = None
+        self.hotkey_matcher = HotkeyMatcher()
+        # Guards the registered commands and the hotkey matcher, injections are arbitrated by self.arbiter
         self.lock = RLock()
-        self.previously_pressed_hotkeys: Deque[KeyInfo] = deque()
-        self.ignore_next_key_press: int = 0
-        self.ignore_next_key_release: int = 0
+        # Key codes of the most recently pressed keys, newest first when iterated
+        self.key_history = KeyHistory(20)
+        # Presses older than this many nanoseconds can not be part of a windowed sequence anymore, 0: keep all
+        self._history_horizon = 0
+        # Time spans of the registered windowed sequences in nanoseconds -> how many commands have them
+        self._history_spans: Counter = Counter()
+        self.held_keys = HeldKeys()
+        # Key id -> commands with the "release" trigger that matched when the key was pressed
+        self._release_commands: Dict[int, List[Union[KeyboardCommand, MouseCommand, ScriptCommand]]] = {}
+        # id(command) -> timestamp of the last double tap that triggered it
+        self._last_double_tap: Dict[int, int] = {}
+
+        if start_listener:
+            self.keyboard_listener.start()
+        # Started after the listener because the injector thread first loads the backend
+        self.injector.start()
+
+        self._exit_requested = False
+        # Set by 'request_exit', created by 'run' on the loop that waits for it
+        self._exit_event: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def exit(self) -> bool:
+        return self._exit_requested
 
-        self.keyboard_listener.start()
+    @exit.setter
+    def exit(self, value: bool):
+        if value:
+            self.request_exit()
 
-        self.exit = False
+    def request_exit(self):
+        """ Lets 'run' shut down the manager and return. Can be called from any thread. """
+        self._exit_requested = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._exit_event.set)
 
-    async def run(self):
-        while 1:
-            await asyncio.sleep(0.1)
-            if self.exit:
-                sys.exit(0)
+    async def run(self, drain_timeout: float = 2):
+        """ Waits without polling until 'request_exit' is called, then shuts down (see 'shutdown'). """
+        self._exit_event = asyncio.Event()
+        self._loop = asyncio.get_event_loop()
+        if self._exit_requested:
+            self._exit_event.set()
+        await self._exit_event.wait()
+        await self.shutdown(drain_timeout)
+
+    async def shutdown(self, drain_timeout: float = 2):
+        """
+        Stops listening, cancels all running actions and waits up to 'drain_timeout' seconds until they finished.
+        Then releases every key and mouse button that is still held down and stops all background threads.
+        """
+        logger.info("Shutting down")
+        self.keyboard_listener.stop()
+        if self.control_server is not None:
+            self.control_server.stop()
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        if self.screen_watcher is not None:
+            self.screen_watcher.stop()
+        # Cancelled actions still inject their releases, so the injector keeps running until they are done
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.executor.stop, drain_timeout)
+        # Actions that did not release their keys in time, or that were cancelled between key_down and key_up
+        held = self.injector.held
+        if held:
+            logger.warning(f"Releasing keys and buttons that are still held down: {held}")
+            await asyncio.wait_for(self.injector.release_held(), drain_timeout)
+        self.injector.stop()
+        self.script_runner.stop()
+        if self.journal is not None:
+            self.journal.close()
+        self.metrics.stop()
+        logger.info("Shutdown complete")
 
     def parse_hotkey_combination(self, combination: str) -> List[KeyInfo]:
-        key_infos = []
-        for hotkey in combination.split(","):
-            hotkey = hotkey.strip()
-            keys = hotkey.split("+")
-            key_info = KeyInfo("", False, False, False)
-            for index, key in enumerate(keys):
-                key = key.strip().lower()
-                assert key in KEYS_WITH_MODIFIERS, f"A key from the hotkey has to be one of: {KEYS_WITH_MODIFIERS}"
-                # Last key has to be a hotkey
-                if index == len(keys) - 1:
-                    assert key in VALID_KEYS, f"The final key of a hotkey has to be one of: {VALID_KEYS}"
-                    key_info.key = key
-                # Activate MODIFIERS
-                elif key == "ctrl":
-                    assert key_info.ctrl is False, f"Invalid hotkey: {hotkey}"
-                    key_info.ctrl = True
-                elif key == "alt":
-                    assert key_info.alt is False, f"Invalid hotkey: {hotkey}"
-                    key_info.alt = True
-                elif key == "shift":
-                    assert key_info.shift is False, f"Invalid hotkey: {hotkey}"
-                    key_info.shift = True
-            key_infos.append(key_info)
-        assert key_infos, f"Could not find at least one hotkey from combination: {combination}"
-        return key_infos
+        return parse_hotkey_combination(combination)
 
     def add_hotkey(self, hotkey_combination: str, command: Union[KeyboardCommand, MouseCommand, ScriptCommand]):
-        # TODO Detect duplicate hotkey combinations
         assert isinstance(command, (KeyboardCommand, MouseCommand, ScriptCommand)), f"{type(command)}"
         # TODO Ignore case sensitivity
-        hotkeys = self.parse_hotkey_combination(hotkey_combination)
+        self._register(self.parse_hotkey_combination(hotkey_combination), command)
+
+    def _register(self, hotkeys: List[KeyInfo], command: Union[KeyboardCommand, MouseCommand, ScriptCommand]):
+        hotkey_combination = ",".join("+".join(hotkey.to_hotkey_list) for hotkey in hotkeys)
         if len(hotkeys) != 1 and not all(hotkey == hotkeys[index + 1] for index, hotkey in enumerate(hotkeys[:-1])):
             logger.warning(
                 f"Your hotkey combination is {hotkey_combination}. You proably do not want that unless you only want to trigger the hotkey once a specific amount of the same button has been pressed."
             )
+        assert command.trigger in TRIGGERS, f"Trigger {command.trigger} has to be one of: {TRIGGERS}"
+        if command.trigger == TRIGGER_DOUBLE_TAP:
+            assert len(hotkeys) == 1, f"A double tap is a single key pressed twice, not {hotkey_combination}"
+            hotkeys = hotkeys * 2
+            if not command.window_ms and not command.max_gap_ms:
+                command.window_ms = DOUBLE_TAP_WINDOW_MS
+        if command.window_ms or command.max_gap_ms:
+            assert len(hotkeys) <= self.key_history.size, f"Sequence is longer than the key history: {hotkeys}"
         command.hotkeys = hotkeys
 
-        self.commands.append(command)
+        with self.lock:
+            self.commands.append(command)
+            # Also reports duplicate and overlapping hotkey combinations
+            self.hotkey_matcher.add(hotkeys, command)
+            self._add_history_span(command)
         if isinstance(command, KeyboardCommand):
             logger.info(f"Adding hotkey combination {hotkeys} to execute keyboard actions {command.keyboard_action}")
         elif isinstance(command, MouseCommand):
             logger.info(f"Adding hotkey combination {hotkeys} to execute mouse actions {command.mouse_action}")
         elif isinstance(command, ScriptCommand):
             logger.info(f"Adding hotkey combination {hotkeys} to execute script {command.functions}")
+            if command.run_in == PROCESS:
+                # Worker processes start in the background while the program keeps running
+                self.script_runner.warm()
+
+    def remove_hotkey(self, command: Union[KeyboardCommand, MouseCommand, ScriptCommand]):
+        """ The command can not be triggered anymore, actions that are already running are not cancelled. """
+        with self.lock:
+            self.commands.remove(command)
+            self.hotkey_matcher.remove(command)
+            self._last_double_tap.pop(id(command), None)
+            self._remove_history_span(command)
+        logger.info(f"Removed hotkey combination {command.hotkeys} of {command.name or command}")
+
+    def add_screen_trigger(self, trigger: "ScreenTrigger", frame_source: Optional["FrameSource"] = None):
+        """
+        Triggers the command of the trigger when its condition is met on the screen, see 'models.screen_trigger'.
+        frame_source: where the screen is grabbed from, only used by the first screen trigger. Default: mss or pyautogui.
+        """
+        if self.screen_watcher is None:
+            from models.screen_trigger import ScreenWatcher
+
+            self.screen_watcher = ScreenWatcher(self, frame_source)
+            self.screen_watcher.start()
+        self.screen_watcher.add(trigger)
+        logger.info(f"Adding screen trigger {type(trigger.condition).__name__} in {trigger.region} to execute {trigger.command}")
+
+    def remove_screen_trigger(self, trigger: "ScreenTrigger"):
+        """ The trigger is not polled anymore, commands that were already triggered keep running. """
+        assert self.screen_watcher is not None, f"No screen trigger was added"
+        self.screen_watcher.remove(trigger)
+        logger.info(f"Removed screen trigger {type(trigger.condition).__name__} in {trigger.region}")
+
+    def serve_control(self, path: Optional[str] = None) -> "ControlServer":
+        """
+        Accepts requests to trigger commands, submit and cancel actions and stream stats on a Unix socket,
+        see 'models.control_server' for the protocol. path: of the socket, defaults to one in the temp directory.
+        """
+        if self.control_server is None:
+            from models.control_server import ControlServer
+
+            control_server = ControlServer(self, path)
+            control_server.start()
+            self.control_server = control_server
+        return self.control_server
+
+    def find_command(self, name: str) -> Optional[Union[KeyboardCommand, MouseCommand, ScriptCommand]]:
+        """ The registered command with this name, e.g. the name of a config entry. """
+        with self.lock:
+            for command in self.commands:
+                if command.name == name:
+                    return command
+        return None
+
+    def load_config(self, path: str, watch: bool = False, interval: float = 1.0, cache_dir: Optional[str] = None):
+        """
+        Adds the hotkeys of a TOML or JSON config file, see 'models.config' for the format.
+        watch: poll the file every 'interval' seconds and apply changes while running.
+        """
+        from models.config import ConfigWatcher, load_config
 
-    def keyboard_on_press(self, key_info: KeyInfo):
-        # Ignore hotkeys pressed by this script
-        if self.ignore_next_key_press > 0:
-            self.ignore_next_key_press -= 1
+        self.apply_config(load_config(path, cache_dir))
+        if watch:
+            self.config_watcher = ConfigWatcher(self, path, interval=interval, cache_dir=cache_dir)
+            self.config_watcher.start()
+
+    def apply_config(self, specs: List["CommandSpec"]):
+        """
+        Updates the commands loaded from a config: only commands whose config entry changed are rebuilt,
+        removed entries are unregistered. Running actions of changed commands continue until they are done.
+        """
+        from models.config import build_command
+
+        new_specs = {spec.name: spec for spec in specs}
+        with self.lock:
+            current = {name: fingerprint for name, (fingerprint, _) in self.config_commands.items()}
+        # Importing scripts and building the actions happens before taking the lock, key events do not wait for it
+        built = {
+            spec.name: build_command(self, spec) for spec in specs if current.get(spec.name) != spec.fingerprint
+        }
+        # Called from the config watcher thread: key events see either the old or the new commands, not a mix
+        with self.lock:
+            for name, (fingerprint, command) in list(self.config_commands.items()):
+                if name not in new_specs or name in built:
+                    self.remove_hotkey(command)
+                    del self.config_commands[name]
+            for name, command in built.items():
+                spec = new_specs[name]
+                self._register(spec.hotkeys, command)
+                self.config_commands[name] = (spec.fingerprint, command)
+
+    @staticmethod
+    def _history_span(command: Union[KeyboardCommand, MouseCommand, ScriptCommand]) -> int:
+        """ The longest time span in nanoseconds that the sequence of a command can cover, 0 if it has no limit. """
+        if not command.window_ms and not command.max_gap_ms:
+            return 0
+        return (command.window_ms or command.max_gap_ms * (len(command.hotkeys) - 1)) * 1_000_000
+
+    def _add_history_span(self, command: Union[KeyboardCommand, MouseCommand, ScriptCommand]):
+        # Kept up to date per command, loading a large table of commands does not rescan all of them every time
+        span = self._history_span(command)
+        if span:
+            self._history_spans[span] += 1
+            self._history_horizon = max(self._history_horizon, span)
+
+    def _remove_history_span(self, command: Union[KeyboardCommand, MouseCommand, ScriptCommand]):
+        span = self._history_span(command)
+        if not span:
             return
+        self._history_spans[span] -= 1
+        if self._history_spans[span] <= 0:
+            del self._history_spans[span]
+            if span == self._history_horizon:
+                self._history_horizon = max(self._history_spans, default=0)
+
+    def keyboard_on_press(self, key_info: KeyInfo, timestamp: Optional[int] = None):
+        self.keyboard_on_press_code(key_info.code, timestamp)
+
+    def keyboard_on_release(self, key_info: KeyInfo, timestamp: Optional[int] = None):
+        self.keyboard_on_release_code(key_info.code, timestamp)
 
-        logger.info(f"Key pressed: {key_info}")
-        self.previously_pressed_hotkeys.appendleft(key_info)
-        if len(self.previously_pressed_hotkeys) > 20:
-            self.previously_pressed_hotkeys.pop()
-        for command in self.commands:
-            if command.pressed_keys_match_hotkey(self.previously_pressed_hotkeys):
-                logger.info(f"Command was triggerend: {command}")
-                # How to split asyncio here to execute in parallel? What if 2 hotkeys are pressed?
-                # asyncio.create_task() doesnt work here because it runs on a seperate thread - no event loop runs on this thread
-                if isinstance(command, ScriptCommand):
-                    Thread(target=asyncio.run, args=[command.execute()]).start()
-                elif isinstance(command, KeyboardCommand):
-                    Thread(target=asyncio.run, args=[command.keyboard_action.execute()]).start()
-                elif isinstance(command, MouseCommand):
-                    Thread(target=asyncio.run, args=[command.mouse_action.execute()]).start()
-
-    def keyboard_on_release(self, key_info: KeyInfo):
-        if self.ignore_next_key_release > 0:
-            self.ignore_next_key_release -= 1
+    def keyboard_on_press_code(self, code: int, timestamp: Optional[int] = None):
+        """
+        Handles a pressed key given as key code (see 'models.key_codes'), this is what the listener calls.
+        Keys injected by this program are filtered out by the listener before, see 'self.injection_filter'.
+        timestamp: 'self.clock_ns()' of the key press, defaults to now.
+        """
+        metrics = self.metrics
+        if metrics.enabled:
+            start = time.perf_counter()
+            metrics.increment("key_events")
+        if timestamp is None:
+            timestamp = self.clock_ns()
+        event_logger.opt(lazy=True).debug("Key pressed: {}", lambda: describe(code))
+        if self.journal is not None:
+            self.journal.write_code(EventKind.KeyPress, code, timestamp)
+        key_history = self.key_history
+        key_history.push(code, timestamp)
+        if self._history_horizon:
+            key_history.expire(timestamp - self._history_horizon)
+        new_press = self.held_keys.press(code >> MODIFIER_BITS_COUNT, timestamp)
+        # Commands may be added and removed from other threads, e.g. when the config file changed
+        with self.lock:
+            commands = self.hotkey_matcher.feed_code(code)
+        if metrics.enabled:
+            metrics.record("match_latency", (time.perf_counter() - start) * 1e6)
+            metrics.increment("matches", len(commands))
+        for command in commands:
+            # Timing conditions are only checked for the few commands whose keys matched
+            if (command.window_ms or command.max_gap_ms) and not key_history.sequence_fits(
+                len(command.hotkeys), command.max_gap_ms * 1_000_000, command.window_ms * 1_000_000
+            ):
+                continue
+            self._matched(command, code, timestamp, new_press)
+
+    def _matched(
+        self, command: Union[KeyboardCommand, MouseCommand, ScriptCommand], code: int, timestamp: int, new_press: bool
+    ):
+        trigger = command.trigger
+        if trigger == TRIGGER_PRESS:
+            logger.info("Command was triggered: {}", command)
+            self.trigger_command(command)
+        elif trigger == TRIGGER_DOUBLE_TAP:
+            # The tap after a double tap starts the next double tap
+            if self.key_history.timestamp(1) <= self._last_double_tap.get(id(command), -1):
+                return
+            self._last_double_tap[id(command)] = timestamp
+            logger.info("Command was triggered by a double tap: {}", command)
+            self.trigger_command(command)
+        elif not new_press:
+            # Repeated press of a held key, the release and the long press belong to the first press
             return
+        elif trigger == TRIGGER_RELEASE:
+            self._release_commands.setdefault(code >> MODIFIER_BITS_COUNT, []).append(command)
+        elif trigger == TRIGGER_LONG_PRESS:
+            key_id = code >> MODIFIER_BITS_COUNT
+            serial = self.held_keys.serial(key_id)
+            # The key press may have waited in the listener queue, the hold time counts from the press
+            delay = max(0.0, command.hold_ms / 1000 - (self.clock_ns() - timestamp) / 1e9)
+            loop = self.executor.loop
+            loop.call_soon_threadsafe(loop.call_later, delay, self._long_press_elapsed, command, key_id, serial)
+
+    def _long_press_elapsed(
+        self, command: Union[KeyboardCommand, MouseCommand, ScriptCommand], key_id: int, serial: int
+    ):
+        # Runs on the executor loop, the key must still be held down since the same press. If the loop was busy, the
+        # release may have been handled before this callback although the key was held long enough
+        held_ns = self.held_keys.held_duration(key_id, serial)
+        if self.held_keys.serial(key_id) == serial or (held_ns is not None and held_ns >= command.hold_ms * 1_000_000):
+            logger.info("Command was triggered by a long press: {}", command)
+            self.trigger_command(command)
+
+    def keyboard_on_release_code(self, code: int, timestamp: Optional[int] = None):
+        """
+        Handles a released key given as key code, with the modifiers that are still held down.
+        timestamp: 'self.clock_ns()' of the key release, defaults to now.
+        """
+        if timestamp is None:
+            timestamp = self.clock_ns()
+        key_id = code >> MODIFIER_BITS_COUNT
+        self.held_keys.release(key_id, timestamp)
+        commands = self._release_commands.pop(key_id, None)
+        if commands:
+            for command in commands:
+                logger.info("Command was triggered by a release: {}", command)
+                self.trigger_command(command)
+
+    def command_coroutine(self, command: Union[KeyboardCommand, MouseCommand, ScriptCommand]) -> Coroutine:
+        if isinstance(command, ScriptCommand):
+            return command.execute(self.script_runner)
+        elif isinstance(command, KeyboardCommand):
+            return command.keyboard_action.execute()
+        elif isinstance(command, MouseCommand):
+            return command.mouse_action.execute()
+        raise TypeError(f"Unknown command type: {type(command)}")
+
+    def trigger_command(self, command: Union[KeyboardCommand, MouseCommand, ScriptCommand]) -> ActionHandle:
+        """ Runs the command on the executor loop, can be called from any thread. """
+        # The listener runs on its own thread, so the action is handed over to the executor's event loop
+        coroutine = self.command_coroutine(command)
+        if self.metrics.enabled:
+            self.metrics.increment("triggers")
+            coroutine = self._measured(coroutine, time.perf_counter())
+        return self.executor.submit(coroutine, name=str(command.hotkeys))
+
+    async def _measured(self, coroutine: Coroutine, triggered_at: float):
+        self.metrics.record("trigger_to_start", (time.perf_counter() - triggered_at) * 1e6)
+        self.metrics.in_flight_actions += 1
+        try:
+            return await coroutine
+        finally:
+            self.metrics.in_flight_actions -= 1
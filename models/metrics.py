@@ -0,0 +1,196 @@
+"""
+Runtime metrics of the Manager: counters, latency histograms and a gauge of running actions.
+
+Metrics are disabled by default. Every call site checks 'metrics.enabled' first, so a disabled Metrics object
+costs one attribute lookup per event. Updates do not take locks: if two threads update the same counter at
+the same moment, an increment may very rarely be lost, which is acceptable for monitoring.
+"""
+import json
+import time
+from threading import Thread, Event
+from typing import Callable, Dict, List, Optional, TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+COUNTERS = [
+    "key_events",
+    "ignored_events",
+    "matches",
+    "triggers",
+    "injected_events",
+    "dropped_events",
+    "scripts_rejected",
+    "scripts_timed_out",
+    "arbiter_conflicts",
+    "arbiter_preemptions",
+    "dropped_key_events",
+]
+# All histograms store microseconds
+HISTOGRAMS = ["match_latency", "trigger_to_start", "schedule_error", "key_queue_latency"]
+QUANTILES = [0.5, 0.9, 0.99, 0.999]
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram: values are counted in buckets that are linear below 2^sub_bucket_bits and then
+    log-linear (2^(sub_bucket_bits - 1) buckets per power of two). The relative error of a reported value
+    is at most 2^-(sub_bucket_bits - 1), recording is O(1) and memory is fixed.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7, max_value: int = 3600 * 1000 * 1000):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count // 2
+        self.max_value = max_value
+        self.counts: List[int] = [0] * (self._index(max_value) + 1)
+        self.total = 0
+        self.sum = 0
+        self.min = max_value
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def _value_at(self, index: int) -> int:
+        """ Upper bound of the bucket. """
+        if index < self.sub_bucket_count:
+            return index
+        shift, offset = divmod(index - self.sub_bucket_count, self.half_count)
+        shift += 1
+        return ((self.half_count + offset + 1) << shift) - 1
+
+    def record(self, value: float):
+        value = min(max(int(value), 0), self.max_value)
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, quantile: float) -> int:
+        if self.total == 0:
+            return 0
+        target = max(1, int(quantile * self.total + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._value_at(index), self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.total,
+            "sum": self.sum,
+            "min": self.min if self.total else 0,
+            "max": self.max,
+            "mean": self.sum / self.total if self.total else 0,
+            **{f"p{quantile * 100:g}": self.percentile(quantile) for quantile in QUANTILES},
+        }
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False, prefix: str = "auto_clicker"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self.histograms: Dict[str, LatencyHistogram] = {name: LatencyHistogram() for name in HISTOGRAMS}
+        # Gauge: amount of actions that are currently running
+        self.in_flight_actions = 0
+        # Further gauges by name, read when a snapshot is taken
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self._server: Optional["ThreadingHTTPServer"] = None
+        self._stop_dump: Optional[Event] = None
+
+    def increment(self, counter: str, amount: int = 1):
+        self.counters[counter] += amount
+
+    def record(self, histogram: str, microseconds: float):
+        self.histograms[histogram].record(microseconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "timestamp": time.time(),
+            "counters": dict(self.counters),
+            "gauges": {"in_flight_actions": self.in_flight_actions, **self._read_gauges()},
+            "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+        }
+
+    def _read_gauges(self) -> Dict[str, float]:
+        return {name: gauge() for name, gauge in self.gauges.items()}
+
+    def prometheus_text(self) -> str:
+        """ Metrics in the Prometheus text exposition format. """
+        lines = []
+        for name, value in self.counters.items():
+            lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+            lines.append(f"{self.prefix}_{name}_total {value}")
+        gauges = {"in_flight_actions": self.in_flight_actions, **self._read_gauges()}
+        for name, value in gauges.items():
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.append(f"{self.prefix}_{name} {value}")
+        for name, histogram in self.histograms.items():
+            metric = f"{self.prefix}_{name}_microseconds"
+            lines.append(f"# TYPE {metric} summary")
+            for quantile in QUANTILES:
+                lines.append(f'{metric}{{quantile="{quantile}"}} {histogram.percentile(quantile)}')
+            lines.append(f"{metric}_sum {histogram.sum}")
+            lines.append(f"{metric}_count {histogram.total}")
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port: int = 9464, host: str = "127.0.0.1"):
+        """ Serves the Prometheus text format on http://host:port/metrics in a background thread. """
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{self._server.server_port}/metrics")
+
+    def start_periodic_dump(self, interval_seconds: float = 60, path: Optional[str] = None):
+        """ Appends a JSON snapshot to 'path' (or logs it if no path is given) every 'interval_seconds'. """
+        self._stop_dump = stop = Event()
+
+        def dump():
+            while not stop.wait(interval_seconds):
+                text = json.dumps(self.snapshot())
+                if path is None:
+                    logger.info(f"Metrics: {text}")
+                else:
+                    with open(path, "a") as f:
+                        f.write(text + "\n")
+
+        Thread(target=dump, name="MetricsDump", daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._stop_dump is not None:
+            self._stop_dump.set()
+            self._stop_dump = None
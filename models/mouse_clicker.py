@@ -1,13 +1,20 @@
+from array import array
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Optional, List
+from typing import TYPE_CHECKING, Optional, List, Tuple
 
 if TYPE_CHECKING:
     from .manager import Manager
 
+from models.action_program import ActionProgram, MOUSE
+from models.input_arbiter import POINTER, WHEEL
 from models.other import MouseInfo, Click, Command, Action
-import pyautogui
 import asyncio
-from loguru import logger
+from models.logging_setup import event_logger
+from models.scheduler import DeadlineScheduler
+
+
+# Which mouse button a click uses
+CLICK_BUTTONS = {Click.Left: "left", Click.Right: "right", Click.Middle: "middle", Click.DoubleClick: "left"}
 
 
 class MouseClicker:
@@ -15,37 +22,114 @@ class MouseClicker:
         self.manager = manager
 
     async def _left_click(self, x: Optional[int], y: Optional[int]):
-        pyautogui.click(x, y)
+        await self.manager.injector.call("click", "left", x, y)
 
     async def _right_click(self, x: Optional[int], y: Optional[int]):
-        pyautogui.rightClick(x, y)
+        await self.manager.injector.call("click", "right", x, y)
 
     async def _middle_click(self, x: Optional[int], y: Optional[int]):
-        pyautogui.middleClick(x, y)
+        await self.manager.injector.call("click", "middle", x, y)
 
     # TODO Back and forward mouse buttons
     # TODO Hold down mouse button
 
     async def _double_click(self, x: Optional[int], y: Optional[int]):
-        pyautogui.doubleClick(x, y)
-
-    async def _move(self, x: int, y: int, duration_milliseconds: int):
-        logger.info(f"Moving mouse to x={x} y={y} over duration {duration_milliseconds}")
-        pyautogui.moveTo(x, y, duration=duration_milliseconds / 1000)
+        await self.manager.injector.call("click", "left", x, y, 2)
+
+    async def _target(self, mouse_info: MouseInfo) -> Tuple[Optional[int], Optional[int]]:
+        """ Absolute coordinates of the mouse action, 'None' means the coordinate stays the same. """
+        if mouse_info.relative_x is None and mouse_info.relative_y is None:
+            return mouse_info.x, mouse_info.y
+        x, y = await self.manager.injector.call("position")
+        return x + (mouse_info.relative_x or 0), y + (mouse_info.relative_y or 0)
+
+    async def _move(
+        self,
+        x: Optional[int],
+        y: Optional[int],
+        duration_milliseconds: int,
+        path: str = "linear",
+        moves_per_second: int = 100,
+        relative: bool = False,
+    ):
+        """ Moves to x, y (or by x, y if 'relative' is set) along a precomputed path, see 'models.trajectory'. """
+        # numpy is only imported once the mouse is moved
+        from models.trajectory import trajectory
+
+        event_logger.debug("Moving mouse to x={} y={} over duration {}", x, y, duration_milliseconds)
+        # The pointer belongs to this action until it arrived
+        async with self.manager.arbiter.mouse(move=True):
+            injector = self.manager.injector
+            start_x, start_y = await injector.call("position")
+            if relative:
+                target_x, target_y = start_x + (x or 0), start_y + (y or 0)
+            else:
+                target_x = start_x if x is None else x
+                target_y = start_y if y is None else y
+            assert moves_per_second > 0, f"{moves_per_second}"
+            steps = max(1, duration_milliseconds * moves_per_second // 1000)
+            offsets = trajectory(target_x - start_x, target_y - start_y, steps, path).tolist()
+            # Steps are scheduled as absolute deadlines, the time spent on injecting does not add up
+            scheduler = DeadlineScheduler(spin_threshold_ms=0)
+            scheduler.start()
+            step_milliseconds = duration_milliseconds / steps
+            previous = None
+            for index, (offset_x, offset_y) in enumerate(offsets):
+                if index > 0:
+                    await scheduler.wait(step_milliseconds)
+                if (offset_x, offset_y) != previous:
+                    await injector.call("move_to", start_x + offset_x, start_y + offset_y)
+                    previous = offset_x, offset_y
+
+    async def mouse_down(self, button: str = "left"):
+        async with self.manager.arbiter.mouse(button):
+            await self.manager.injector.call("mouse_down", button)
+
+    async def mouse_up(self, button: str = "left"):
+        async with self.manager.arbiter.mouse(button):
+            await self.manager.injector.call("mouse_up", button)
+
+    async def move_to(self, x: int, y: int):
+        """ Moves the mouse immediately. """
+        async with self.manager.arbiter.mouse(move=True):
+            await self.manager.injector.call("move_to", x, y)
+
+    async def scroll(self, dx: int, dy: int):
+        async with self.manager.arbiter.acquire_resources([WHEEL], [POINTER]):
+            await self.manager.injector.call("scroll", dx, dy)
 
     async def do_mouse_action(self, mouse_info: MouseInfo):
         """ Do one mouse action """
-        with self.manager.lock:
-            if mouse_info.click == Click.Move:
-                await self._move(mouse_info.x, mouse_info.y, mouse_info.duration)
-            elif mouse_info.click == Click.DoubleClick:
-                await self._double_click(mouse_info.x, mouse_info.y)
-            elif mouse_info.click == Click.Left:
-                await self._left_click(mouse_info.x, mouse_info.y)
-            elif mouse_info.click == Click.Right:
-                await self._right_click(mouse_info.x, mouse_info.y)
-            elif mouse_info.click == Click.Middle:
-                await self._middle_click(mouse_info.x, mouse_info.y)
+        # The injection runs on the injector thread, awaiting it does not block other actions
+        click = mouse_info.click
+        if click == Click.Move:
+            await self._move(mouse_info.x, mouse_info.y, mouse_info.duration, mouse_info.path, mouse_info.moves_per_second)
+            return
+        if click == Click.MoveRelative:
+            await self._move(
+                mouse_info.relative_x,
+                mouse_info.relative_y,
+                mouse_info.duration,
+                mouse_info.path,
+                mouse_info.moves_per_second,
+                relative=True,
+            )
+            return
+        button = CLICK_BUTTONS.get(click)
+        if button is None:
+            return
+        coordinates = (mouse_info.x, mouse_info.y, mouse_info.relative_x, mouse_info.relative_y)
+        moves = any(coordinate is not None for coordinate in coordinates)
+        async with self.manager.arbiter.mouse(button, move=moves):
+            x, y = await self._target(mouse_info)
+            if click == Click.DoubleClick:
+                await self._double_click(x, y)
+            elif click == Click.Left:
+                await self._left_click(x, y)
+            elif click == Click.Right:
+                await self._right_click(x, y)
+            elif click == Click.Middle:
+                await self._middle_click(x, y)
 
     async def do_mouse_actions(self, mouse_infos: List[MouseInfo]):
         """ Do a sequence of mouse action: click, move, double click, right click """
@@ -65,7 +149,21 @@ class MouseAction(Action):
 
     def __post_init__(self):
         assert self.mouse_actions, f"Action field is empty"
-        # TODO Only one field needs to be used: coordinate or relative or none of them
+        coordinate = self.coordinate_x is not None or self.coordinate_y is not None
+        relative = self.relative_x is not None or self.relative_y is not None
+        assert not (coordinate and relative), f"Only use either coordinate or relative coordinates"
+
+    def compile(self) -> ActionProgram:
+        """ Every repetition starts with moving to the coordinates of the action, if they are set. """
+        program = super().compile()
+        if self.coordinate_x is not None or self.coordinate_y is not None:
+            move = MouseInfo(click=Click.Move, x=self.coordinate_x, y=self.coordinate_y)
+        elif self.relative_x is not None or self.relative_y is not None:
+            move = MouseInfo(click=Click.MoveRelative, relative_x=self.relative_x, relative_y=self.relative_y)
+        else:
+            return program
+        program.body[0:0] = array("i", [MOUSE, program.add_operand(move)])
+        return program
 
 
 @dataclass
@@ -78,9 +176,16 @@ class MouseCommand(Command):
 
 if __name__ == "__main__":
     # Local testing
+    from types import SimpleNamespace
+
+    from models.backends import PyAutoGuiBackend
+    from models.injector import Injector
+    from models.input_arbiter import InputArbiter
 
     async def main():
-        clicker = MouseClicker(None)
+        clicker = MouseClicker(
+            SimpleNamespace(injector=Injector(PyAutoGuiBackend(), threaded=False), arbiter=InputArbiter())
+        )
 
         # Double click, then rightclick
         double_click = MouseInfo(click=Click.DoubleClick, delay=2000)
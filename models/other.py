@@ -1,9 +1,17 @@
 import asyncio
 import enum
 import string
+from array import array
 from dataclasses import dataclass, field
-from typing import Optional, List, Generator, Union, Deque, Awaitable, TYPE_CHECKING
+from typing import Optional, List, Union, Awaitable, TYPE_CHECKING
 
+from loguru import logger
+
+from models import key_codes
+from models.action_program import ActionProgram, SLEEP, PRESS, HOLD, MOUSE, TYPE, REPEAT_FOREVER
+from models.input_arbiter import action_priority
+from models.scheduler import DeadlineScheduler, TimingStats
+from models.script_runner import ScriptRunner, RUN_IN, LOOP
 
 if TYPE_CHECKING:
     from models.manager import Manager
@@ -19,6 +27,15 @@ for number in range(1, 13):
 MODIFIERS = ["ctrl", "alt", "shift"]
 KEYS_WITH_MODIFIERS = VALID_KEYS | set(MODIFIERS)
 
+# When a command is triggered, see 'Command.trigger'
+TRIGGER_PRESS = "press"
+TRIGGER_RELEASE = "release"
+TRIGGER_LONG_PRESS = "long_press"
+TRIGGER_DOUBLE_TAP = "double_tap"
+TRIGGERS = [TRIGGER_PRESS, TRIGGER_RELEASE, TRIGGER_LONG_PRESS, TRIGGER_DOUBLE_TAP]
+# Default 'window_ms' of double taps
+DOUBLE_TAP_WINDOW_MS = 300
+
 
 class Click(enum.Enum):
     # What mouse action to do
@@ -46,6 +63,10 @@ class MouseInfo:
     delay: int = 0
     # How long a mouse moves to target location
     duration: int = 0
+    # Shape of the movement, one of 'models.trajectory.PATHS': "linear", "ease_in_out", "bezier", "human"
+    path: str = "linear"
+    # How often the mouse position is updated while moving over a duration
+    moves_per_second: int = 100
 
 
 @dataclass
@@ -80,16 +101,22 @@ class KeyInfo:
         keys.append(self.key)
         return keys
 
+    @property
+    def code(self) -> int:
+        """ Compact key code of this key press, see 'models.key_codes'. Modifiers that are 'None' count as not pressed. """
+        return key_codes.encode(self.key, key_codes.modifier_mask(self.ctrl, self.alt, self.shift))
+
     def copy(self) -> "KeyInfo":
         return KeyInfo(self.key, self.ctrl, self.alt, self.shift, self.delay, self.duration)
 
     def __eq__(self, other: "KeyInfo"):
         assert isinstance(other, KeyInfo)
-        return self.key == other.key and all(
-            self_modifier is None or other_modifier is None or self_modifier is other_modifier
-            for self_modifier, other_modifier in zip(
-                [self.ctrl, self.alt, self.shift], [other.ctrl, other.alt, other.shift]
-            )
+        # A modifier that is 'None' matches both states
+        return (
+            self.key == other.key
+            and (self.ctrl is None or other.ctrl is None or self.ctrl is other.ctrl)
+            and (self.alt is None or other.alt is None or self.alt is other.alt)
+            and (self.shift is None or other.shift is None or self.shift is other.shift)
         )
 
     def __ne__(self, other: "KeyInfo"):
@@ -97,6 +124,35 @@ class KeyInfo:
         return not (self == other)
 
 
+def parse_hotkey_combination(combination: str) -> List[KeyInfo]:
+    """ Parses a hotkey combination like "ctrl+e" or "h,e,l,l,o" into the keys that have to be pressed in order. """
+    key_infos = []
+    for hotkey in combination.split(","):
+        hotkey = hotkey.strip()
+        keys = hotkey.split("+")
+        key_info = KeyInfo("", False, False, False)
+        for index, key in enumerate(keys):
+            key = key.strip().lower()
+            assert key in KEYS_WITH_MODIFIERS, f"A key from the hotkey has to be one of: {KEYS_WITH_MODIFIERS}"
+            # Last key has to be a hotkey
+            if index == len(keys) - 1:
+                assert key in VALID_KEYS, f"The final key of a hotkey has to be one of: {VALID_KEYS}"
+                key_info.key = key
+            # Activate MODIFIERS
+            elif key == "ctrl":
+                assert key_info.ctrl is False, f"Invalid hotkey: {hotkey}"
+                key_info.ctrl = True
+            elif key == "alt":
+                assert key_info.alt is False, f"Invalid hotkey: {hotkey}"
+                key_info.alt = True
+            elif key == "shift":
+                assert key_info.shift is False, f"Invalid hotkey: {hotkey}"
+                key_info.shift = True
+        key_infos.append(key_info)
+    assert key_infos, f"Could not find at least one hotkey from combination: {combination}"
+    return key_infos
+
+
 @dataclass
 class Action:
     manager: "Manager"
@@ -115,49 +171,101 @@ class Action:
     repeat_amount: int = 0
     # TODO Toggle on / off
     toggled_state: bool = False
+    # Actions with a higher priority get the keys and mouse buttons they wait for first, see 'models.input_arbiter'
+    priority: int = 0
+    # Cancel running actions with a lower priority that use keys or mouse buttons this action waits for
+    preempt: bool = False
+    # How accurately the last execution kept the delays, set by 'execute()'
+    timing_stats: Optional[TimingStats] = field(default=None, init=False, repr=False, compare=False)
+    # Compiled on the first execution, see 'program'
+    _program: Optional[ActionProgram] = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name: str, value):
+        # Assigning any field invalidates the compiled program
+        if name not in ("_program", "timing_stats"):
+            object.__setattr__(self, "_program", None)
+        object.__setattr__(self, name, value)
+
+    @property
+    def program(self) -> ActionProgram:
+        """
+        The compiled program, which is cached until a field of the action is assigned.
+        Call 'invalidate' after changing the lists of the action or their KeyInfo / MouseInfo in place.
+        """
+        program = self._program
+        if program is None:
+            program = self._program = self.compile()
+        return program
+
+    def invalidate(self):
+        self._program = None
 
     def __post_init__(self):
         assert self.start_delay >= 0, f"{self.start_delay}"
         assert self.repeat_delay >= 0, f"{self.repeat_delay}"
         assert self.repeat_amount >= 0, f"{self.repeat_amount}"
 
-    def actions(self) -> Generator[Union[int, Union[KeyInfo, MouseInfo]], None, None]:
+    def compile(self) -> ActionProgram:
         """
-        This function returns the instruction to the thread:
-        yield an integer which means waiting time in milliseconds
-        yield a KeyInfo which means that keypress should be executed
-        (in MouseAction: yield a MouseInfo which means that mouse action should be executed)
+        Compiles the action into a flat instruction program, see 'models.action_program'.
+        The fields are validated once here instead of on every repetition.
         """
-        if self.start_delay:
-            yield self.start_delay
-        while 1:
-            for _ in range(self.repeat_amount + 1):
-                for key_info in self.hotkeys_to_press:
-                    assert isinstance(key_info, KeyInfo)
-                    yield key_info
-                    yield key_info.delay
-                for mouse_info in self.mouse_actions:
-                    assert isinstance(mouse_info, MouseInfo)
-                    yield mouse_info
-                    yield mouse_info.delay
-                yield self.repeat_delay
-            if not self.toggled_state:
-                return
+        program = ActionProgram()
+        program.emit(program.prelude, SLEEP, self.start_delay)
+        for key_info in self.hotkeys_to_press:
+            assert isinstance(key_info, KeyInfo)
+            opcode = HOLD if key_info.duration > 0 else PRESS
+            program.emit(program.body, opcode, program.add_operand(key_info))
+            program.emit(program.body, SLEEP, key_info.delay)
+        for mouse_info in self.mouse_actions:
+            assert isinstance(mouse_info, MouseInfo)
+            program.emit(program.body, MOUSE, program.add_operand(mouse_info))
+            program.emit(program.body, SLEEP, mouse_info.delay)
+        program.emit(program.body, SLEEP, self.repeat_delay)
+        program.repeat = REPEAT_FOREVER if self.toggled_state else self.repeat_amount + 1
+        if program.repeat != 1 and SLEEP not in program.body[::2]:
+            # Without any delay the body would never yield when the injector does not await, e.g. 'threaded=False'
+            program.body.extend([SLEEP, 0])
+        return program
 
     async def execute(self):
-        for action in self.actions():
-            if isinstance(action, int):
-                await asyncio.sleep(action / 1000)
-            elif isinstance(action, KeyInfo):
+        program = self.program
+        # Delays are scheduled as absolute deadlines so that the time spent on pressing does not add up
+        scheduler = DeadlineScheduler(spin_threshold_ms=self.manager.spin_threshold_ms, metrics=self.manager.metrics)
+        self.timing_stats = scheduler.stats
+        token = action_priority.set((self.priority, self.preempt))
+        try:
+            scheduler.start()
+            await self._run_instructions(program.prelude, program.operands, scheduler)
+            repeat = program.repeat
+            while repeat != 0:
+                await self._run_instructions(program.body, program.operands, scheduler)
+                if repeat > 0:
+                    repeat -= 1
+        finally:
+            action_priority.reset(token)
+        logger.info("Action finished: {}", scheduler.stats)
+
+    async def _run_instructions(self, code: array, operands: list, scheduler: DeadlineScheduler):
+        keyboard_presser = self.manager.keyboard_presser
+        mouse_clicker = self.manager.mouse_clicker
+        for opcode, operand in ActionProgram.instructions(code):
+            if opcode == SLEEP:
+                await scheduler.wait(operand)
+                continue
+            if opcode == PRESS:
                 # Press keyboard hotkey / combination
-                if action.duration > 0:
-                    await self.manager.keyboard_presser.hold_down_button(action)
-                else:
-                    self.manager.ignore_next_key_press += 1
-                    await self.manager.keyboard_presser.press_hotkey(action)
-            elif isinstance(action, MouseInfo):
-                # Press mouse
-                await self.manager.mouse_clicker.do_mouse_action(action)
+                await keyboard_presser.press_hotkey(operands[operand])
+            elif opcode == HOLD:
+                await keyboard_presser.hold_down_button(operands[operand])
+            elif opcode == MOUSE:
+                await mouse_clicker.do_mouse_action(operands[operand])
+            elif opcode == TYPE:
+                text_action = operands[operand]
+                await keyboard_presser.type_text(
+                    text_action.text, text_action.chars_per_second, text_action.paste_min_length
+                )
+            scheduler.event_done()
 
 
 @dataclass
@@ -166,6 +274,16 @@ class Command:
 
     # TRIGGER CONDITIONS
     hotkeys: List[KeyInfo] = field(default_factory=lambda: [])
+    # Identifies the command in a config file (see 'models.config'), commands are updated and removed by name
+    name: str = ""
+    # One of TRIGGERS. "press": when the last key of the combination is pressed, "release": when it is released again,
+    # "long_press": when it was held down for 'hold_ms', "double_tap": a single key pressed twice within 'window_ms'
+    trigger: str = TRIGGER_PRESS
+    # Sequences only match if no two keys were pressed more than 'max_gap_ms' apart, 0 means no limit
+    max_gap_ms: int = 0
+    # Sequences only match if they were pressed within 'window_ms' from the first to the last key, 0 means no limit
+    window_ms: int = 0
+    hold_ms: int = 500
 
     # OPTIONS
     # TODO Should this action be active until toggled off again?
@@ -174,14 +292,6 @@ class Command:
     def __post_init__(self):
         assert not self.hotkeys, f"Do not enter data here. Will be filled out automatically by the script."
 
-    def pressed_keys_match_hotkey(self, previous_hotkeys: Deque[KeyInfo]) -> bool:
-        if len(self.hotkeys) > len(previous_hotkeys):
-            return False
-        for hotkey, previous_hotkey in zip(reversed(self.hotkeys), previous_hotkeys):
-            if hotkey != previous_hotkey:
-                return False
-        return True
-
 
 @dataclass
 class ScriptCommand(Command):
@@ -189,28 +299,45 @@ class ScriptCommand(Command):
 
     functions: List[Union[callable, Awaitable]] = field(default_factory=lambda: [])
     start_delay: int = 0
+    # Where the functions run, one of 'models.script_runner.RUN_IN': "loop", "thread" or "process".
+    # 'None' runs every function on the loop like before the script runner existed, blocking functions should
+    # use "thread" or "process"
+    run_in: Optional[str] = None
+    # Milliseconds after which a function is given up on, 0 means no timeout
+    timeout: int = 0
 
     def __post_init__(self):
         assert self.start_delay >= 0, f"{self.start_delay}"
+        assert self.run_in is None or self.run_in in RUN_IN, f"{self.run_in} has to be one of: {RUN_IN}"
+        assert self.timeout >= 0, f"{self.timeout}"
 
-    async def execute(self):
-        if self.start_delay:
-            await asyncio.sleep(self.start_delay / 1000)
-
-        for execute_function in self.functions:
-            # logger.info(f"Type iscallable: {callable(execute_function)}")
-            # logger.info(f"Type isfuture: {asyncio.isfuture(execute_function)}")
-            # logger.info(f"Type iscoroutine: {asyncio.iscoroutine(execute_function)}")
-            # logger.info(f"Type iscoroutinefunction: {asyncio.iscoroutinefunction(execute_function)}")
-
-            # # Is Async function
-            if asyncio.iscoroutinefunction(execute_function):
-                asyncio.create_task(execute_function())
-                # await execute_function()
-            # Is Async function but already was executed() but not awaited
-            elif asyncio.iscoroutine(execute_function):
-                asyncio.create_task(execute_function)
-                # await execute_function
-            # Is just a normal function waiting to be called
-            elif callable(execute_function):
-                execute_function()
+    def runs_in(self, function: Union[callable, Awaitable]) -> str:
+        if self.run_in is not None:
+            return self.run_in
+        return LOOP
+
+    async def execute(self, script_runner: Optional[ScriptRunner] = None) -> list:
+        """
+        Runs the functions one after another and returns their results.
+        An exception or timeout of a function stops the command and is raised.
+        """
+        if script_runner is None:
+            # Without a manager, e.g. when executed directly
+            own_runner = script_runner = ScriptRunner()
+        else:
+            own_runner = None
+        try:
+            if self.start_delay:
+                await asyncio.sleep(self.start_delay / 1000)
+
+            results = []
+            for execute_function in self.functions:
+                result = await script_runner.run(
+                    execute_function, self.runs_in(execute_function), self.timeout / 1000 if self.timeout else None
+                )
+                logger.info("Script {} returned {!r}", getattr(execute_function, "__name__", execute_function), result)
+                results.append(result)
+            return results
+        finally:
+            if own_runner is not None:
+                own_runner.stop()
@@ -0,0 +1,138 @@
+import asyncio
+import math
+from dataclasses import dataclass
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from models.metrics import Metrics
+
+
+@dataclass
+class TimingStats:
+    """ How accurately an action kept its schedule. Errors are in milliseconds, positive means late. """
+
+    # Amount of executed inputs (key presses, mouse clicks)
+    events: int = 0
+    # Amount of waits
+    steps: int = 0
+    # Seconds from start until the last wait or event
+    elapsed: float = 0
+    # Seconds the action should have taken according to its delays
+    requested: float = 0
+    mean_error: float = 0
+    max_error: float = 0
+    # Running sum of squared differences from the mean (Welford)
+    _m2: float = 0
+
+    def add_error(self, error_ms: float):
+        self.steps += 1
+        delta = error_ms - self.mean_error
+        self.mean_error += delta / self.steps
+        self._m2 += delta * (error_ms - self.mean_error)
+        self.max_error = max(self.max_error, error_ms)
+
+    @property
+    def jitter(self) -> float:
+        """ Standard deviation of the schedule error in milliseconds. """
+        if self.steps < 2:
+            return 0
+        return math.sqrt(self._m2 / (self.steps - 1))
+
+    @property
+    def achieved_rate(self) -> float:
+        """ Executed inputs per second. """
+        return self.events / self.elapsed if self.elapsed > 0 else 0
+
+    @property
+    def requested_rate(self) -> float:
+        return self.events / self.requested if self.requested > 0 else 0
+
+    def __str__(self):
+        return (
+            f"{self.events} events in {self.elapsed:.3f}s (requested {self.requested:.3f}s), "
+            f"rate {self.achieved_rate:.1f}/s (requested {self.requested_rate:.1f}/s), "
+            f"error mean {self.mean_error:.3f}ms max {self.max_error:.3f}ms, jitter {self.jitter:.3f}ms"
+        )
+
+
+class DeadlineScheduler:
+    """
+    Waits until absolute deadlines instead of sleeping relative durations, so the time spent on injecting input
+    and the wakeup delay of the event loop do not add up: if one step wakes up late, the next sleep is shorter.
+
+    The last 'spin_threshold_ms' before a deadline are spent yielding to the event loop instead of sleeping,
+    because sleeping is only accurate to about a millisecond (or worse, depending on the OS timer).
+    If the schedule falls behind by more than 'max_lag_ms', the schedule restarts from the current time
+    instead of firing all missed steps at once.
+    """
+
+    def __init__(
+        self, spin_threshold_ms: float = 1.0, max_lag_ms: Optional[float] = 1000, metrics: Optional["Metrics"] = None
+    ):
+        assert spin_threshold_ms >= 0, f"{spin_threshold_ms}"
+        self.metrics = metrics
+        self.spin_threshold = spin_threshold_ms / 1000
+        self.max_lag = None if max_lag_ms is None else max_lag_ms / 1000
+        self.stats = TimingStats()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._start = 0
+        self._deadline = 0
+        # Seconds the schedule was moved back after falling behind by more than 'max_lag'
+        self._shift = 0
+
+    def start(self):
+        # The loop clock is monotonic, using it also allows running the scheduler on a simulated clock
+        self._loop = asyncio.get_event_loop()
+        self._start = self._deadline = self._loop.time()
+        self._shift = 0
+
+    def event_done(self):
+        """ Counts one executed input. """
+        self.stats.events += 1
+        self.stats.elapsed = self._loop.time() - self._start
+
+    async def wait(self, milliseconds: float):
+        if self._loop is None:
+            self.start()
+        if milliseconds <= 0:
+            # Give other actions the chance to run
+            await asyncio.sleep(0)
+            return
+        self._deadline += milliseconds / 1000
+        self.stats.requested += milliseconds / 1000
+        await self._wait_for_deadline()
+
+    async def wait_until(self, seconds: float):
+        """
+        Waits until 'seconds' after 'start', e.g. to replay events at their recorded offsets. Every deadline is
+        relative to the start, so lateness of earlier steps is not carried over. A deadline that already passed
+        (e.g. of an out of order event) returns right away and is counted as late.
+        """
+        if self._loop is None:
+            self.start()
+        self._deadline = self._start + self._shift + seconds
+        self.stats.requested = max(self.stats.requested, seconds)
+        await self._wait_for_deadline()
+
+    async def _wait_for_deadline(self):
+        loop = self._loop
+        remaining = self._deadline - loop.time()
+        if remaining > self.spin_threshold:
+            await asyncio.sleep(remaining - self.spin_threshold)
+        elif remaining <= 0:
+            # Give other actions the chance to run
+            await asyncio.sleep(0)
+        # Without a spin threshold the sleep is trusted (e.g. on a virtual clock, see 'models.simulation')
+        while self.spin_threshold and loop.time() < self._deadline:
+            await asyncio.sleep(0)
+
+        now = loop.time()
+        error = now - self._deadline
+        self.stats.add_error(error * 1000)
+        if self.metrics is not None and self.metrics.enabled:
+            self.metrics.record("schedule_error", error * 1e6)
+        self.stats.elapsed = now - self._start
+        if self.max_lag is not None and error > self.max_lag:
+            # Later deadlines of 'wait_until' are moved back by the same amount
+            self._shift += error
+            self._deadline = now
@@ -0,0 +1,395 @@
+"""
+Triggers commands when something appears or changes on the screen.
+
+A 'ScreenTrigger' watches one region of the screen: it grabs only that region from a 'FrameSource', optionally
+downsamples it and checks a 'Condition' on it. All comparisons work on whole numpy arrays.
+The 'ScreenWatcher' polls all triggers of a manager on one thread. Each trigger polls at 'min_interval_ms' while
+the region changes and slows down up to 'max_interval_ms' while it stays the same.
+
+Frames are numpy arrays of shape (height, width, 3) with dtype uint8 in RGB order.
+
+'mss' is not a dependency of this project: install it ('pip install mss') for the fastest grabs, without it the
+screen is grabbed with pyautogui, which takes a screenshot of the whole screen for every region.
+"""
+import heapq
+import itertools
+import time
+from threading import Thread, Event, Lock
+from typing import Optional, Tuple, List, Dict, Callable, Union, NamedTuple, TYPE_CHECKING
+
+import numpy as np
+from loguru import logger
+
+if TYPE_CHECKING:
+    from models.keyboard_presser import KeyboardCommand
+    from models.manager import Manager
+    from models.mouse_clicker import MouseCommand
+    from models.other import ScriptCommand
+
+
+class Region(NamedTuple):
+    """ Rectangle on the screen in pixels. """
+
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+class FrameSource:
+    """ Base class of all frame sources. Subclasses only have to implement 'grab'. """
+
+    def grab(self, region: Region) -> np.ndarray:
+        """ Returns the pixels of the region as (height, width, 3) uint8 RGB array. """
+        raise NotImplementedError
+
+
+class MssFrameSource(FrameSource):
+    """ Grabs regions with the 'mss' library, which only copies the requested region from the screen. """
+
+    def __init__(self):
+        import mss
+
+        self._mss = mss
+        self._screenshot = None
+
+    def grab(self, region: Region) -> np.ndarray:
+        if self._screenshot is None:
+            # mss objects can only be used on the thread that created them, which is the watcher thread
+            self._screenshot = self._mss.mss()
+        image = self._screenshot.grab({"left": region.x, "top": region.y, "width": region.width, "height": region.height})
+        # BGRA -> RGB
+        return np.asarray(image)[:, :, 2::-1]
+
+
+class PyAutoGuiFrameSource(FrameSource):
+    """ Grabs regions with pyautogui (pyscreeze), slower than mss. """
+
+    def __init__(self):
+        import pyautogui
+
+        self.pyautogui = pyautogui
+
+    def grab(self, region: Region) -> np.ndarray:
+        return np.asarray(self.pyautogui.screenshot(region=tuple(region)))[:, :, :3]
+
+
+class SyntheticFrameSource(FrameSource):
+    """ Serves regions of a screen image that is set by code, used for tests and benchmarks without a display. """
+
+    def __init__(self, screen: np.ndarray):
+        self.screen = screen
+        self.grabs = 0
+
+    def grab(self, region: Region) -> np.ndarray:
+        self.grabs += 1
+        return self.screen[region.y : region.y + region.height, region.x : region.x + region.width]
+
+
+def create_frame_source() -> FrameSource:
+    """ Returns the fastest frame source that is installed: mss if it is installed, otherwise pyautogui. """
+    try:
+        return MssFrameSource()
+    except ImportError:
+        logger.info("mss is not installed, grabbing the screen with pyautogui")
+        return PyAutoGuiFrameSource()
+
+
+def grayscale(frame: np.ndarray) -> np.ndarray:
+    """ Luminance of a RGB frame as float32 array of shape (height, width). """
+    return frame[:, :, :3].astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def resize_area(image: np.ndarray, height: int, width: int) -> np.ndarray:
+    """ Shrinks an image to (height, width) by averaging the pixels of each output pixel. """
+    image_height, image_width = image.shape[:2]
+    assert image_height >= height and image_width >= width, f"Image {image.shape} is smaller than {(height, width)}"
+    rows = np.arange(height) * image_height // height
+    columns = np.arange(width) * image_width // width
+    sums = np.add.reduceat(np.add.reduceat(image, rows, axis=0), columns, axis=1)
+    counts = np.outer(np.diff(np.append(rows, image_height)), np.diff(np.append(columns, image_width)))
+    if sums.ndim == 3:
+        counts = counts[:, :, None]
+    return sums / counts
+
+
+def perceptual_hash(frame: np.ndarray, hash_size: int = 8) -> int:
+    """
+    Difference hash: the grayscale frame is shrunk to hash_size x (hash_size + 1) and every bit tells whether a
+    pixel is brighter than its right neighbour. Similar images have hashes that differ in few bits.
+    """
+    small = resize_area(grayscale(frame), hash_size, hash_size + 1)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+def hash_distance(a: int, b: int) -> int:
+    """ Amount of bits that differ between two perceptual hashes. """
+    return bin(a ^ b).count("1")
+
+
+class Condition:
+    """ Base class of trigger conditions. 'matches' gets the (downsampled) pixels of the region. """
+
+    def setup(self, downsample: int):
+        """ Called once before the first frame with the downsampling factor of the trigger. """
+
+    def min_size(self) -> Tuple[int, int]:
+        """ Smallest (height, width) of a (downsampled) frame that the condition can check. """
+        return 1, 1
+
+    def matches(self, frame: np.ndarray) -> bool:
+        raise NotImplementedError
+
+
+class PixelColor(Condition):
+    """ At least 'min_pixels' pixels of the region have the color, every channel may differ by up to 'tolerance'. """
+
+    def __init__(self, color: Tuple[int, int, int], tolerance: int = 0, min_pixels: int = 1):
+        assert tolerance >= 0, f"{tolerance}"
+        assert min_pixels >= 1, f"{min_pixels}"
+        self.color = color
+        self.tolerance = tolerance
+        self.min_pixels = min_pixels
+        # Compared per channel on the uint8 frame, which avoids converting the frame to a signed type
+        self._bounds = [(max(value - tolerance, 0), min(value + tolerance, 255)) for value in color]
+
+    def matches(self, frame: np.ndarray) -> bool:
+        mask = None
+        for channel, (low, high) in enumerate(self._bounds):
+            values = frame[:, :, channel]
+            channel_mask = (values >= low) & (values <= high)
+            if mask is None:
+                mask = channel_mask
+            else:
+                mask &= channel_mask
+        return int(np.count_nonzero(mask)) >= self.min_pixels
+
+
+class RegionHash(Condition):
+    """ The perceptual hash of the region is at most 'max_distance' bits away from 'expected_hash'. """
+
+    def __init__(self, expected_hash: int, max_distance: int = 5, hash_size: int = 8):
+        self.expected_hash = expected_hash
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+
+    def min_size(self) -> Tuple[int, int]:
+        return self.hash_size, self.hash_size + 1
+
+    def matches(self, frame: np.ndarray) -> bool:
+        return hash_distance(perceptual_hash(frame, self.hash_size), self.expected_hash) <= self.max_distance
+
+
+class RegionChanged(Condition):
+    """
+    The perceptual hash of the region differs by more than 'min_distance' bits from the first frame that was seen,
+    i.e. the content changed and not only a few pixels or the noise of a video.
+    """
+
+    def __init__(self, min_distance: int = 5, hash_size: int = 8):
+        self.min_distance = min_distance
+        self.hash_size = hash_size
+        self.reference_hash: Optional[int] = None
+
+    def min_size(self) -> Tuple[int, int]:
+        return self.hash_size, self.hash_size + 1
+
+    def matches(self, frame: np.ndarray) -> bool:
+        frame_hash = perceptual_hash(frame, self.hash_size)
+        if self.reference_hash is None:
+            self.reference_hash = frame_hash
+            return False
+        return hash_distance(frame_hash, self.reference_hash) > self.min_distance
+
+
+class TemplateMatch(Condition):
+    """
+    The template image appears somewhere in the region: the root mean squared difference of the grayscale pixels
+    (0 - 255) at the best position is at most 'max_difference'. The best position is stored in 'position'
+    (top left corner relative to the region, in screen pixels).
+    The squared differences of all positions are computed at once with an FFT cross-correlation.
+    """
+
+    def __init__(self, template: np.ndarray, max_difference: float = 10):
+        self.template = template
+        self.max_difference = max_difference
+        self.downsample = 1
+        self.position: Optional[Tuple[int, int]] = None
+        self._template: Optional[np.ndarray] = None
+        self._template_energy = 0.0
+        # Frame shape -> FFT of the flipped template, the frames of a region always have the same shape
+        self._template_spectrum: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def setup(self, downsample: int):
+        self.downsample = downsample
+        self._template = grayscale(self.template[::downsample, ::downsample])
+        self._template_energy = float(np.square(self._template, dtype=np.float64).sum())
+        self._template_spectrum.clear()
+
+    def min_size(self) -> Tuple[int, int]:
+        height, width = self.template.shape[:2]
+        return -(-height // self.downsample), -(-width // self.downsample)
+
+    def matches(self, frame: np.ndarray) -> bool:
+        if self._template is None:
+            self.setup(1)
+        template = self._template
+        height, width = template.shape
+        image = grayscale(frame).astype(np.float64)
+        image_height, image_width = image.shape
+        if image_height < height or image_width < width:
+            return False
+        # Sum of squared differences = sum(image^2) - 2 * correlation(image, template) + sum(template^2)
+        integral = np.pad(np.square(image), ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+        window_energy = integral[height:, width:] - integral[:-height, width:] - integral[height:, :-width] + integral[:-height, :-width]
+        # Only the positions where the template is fully inside the frame are needed, wrapped around values are not
+        shape = (image_height, image_width)
+        template_spectrum = self._template_spectrum.get(shape)
+        if template_spectrum is None:
+            template_spectrum = self._template_spectrum[shape] = np.fft.rfft2(template[::-1, ::-1], shape)
+        correlation = np.fft.irfft2(np.fft.rfft2(image) * template_spectrum, shape)
+        correlation = correlation[height - 1 :, width - 1 :]
+        squared_difference = window_energy - 2 * correlation + self._template_energy
+        index = np.unravel_index(np.argmin(squared_difference), squared_difference.shape)
+        difference = np.sqrt(max(squared_difference[index], 0) / template.size)
+        if difference > self.max_difference:
+            return False
+        self.position = (int(index[1]) * self.downsample, int(index[0]) * self.downsample)
+        return True
+
+
+class ScreenTrigger:
+    """
+    Triggers 'command' when 'condition' becomes true in 'region'. The command is triggered again only after the
+    condition was false in between, unless 'repeat' is set, then it is triggered on every poll that matches.
+    downsample: only every n-th pixel in both directions is compared.
+    """
+
+    def __init__(
+        self,
+        region: Union[Region, Tuple[int, int, int, int]],
+        condition: Condition,
+        command: Union["KeyboardCommand", "MouseCommand", "ScriptCommand"],
+        downsample: int = 1,
+        min_interval_ms: float = 33,
+        max_interval_ms: float = 250,
+        repeat: bool = False,
+    ):
+        assert downsample >= 1, f"{downsample}"
+        assert 0 < min_interval_ms <= max_interval_ms, f"{min_interval_ms} {max_interval_ms}"
+        self.region = Region(*region)
+        self.condition = condition
+        self.command = command
+        self.downsample = downsample
+        self.min_interval = min_interval_ms / 1000
+        self.max_interval = max_interval_ms / 1000
+        self.repeat = repeat
+        self.interval = self.min_interval
+        self.matched = False
+        self._previous_frame: Optional[np.ndarray] = None
+        condition.setup(downsample)
+        # Checked here, otherwise the condition would fail on every poll
+        min_height, min_width = condition.min_size()
+        height, width = -(-self.region.height // downsample), -(-self.region.width // downsample)
+        assert height >= min_height and width >= min_width, (
+            f"Region {self.region} downsampled by {downsample} is {(height, width)}, "
+            f"{type(condition).__name__} needs at least {(min_height, min_width)}"
+        )
+
+    def poll(self, frame_source: FrameSource) -> bool:
+        """ Grabs the region and returns whether the command should be triggered, also adapts 'interval'. """
+        frame = frame_source.grab(self.region)
+        if self.downsample > 1:
+            frame = frame[:: self.downsample, :: self.downsample]
+        previous_frame = self._previous_frame
+        if previous_frame is not None and np.array_equal(frame, previous_frame):
+            # Nothing changed: poll less often, the condition has the same result as last time
+            self.interval = min(self.interval * 1.5, self.max_interval)
+            return self.matched and self.repeat
+        self.interval = self.min_interval
+        # The frame source may reuse its buffer
+        self._previous_frame = frame.copy()
+        matched = self.condition.matches(frame)
+        triggered = matched and (self.repeat or not self.matched)
+        self.matched = matched
+        return triggered
+
+
+class ScreenWatcher:
+    """ Polls the screen triggers of a manager on a background thread, each trigger when its interval passed. """
+
+    def __init__(self, manager: "Manager", frame_source: Optional[FrameSource] = None):
+        self.manager = manager
+        self.frame_source = frame_source
+        self.triggers: List[ScreenTrigger] = []
+        # (next poll time, index, trigger)
+        self._schedule: List[Tuple[float, int, ScreenTrigger]] = []
+        self._counter = itertools.count()
+        self._lock = Lock()
+        self._changed = Event()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+        self.clock: Callable[[], float] = time.perf_counter
+
+    def add(self, trigger: ScreenTrigger):
+        with self._lock:
+            self.triggers.append(trigger)
+            heapq.heappush(self._schedule, (self.clock(), next(self._counter), trigger))
+        self._changed.set()
+
+    def remove(self, trigger: ScreenTrigger):
+        with self._lock:
+            self.triggers.remove(trigger)
+            self._schedule = [entry for entry in self._schedule if entry[2] is not trigger]
+            heapq.heapify(self._schedule)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name="ScreenWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._changed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        if self.frame_source is None:
+            self.frame_source = create_frame_source()
+        while not self._stop.is_set():
+            with self._lock:
+                entry = self._schedule[0] if self._schedule else None
+            if entry is None:
+                self._changed.wait()
+                self._changed.clear()
+                continue
+            delay = entry[0] - self.clock()
+            if delay > 0:
+                # Wakes up early if a trigger was added
+                if self._changed.wait(delay):
+                    self._changed.clear()
+                    continue
+            self.poll_next()
+
+    def poll_next(self):
+        """ Polls the trigger that is due next, regardless of its time. """
+        with self._lock:
+            if not self._schedule:
+                return
+            _, _, trigger = heapq.heappop(self._schedule)
+        try:
+            triggered = trigger.poll(self.frame_source)
+        except Exception as e:
+            logger.error(f"Could not check screen region {trigger.region}: {e!r}")
+            triggered = False
+            trigger.interval = trigger.max_interval
+        with self._lock:
+            if trigger in self.triggers:
+                heapq.heappush(self._schedule, (self.clock() + trigger.interval, next(self._counter), trigger))
+        if triggered:
+            logger.info("Screen trigger {} matched in {}", type(trigger.condition).__name__, trigger.region)
+            self.manager.trigger_command(trigger.command)
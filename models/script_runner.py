@@ -0,0 +1,169 @@
+"""
+Runs the functions of a 'ScriptCommand' where they declare to run:
+
+    "loop": on the executor's event loop, the default. For coroutine functions and quick functions that only start
+    actions.
+    "thread": in a shared, bounded thread pool. For blocking functions, e.g. file or network access.
+    "process": in a pool of worker processes that is started ahead of time. For CPU-bound functions that would hold
+    the GIL and delay every injection. Functions and their results have to be picklable, e.g. module level functions.
+
+Timeouts are enforced as far as possible: coroutines are cancelled, the process pool is terminated and restarted
+(scripts running in other worker processes fail as well), a thread can not be stopped and keeps running in the
+background, but the command no longer waits for it.
+Threads and processes accept at most 'max_pending' scripts each, further scripts are rejected with 'ScriptRunnerFull'
+instead of piling up behind a stuck script.
+"""
+import asyncio
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Set, TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from multiprocessing.pool import Pool
+
+    from models.metrics import Metrics
+
+LOOP = "loop"
+THREAD = "thread"
+PROCESS = "process"
+RUN_IN = [LOOP, THREAD, PROCESS]
+
+
+class ScriptRunnerFull(RuntimeError):
+    """ Too many scripts are already waiting for the thread or process pool. """
+
+
+class ScriptRunner:
+    def __init__(
+        self,
+        max_threads: int = 4,
+        max_processes: Optional[int] = None,
+        max_pending: int = 32,
+        metrics: Optional["Metrics"] = None,
+    ):
+        """
+        max_processes: size of the process pool, defaults to the amount of CPUs.
+        max_pending: how many scripts may be running or queued in each pool at the same time.
+        """
+        assert max_threads > 0, f"{max_threads}"
+        assert max_processes is None or max_processes > 0, f"{max_processes}"
+        assert max_pending > 0, f"{max_pending}"
+        self.max_threads = max_threads
+        self.max_processes = max_processes or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.metrics = metrics
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional["Pool"] = None
+        self._pending: Dict[str, int] = {THREAD: 0, PROCESS: 0}
+        # Results of the process pool that did not arrive yet, they fail when the pool is terminated
+        self._process_futures: Set[Future] = set()
+        self._lock = Lock()
+
+    def pending(self, run_in: str) -> int:
+        with self._lock:
+            return self._pending[run_in]
+
+    def warm(self):
+        """ Starts the worker processes, so the first script that runs in a process does not wait for them. """
+        with self._lock:
+            self._processes()
+
+    def _threads(self) -> ThreadPoolExecutor:
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(self.max_threads, thread_name_prefix="ScriptRunner")
+        return self._thread_pool
+
+    def _processes(self) -> "Pool":
+        # Called with the lock held
+        if self._process_pool is None:
+            import multiprocessing
+
+            # Forking a process with running listener and injector threads can copy locks in a locked state
+            self._process_pool = multiprocessing.get_context("spawn").Pool(self.max_processes)
+        return self._process_pool
+
+    def _resolve(self, future: Future, result: Any = None, exception: Optional[BaseException] = None):
+        # Called from the result thread of the process pool and when the pool is terminated, the first one wins
+        with self._lock:
+            if future.done():
+                return
+            self._process_futures.discard(future)
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+
+    def _submit(self, function: Callable, run_in: str) -> Future:
+        with self._lock:
+            if self._pending[run_in] >= self.max_pending:
+                if self.metrics is not None and self.metrics.enabled:
+                    self.metrics.increment("scripts_rejected")
+                raise ScriptRunnerFull(f"{self._pending[run_in]} scripts are already pending in the {run_in} pool")
+            if run_in == THREAD:
+                future = self._threads().submit(function)
+            else:
+                future = Future()
+                future.set_running_or_notify_cancel()
+                self._process_futures.add(future)
+                self._processes().apply_async(
+                    function,
+                    callback=lambda result: self._resolve(future, result),
+                    error_callback=lambda exception: self._resolve(future, exception=exception),
+                )
+            self._pending[run_in] += 1
+        future.add_done_callback(lambda _: self._done(run_in))
+        return future
+
+    def _done(self, run_in: str):
+        with self._lock:
+            self._pending[run_in] -= 1
+
+    def _terminate_processes(self, reason: str):
+        with self._lock:
+            pool, self._process_pool = self._process_pool, None
+            futures = list(self._process_futures)
+        if pool is not None:
+            pool.terminate()
+        for future in futures:
+            self._resolve(future, exception=RuntimeError(reason))
+
+    async def run(self, function: Callable, run_in: str = LOOP, timeout: Optional[float] = None) -> Any:
+        """
+        Runs the function where 'run_in' says and returns its result, exceptions of the function are raised.
+        timeout: seconds after which 'asyncio.TimeoutError' is raised, 'None' waits forever.
+        """
+        assert run_in in RUN_IN, f"Unknown run_in {run_in}, has to be one of: {RUN_IN}"
+        if run_in == LOOP:
+            if asyncio.iscoroutinefunction(function):
+                awaitable = function()
+            elif asyncio.iscoroutine(function):
+                awaitable = function
+            else:
+                # Blocks the loop until it returns, the timeout can not interrupt it
+                return function()
+        else:
+            awaitable = asyncio.wrap_future(self._submit(function, run_in))
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            if self.metrics is not None and self.metrics.enabled:
+                self.metrics.increment("scripts_timed_out")
+            if run_in == PROCESS:
+                reason = f"Process pool was restarted because {function} did not finish within {timeout} seconds"
+                logger.warning(reason)
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, self._terminate_processes, reason)
+            elif run_in == THREAD:
+                logger.warning(f"{function} did not finish within {timeout} seconds and keeps running in its thread")
+            raise
+
+    def stop(self):
+        """ Terminates the worker processes, running threads finish in the background. """
+        self._terminate_processes("Script runner was stopped")
+        with self._lock:
+            thread_pool, self._thread_pool = self._thread_pool, None
+        if thread_pool is not None:
+            thread_pool.shutdown(wait=False)
@@ -0,0 +1,135 @@
+"""
+Deterministic simulation: runs the manager, its actions and its injections on an event loop with a virtual clock,
+so scenarios that take minutes or hours of real time (long holds, toggled macros, repeated triggers, shutdown)
+run in milliseconds and can be asserted on as exact timelines.
+
+    with Simulation() as simulation:
+        simulation.manager.add_hotkey("alt+1", KeyboardCommand(keyboard_action=...))
+        simulation.tap(KeyInfo("1", alt=True), at_ms=100)
+        simulation.run_until(30 * 60 * 1000)
+        assert simulation.timeline()[:2] == [(100.0, "key_down", ("a",)), (100.0, "key_up", ("a",))]
+
+Whenever the loop has nothing to do, the clock jumps to the next scheduled callback instead of sleeping.
+Everything has to run on the loop: functions of script commands that run in threads or processes still take
+real time, while the virtual clock may jump ahead meanwhile.
+"""
+import asyncio
+import selectors
+from typing import Iterable, List, Optional, Tuple
+
+from models.backends import RecordingBackend
+from models.manager import Manager
+from models.other import KeyInfo
+
+# (milliseconds since the start, key, pressed)
+ScriptedKeyEvent = Tuple[float, KeyInfo, bool]
+# (milliseconds since the start, backend function, arguments)
+TimelineEvent = Tuple[float, str, tuple]
+
+
+class _VirtualSelector:
+    """ Selector of the virtual clock loop: where the loop would sleep until the next timer, the clock jumps to it. """
+
+    def __init__(self, selector: selectors.BaseSelector):
+        self.selector = selector
+        self.loop: Optional["VirtualClockLoop"] = None
+
+    def select(self, timeout: Optional[float] = None):
+        # Sockets and callbacks from other threads (the loop's self-pipe) are still served
+        events = self.selector.select(0)
+        if events:
+            return events
+        if timeout is None:
+            # Nothing is scheduled, only another thread can wake up the loop
+            return self.selector.select(None)
+        if timeout > 0:
+            self.loop.advance(timeout)
+        return []
+
+    def __getattr__(self, name: str):
+        return getattr(self.selector, name)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        selector = _VirtualSelector(selectors.DefaultSelector())
+        super().__init__(selector)
+        selector.loop = self
+        self._now = 0.0
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float):
+        assert seconds >= 0, f"{seconds}"
+        self._now += seconds
+
+
+class Simulation:
+    """
+    A manager on a virtual clock loop with a recording backend. Key events are scripted with 'press', 'release',
+    'tap' and 'feed' and are handed to 'Manager.keyboard_on_press' at their time while the loop runs.
+    """
+
+    def __init__(self, **manager_options):
+        """ manager_options: further arguments of 'Manager', e.g. 'max_concurrent_actions'. """
+        self.loop = VirtualClockLoop()
+        self.backend = RecordingBackend(clock=self.loop.time)
+        options = {"backend": self.backend, "start_listener": False, "spin_threshold_ms": 0}
+        options.update(manager_options)
+        self.manager = Manager(loop=self.loop, **options)
+        self._closed = False
+
+    @property
+    def now_ms(self) -> float:
+        return self.loop.time() * 1000
+
+    def press(self, key_info: KeyInfo, at_ms: float):
+        self.loop.call_at(at_ms / 1000, self.manager.keyboard_on_press, key_info)
+
+    def release(self, key_info: KeyInfo, at_ms: float):
+        self.loop.call_at(at_ms / 1000, self.manager.keyboard_on_release, key_info)
+
+    def tap(self, key_info: KeyInfo, at_ms: float, hold_ms: float = 0):
+        self.press(key_info, at_ms)
+        self.release(key_info, at_ms + hold_ms)
+
+    def feed(self, events: Iterable[ScriptedKeyEvent]):
+        """ Schedules a scripted stream of key presses and releases. """
+        for at_ms, key_info, pressed in events:
+            if pressed:
+                self.press(key_info, at_ms)
+            else:
+                self.release(key_info, at_ms)
+
+    def run_until(self, at_ms: float):
+        """ Runs everything that is scheduled until the virtual time 'at_ms'. """
+        self.loop.run_until_complete(asyncio.sleep(max(0.0, at_ms / 1000 - self.loop.time())))
+
+    def run(self, coroutine):
+        """ Runs the coroutine on the virtual clock, e.g. 'simulation.run(manager.run())', and returns its result. """
+        return self.loop.run_until_complete(coroutine)
+
+    def timeline(self, since_ms: float = 0) -> List[TimelineEvent]:
+        """ Injected events with their virtual time in milliseconds, rounded to microseconds. """
+        return [
+            (round(event.timestamp * 1000, 3), event.action, event.args)
+            for event in self.backend.events
+            if event.timestamp * 1000 >= since_ms
+        ]
+
+    def close(self, drain_timeout: float = 2):
+        """ Shuts the manager down on the virtual clock (see 'Manager.shutdown') and closes the loop. """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.loop.run_until_complete(self.manager.shutdown(drain_timeout))
+        finally:
+            self.loop.close()
+
+    def __enter__(self) -> "Simulation":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
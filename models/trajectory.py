@@ -0,0 +1,68 @@
+"""
+Mouse movement paths. A path is computed at once with numpy as array of offsets from the start position,
+the mouse clicker then only moves to one precomputed point per step.
+Paths only depend on the distance, the amount of steps, the shape and the seed, so identical moves reuse the
+cached array regardless of where they start.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+LINEAR = "linear"
+# Accelerates at the start and slows down at the end
+EASE_IN_OUT = "ease_in_out"
+# Curved path
+BEZIER = "bezier"
+# Curved path with ease in / out and small deviations, deterministic for the same seed
+HUMAN = "human"
+PATHS = [LINEAR, EASE_IN_OUT, BEZIER, HUMAN]
+
+
+def ease_in_out(t: np.ndarray) -> np.ndarray:
+    """ Smoothstep: slope 0 at t=0 and t=1. """
+    return t * t * (3 - 2 * t)
+
+
+def cubic_bezier(t: np.ndarray, p0: np.ndarray, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray) -> np.ndarray:
+    """ Points of a cubic Bézier curve for all values of t at once, shape (len(t), 2). """
+    t = t[:, None]
+    u = 1 - t
+    return u ** 3 * p0 + 3 * u * u * t * p1 + 3 * u * t * t * p2 + t ** 3 * p3
+
+
+@lru_cache(maxsize=256)
+def trajectory(dx: int, dy: int, steps: int, path: str = LINEAR, seed: int = 0) -> np.ndarray:
+    """
+    Offsets from the start position after each step as read-only int array of shape (steps, 2).
+    The last offset is always exactly (dx, dy).
+    """
+    assert steps >= 1, f"{steps}"
+    assert path in PATHS, f"Unknown path {path}, has to be one of: {PATHS}"
+    t = np.arange(1, steps + 1, dtype=np.float64) / steps
+    end = np.array([dx, dy], dtype=np.float64)
+    if path == LINEAR:
+        points = t[:, None] * end
+    elif path == EASE_IN_OUT:
+        points = ease_in_out(t)[:, None] * end
+    else:
+        # Control points are shifted perpendicular to the direction of the move
+        normal = np.array([-dy, dx], dtype=np.float64)
+        rng = np.random.RandomState(seed)
+        if path == BEZIER:
+            bends = np.array([0.2, 0.2])
+        else:
+            bends = rng.uniform(-0.25, 0.25, size=2)
+        p1 = end * 0.3 + normal * bends[0]
+        p2 = end * 0.7 + normal * bends[1]
+        if path == HUMAN:
+            t = ease_in_out(t)
+        points = cubic_bezier(t, np.zeros(2), p1, p2, end)
+        if path == HUMAN and steps > 2:
+            # Tremor that fades out towards the target, so the target is still hit exactly
+            distance = float(np.hypot(dx, dy))
+            noise = rng.normal(0, min(2.0, distance * 0.005), size=(steps, 2))
+            points += noise * (1 - t)[:, None]
+    offsets = np.rint(points).astype(np.int32)
+    offsets[-1] = (dx, dy)
+    offsets.setflags(write=False)
+    return offsets
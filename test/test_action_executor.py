@@ -0,0 +1,56 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import CancelledError
+from threading import Event
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.action_executor import ActionExecutor
+
+
+def test_submit_and_cancel():
+    executor = ActionExecutor()
+    executor.start()
+    try:
+        handle = executor.submit(asyncio.sleep(0, result=5), name="quick")
+        assert handle.result(timeout=1) == 5
+
+        started = Event()
+
+        async def long_action():
+            started.set()
+            await asyncio.sleep(100)
+
+        long_running = executor.submit(long_action(), name="long")
+        assert started.wait(timeout=1)
+        assert executor.running == [long_running]
+        assert executor.cancel(long_running.action_id)
+        with pytest.raises(CancelledError):
+            long_running.result(timeout=1)
+        assert executor.running == []
+    finally:
+        executor.stop()
+
+
+def test_concurrency_limit():
+    executor = ActionExecutor(max_concurrent_actions=2)
+    executor.start()
+    active = []
+    peak = []
+
+    async def action():
+        active.append(1)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.pop()
+
+    try:
+        handles = [executor.submit(action()) for _ in range(6)]
+        for handle in handles:
+            handle.result(timeout=1)
+        assert max(peak) == 2
+    finally:
+        executor.stop()
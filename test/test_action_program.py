@@ -0,0 +1,101 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.action_program import ActionProgram, SLEEP, PRESS, HOLD, MOUSE, TYPE, REPEAT_FOREVER
+from models.backends import RecordingBackend
+from models.injector import Injector
+from models.input_arbiter import InputArbiter
+from models.keyboard_presser import KeyboardAction, KeyboardCommand, KeyboardPresser, TextAction
+from models.manager import Manager
+from models.metrics import Metrics
+from models.mouse_clicker import MouseAction, MouseClicker
+from models.other import KeyInfo, MouseInfo, Click
+
+
+def test_compile():
+    a, f = KeyInfo("a", delay=5), KeyInfo("f", duration=100)
+    program = KeyboardAction(None, hotkeys_to_press=[a, f], start_delay=1000, repeat_delay=20, repeat_amount=9999).compile()
+    assert list(ActionProgram.instructions(program.prelude)) == [(SLEEP, 1000)]
+    # Waits of 0 are dropped and consecutive waits are merged
+    assert list(ActionProgram.instructions(program.body)) == [(PRESS, 0), (SLEEP, 5), (HOLD, 1), (SLEEP, 20)]
+    assert program.operands == [a, f]
+    assert program.repeat == 10000
+
+    click = MouseInfo(click=Click.Left, delay=3)
+    program = MouseAction(None, mouse_actions=[click], repeat_delay=0, toggled_state=True).compile()
+    assert list(ActionProgram.instructions(program.prelude)) == []
+    assert list(ActionProgram.instructions(program.body)) == [(MOUSE, 0), (SLEEP, 3)]
+    assert program.repeat == REPEAT_FOREVER
+
+    # A repeating body without any delay still yields once per repetition
+    program = MouseAction(None, mouse_actions=[MouseInfo(click=Click.Left)], repeat_delay=0, toggled_state=True).compile()
+    assert list(ActionProgram.instructions(program.body)) == [(MOUSE, 0), (SLEEP, 0)]
+
+    # Every repetition first moves by the relative coordinates of the action
+    program = MouseAction(None, mouse_actions=[click], relative_x=10, repeat_delay=0).compile()
+    assert list(ActionProgram.instructions(program.body)) == [(MOUSE, 1), (MOUSE, 0), (SLEEP, 3)]
+    assert program.operands[1] == MouseInfo(click=Click.MoveRelative, relative_x=10)
+
+
+def test_execute():
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    try:
+        action = KeyboardAction(manager, hotkeys_to_press=[KeyInfo("a"), KeyInfo("b")], repeat_delay=1, repeat_amount=2)
+        manager.trigger_command(KeyboardCommand(keyboard_action=action)).result(timeout=1)
+        assert [event.args for event in manager.backend.events if event.action == "key_down"] == [("a",), ("b",)] * 3
+        assert action.timing_stats.events == 6
+
+        manager.backend.clear()
+        action = TextAction(manager, text="ab", repeat_delay=5)
+        assert list(ActionProgram.instructions(action.compile().body)) == [(TYPE, 0), (SLEEP, 5)]
+        manager.trigger_command(KeyboardCommand(keyboard_action=action)).result(timeout=1)
+        assert [event.args for event in manager.backend.events if event.action == "key_down"] == [("a",), ("b",)]
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
+
+
+def test_text_action_validates_the_base_fields():
+    with pytest.raises(AssertionError):
+        TextAction(None, text="ab", repeat_delay=-1)
+    with pytest.raises(AssertionError):
+        TextAction(None, text="")
+    assert TextAction(None, text="ab").hotkeys_to_press == []
+
+
+def test_program_is_compiled_once():
+    action = KeyboardAction(None, hotkeys_to_press=[KeyInfo("a")], repeat_delay=5)
+    program = action.program
+    assert action.program is program
+    action.repeat_delay = 7
+    assert action.program is not program
+    assert list(ActionProgram.instructions(action.program.body)) == [(PRESS, 0), (SLEEP, 7)]
+    action.hotkeys_to_press.append(KeyInfo("b"))
+    action.invalidate()
+    assert action.program.operands == [KeyInfo("a"), KeyInfo("b")]
+
+
+@pytest.mark.asyncio
+async def test_toggled_action_without_delays_yields():
+    backend = RecordingBackend()
+    # Injects right away on submission, so pressing a key never awaits anything
+    manager = SimpleNamespace(
+        injector=Injector(backend, threaded=False), arbiter=InputArbiter(), spin_threshold_ms=1.0, metrics=Metrics()
+    )
+    manager.keyboard_presser = KeyboardPresser(manager)
+    manager.mouse_clicker = MouseClicker(manager)
+    action = KeyboardAction(manager, hotkeys_to_press=[KeyInfo("a")], repeat_delay=0, toggled_state=True)
+    task = asyncio.ensure_future(action.execute())
+    await asyncio.sleep(0.01)
+    # The loop was not starved by the action
+    assert not task.done()
+    assert backend.events
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
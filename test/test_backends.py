@@ -0,0 +1,160 @@
+import enum
+import os
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend, LazyBackend, PynputBackend, PASTE_MODIFIER, create_backend, split_runs
+from models.injector import Injector
+from models.input_arbiter import InputArbiter
+from models.keyboard_presser import KeyboardPresser
+from models.mouse_clicker import MouseClicker
+from models.other import KeyInfo, MouseInfo, Click
+
+
+def fake_manager(backend: RecordingBackend):
+    return SimpleNamespace(injector=Injector(backend, threaded=False), arbiter=InputArbiter())
+
+
+def recorded(backend: RecordingBackend):
+    return [(event.action, event.args) for event in backend.events]
+
+
+def test_create_backend():
+    backend = RecordingBackend()
+    assert create_backend(backend) is backend
+    assert isinstance(create_backend("recording"), RecordingBackend)
+    with pytest.raises(AssertionError):
+        create_backend("does_not_exist")
+
+
+@pytest.mark.asyncio
+async def test_keyboard_presser():
+    backend = RecordingBackend()
+    presser = KeyboardPresser(fake_manager(backend))
+    await presser.press_hotkey(KeyInfo("v", ctrl=True))
+    await presser.hold_down_button(KeyInfo("f", shift=True, duration=1))
+    assert recorded(backend) == [
+        ("key_down", ("ctrl",)),
+        ("key_down", ("v",)),
+        ("key_up", ("v",)),
+        ("key_up", ("ctrl",)),
+        ("key_down", ("shift",)),
+        ("key_down", ("f",)),
+        ("key_up", ("f",)),
+        ("key_up", ("shift",)),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_mouse_clicker():
+    backend = RecordingBackend()
+    clicker = MouseClicker(fake_manager(backend))
+    await clicker.do_mouse_action(MouseInfo(click=Click.Right, x=10, y=20))
+    await clicker.do_mouse_action(MouseInfo(click=Click.Move, x=110, y=20, duration=30))
+    assert recorded(backend) == [
+        ("move_to", (10, 20)),
+        ("mouse_down", ("right",)),
+        ("mouse_up", ("right",)),
+        ("move_to", (43, 20)),
+        ("move_to", (77, 20)),
+        ("move_to", (110, 20)),
+    ]
+
+
+def test_lazy_backend_is_loaded_by_injector_thread():
+    backend = create_backend("recording", lazy=True)
+    assert isinstance(backend, LazyBackend)
+    assert not backend.loaded
+    injector = Injector(backend)
+    injector.start()
+    injector.stop()
+    assert backend.loaded
+    assert isinstance(backend.load(), RecordingBackend)
+
+
+def test_manager_import_does_not_load_input_libraries():
+    script = "import sys; import models.manager; print([name for name in ['pyautogui', 'pynput', 'Xlib'] if name in sys.modules])"
+    root = os.path.join(os.path.dirname(__file__), "..")
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=root)
+    assert output.decode().strip() == "[]"
+
+
+@pytest.mark.asyncio
+async def test_relative_mouse_actions():
+    backend = RecordingBackend()
+    backend.move_to(100, 100)
+    backend.clear()
+    clicker = MouseClicker(fake_manager(backend))
+    await clicker.do_mouse_action(MouseInfo(click=Click.MoveRelative, relative_x=-20, relative_y=10, duration=20))
+    await clicker.do_mouse_action(MouseInfo(click=Click.Left, relative_x=5))
+    await clicker.do_mouse_action(MouseInfo(click=Click.Move, x=0, y=0, duration=50, path="ease_in_out", moves_per_second=40))
+    assert recorded(backend) == [
+        ("move_to", (90, 105)),
+        ("move_to", (80, 110)),
+        ("move_to", (85, 110)),
+        ("mouse_down", ("left",)),
+        ("mouse_up", ("left",)),
+        ("move_to", (43, 55)),
+        ("move_to", (0, 0)),
+    ]
+
+
+def test_split_runs():
+    assert split_runs("ab€c€€", lambda char: char.isascii()) == [(True, "ab"), (False, "€"), (True, "c"), (False, "€€")]
+    assert split_runs("", str.isascii) == []
+
+
+@pytest.mark.asyncio
+async def test_type_text():
+    backend = RecordingBackend()
+    presser = KeyboardPresser(fake_manager(backend))
+    await presser.type_text("Hi a\n" * 40, paste_min_length=None)
+    assert len(backend.events) == 2 * 200
+    assert recorded(backend)[4:10] == [
+        ("key_down", ("space",)),
+        ("key_up", ("space",)),
+        ("key_down", ("a",)),
+        ("key_up", ("a",)),
+        ("key_down", ("enter",)),
+        ("key_up", ("enter",)),
+    ]
+    backend.clear()
+    await presser.type_text("long text", paste_min_length=5)
+    assert recorded(backend) == [("paste_text", ("long text",))]
+
+    backend.clear()
+    start = time.perf_counter()
+    await presser.type_text("x" * 20, chars_per_second=200)
+    assert time.perf_counter() - start >= 0.09
+    key_downs = [event.timestamp for event in backend.events if event.action == "key_down"]
+    assert len(key_downs) == 20
+    # Typed in 2 chunks of 10 characters
+    assert key_downs[10] - key_downs[9] >= 0.045
+
+
+class FakePynputKeyboard:
+    class Key(enum.Enum):
+        cmd = 1
+        ctrl = 2
+        page_up = 3
+
+    class KeyCode:
+        @staticmethod
+        def from_char(char: str):
+            return char
+
+
+def test_pynput_backend_translates_key_names():
+    backend = PynputBackend.__new__(PynputBackend)
+    backend.keyboard = FakePynputKeyboard
+    backend._keys = {}
+    assert backend._key("command") is FakePynputKeyboard.Key.cmd
+    assert backend._key(PASTE_MODIFIER) in {FakePynputKeyboard.Key.cmd, FakePynputKeyboard.Key.ctrl}
+    assert backend._key("pageup") is FakePynputKeyboard.Key.page_up
+    assert backend._key("v") == "v"
@@ -0,0 +1,134 @@
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend
+from models.config import ConfigWatcher, build_command, compile_config, load_config
+from models.keyboard_presser import KeyboardCommand
+from models.manager import Manager
+from models.mouse_clicker import MouseCommand
+from models.other import KeyInfo, Click
+
+CONFIG = {
+    "hotkey": [
+        {"name": "click", "hotkey": "alt+1", "start_delay": 1000, "mouse": [{"click": "Right", "delay": 5}]},
+        {"hotkey": "alt+e", "keys": [{"key": "e", "ctrl": True}], "repeat_amount": 19},
+        {"hotkey": "h,i", "text": "hello", "chars_per_second": 30},
+    ]
+}
+
+TOML_CONFIG = """
+[[hotkey]]
+hotkey = "ctrl+f"
+keys = [{ key = "f", duration = 100 }]
+"""
+
+
+def write_json(path, config):
+    with open(path, "w") as f:
+        json.dump(config, f)
+
+
+def test_load_config_compiles_and_caches(tmp_path):
+    path = str(tmp_path / "hotkeys.json")
+    write_json(path, CONFIG)
+    specs = load_config(path)
+    assert [spec.name for spec in specs] == ["click", "alt+e", "h,i"]
+    assert specs[0].actions[0].click == Click.Right
+    assert specs[0].options == {"start_delay": 1000}
+    assert specs[2].actions == "hello"
+    assert specs[2].options == {"chars_per_second": 30}
+    assert len(os.listdir(tmp_path / ".hotkey_cache")) == 1
+
+    # A cold start with the same content does not parse the config again
+    assert [spec.fingerprint for spec in load_config(path)] == [spec.fingerprint for spec in specs]
+
+    toml_path = str(tmp_path / "hotkeys.toml")
+    with open(toml_path, "w") as f:
+        f.write(TOML_CONFIG)
+    (spec,) = load_config(toml_path, cache_dir="")
+    assert spec.hotkeys == [KeyInfo("f", ctrl=True)]
+    assert spec.actions[0].duration == 100
+
+
+@pytest.mark.parametrize("content", [b"[{", b'{"not": "specs"}', b'[{"name": "click"}]', b"\x80\x04garbage"])
+def test_unloadable_cache_is_a_cache_miss(tmp_path, content):
+    path = str(tmp_path / "hotkeys.json")
+    write_json(path, CONFIG)
+    load_config(path)
+    (cache_file,) = os.listdir(tmp_path / ".hotkey_cache")
+    cache_path = tmp_path / ".hotkey_cache" / cache_file
+    cache_path.write_bytes(content)
+    assert [spec.name for spec in load_config(path)] == ["click", "alt+e", "h,i"]
+    # The cache file was written again
+    assert [spec["name"] for spec in json.loads(cache_path.read_text())] == ["click", "alt+e", "h,i"]
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="File owners are only checked on POSIX")
+def test_cache_that_others_can_write_is_not_read(tmp_path):
+    path = str(tmp_path / "hotkeys.json")
+    write_json(path, CONFIG)
+    load_config(path)
+    cache_dir = tmp_path / ".hotkey_cache"
+    assert stat.S_IMODE(cache_dir.stat().st_mode) == 0o700
+    (cache_file,) = os.listdir(cache_dir)
+    cache_path = cache_dir / cache_file
+    # Somebody else swapped in a script
+    cached = json.loads(cache_path.read_text())
+    cached[0].update(kind="script", actions="os:getpid", options={})
+    cache_path.write_text(json.dumps(cached))
+    os.chmod(cache_path, 0o666)
+    assert load_config(path)[0].kind == "mouse"
+
+
+def test_config_changes_are_applied_incrementally(tmp_path):
+    path = str(tmp_path / "hotkeys.json")
+    write_json(path, CONFIG)
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    try:
+        manager.load_config(path)
+        assert len(manager.commands) == 3
+        (click_command,) = manager.hotkey_matcher.feed(KeyInfo("1", alt=True))
+        assert isinstance(click_command, MouseCommand)
+        assert click_command.name == "click"
+        text_command = manager.config_commands["h,i"][1]
+
+        config = json.loads(json.dumps(CONFIG))
+        config["hotkey"][0]["hotkey"] = "alt+2"
+        del config["hotkey"][1]
+        write_json(path, config)
+        watcher = ConfigWatcher(manager, path)
+        # Make sure the change is noticed even if the file system has a coarse modification time
+        watcher._signature = None
+        assert watcher.check()
+        assert not watcher.check()
+
+        assert len(manager.commands) == 2
+        # Unchanged commands are kept
+        assert manager.config_commands["h,i"][1] is text_command
+        assert not manager.hotkey_matcher.feed(KeyInfo("1", alt=True))
+        assert not manager.hotkey_matcher.feed(KeyInfo("e", alt=True))
+        (click_command,) = manager.hotkey_matcher.feed(KeyInfo("2", alt=True))
+        assert click_command.name == "click"
+        assert not any(isinstance(command, KeyboardCommand) and command.name == "alt+e" for command in manager.commands)
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
+
+
+def test_script_entries_declare_where_they_run():
+    (spec,) = compile_config(
+        {"hotkey": [{"hotkey": "alt+q", "script": "os:getpid", "run_in": "process", "timeout": 500}]}
+    )
+    assert spec.options == {"run_in": "process", "timeout": 500}
+    (spec,) = compile_config({"hotkey": [{"hotkey": "d", "script": "os:getpid", "trigger": "double_tap"}]})
+    assert build_command(None, spec).trigger == "double_tap"
+    with pytest.raises(AssertionError):
+        compile_config({"hotkey": [{"hotkey": "d", "script": "os:getpid", "trigger": "triple_tap"}]})
+    with pytest.raises(AssertionError):
+        compile_config({"hotkey": [{"hotkey": "alt+q", "script": "os:getpid", "run_in": "gpu"}]})
@@ -0,0 +1,128 @@
+import os
+import socket
+import stat
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend
+from models.control_server import ControlClient, ControlError, ControlServer
+from models.keyboard_presser import KeyboardAction, KeyboardCommand
+from models.manager import Manager
+from models.other import KeyInfo, ScriptCommand
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="The control server needs Unix sockets")
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = Manager(backend=RecordingBackend(), start_listener=False, metrics=True)
+    manager.serve_control(str(tmp_path / "control.sock"))
+    yield manager
+    manager.control_server.stop()
+    manager.executor.stop()
+    manager.injector.stop()
+
+
+def add_named(manager: Manager, name: str, hotkey: str, command):
+    command.name = name
+    manager.add_hotkey(hotkey, command)
+    return command
+
+
+def test_trigger_list_and_errors(manager):
+    action = KeyboardAction(manager, hotkeys_to_press=[KeyInfo("a")], repeat_delay=0)
+    add_named(manager, "press a", "alt+a", KeyboardCommand(keyboard_action=action))
+    with ControlClient(manager.control_server.path) as client:
+        assert client.request("ping") == "pong"
+        commands = client.request("list")
+        assert commands == [{"name": "press a", "hotkey": "alt+a", "kind": "keyboard", "trigger": "press"}]
+        result = client.request("trigger", name="press a", wait=True)
+        assert result == [{"action_id": 1, "cancelled": False, "error": None}]
+        with pytest.raises(ControlError, match="KeyError"):
+            client.request("trigger", name="missing")
+        with pytest.raises(ControlError, match="Unknown op"):
+            client.request("explode")
+        # The connection is still usable after errors
+        assert client.request("ping") == "pong"
+    actions = [(event.action, event.args) for event in manager.backend.events]
+    assert actions == [("key_down", ("a",)), ("key_up", ("a",))]
+
+
+def test_pipelined_requests_are_answered_in_order(manager):
+    triggered = []
+
+    def record():
+        triggered.append(1)
+
+    add_named(manager, "count", "alt+c", ScriptCommand(functions=[record], run_in="loop"))
+    with ControlClient(manager.control_server.path) as client:
+        request_ids = client.send_many([("trigger", {"name": "count"})] * 500)
+        responses = [client.receive() for _ in request_ids]
+        assert [response["id"] for response in responses] == request_ids
+        assert all(response["ok"] for response in responses)
+        while client.request("running"):
+            pass
+    assert len(triggered) == 500
+
+
+def test_submit_batches_and_cancel(manager):
+    with ControlClient(manager.control_server.path) as client:
+        # Explicit checks, they also hold under 'python -O'
+        with pytest.raises(ControlError, match="ValueError: Scripts"):
+            client.request("submit", actions=[{"script": "os:getpid"}])
+        with pytest.raises(ControlError, match="ValueError: Submitted actions have no hotkey"):
+            client.request("submit", actions=[{"hotkey": "alt+x", "text": "x"}])
+        for actions in [[], {"text": "x"}, ["script"]]:
+            with pytest.raises(ControlError, match="ValueError"):
+                client.request("submit", actions=actions)
+        result = client.request("submit", actions=[{"keys": [{"key": "c", "ctrl": True}]}, {"text": "hi"}], wait=True)
+        assert [entry["error"] for entry in result] == [None, None]
+
+        (action_id,) = client.request("submit", actions=[{"keys": [{"key": "h", "duration": 60000}]}])["action_ids"]
+        waiting = client.send("submit", actions=[{"keys": [{"key": "x"}]}], wait=True)
+        assert client.request("cancel", action_id=action_id) is True
+        assert client.receive(waiting)["result"][0]["cancelled"] is False
+        assert client.request("cancel", all=True) == 0
+    actions = [(event.action, event.args) for event in manager.backend.events]
+    # The cancelled hold released its key
+    for action in [("key_down", ("ctrl",)), ("key_up", ("c",)), ("key_up", ("i",)), ("key_up", ("h",))]:
+        assert action in actions
+    assert manager.injector.held == []
+
+
+def test_stats_stream(manager):
+    with ControlClient(manager.control_server.path) as client:
+        assert client.request("stats")["running_actions"] == 0
+        for interval_ms in [0, "10"]:
+            with pytest.raises(ControlError, match="ValueError"):
+                client.request("stats", interval_ms=interval_ms)
+        stream = client.send("stats", interval_ms=10)
+        messages = [client.receive(stream) for _ in range(3)]
+        assert all(message["stream"] and "counters" in message["result"] for message in messages)
+        assert client.request("unsubscribe", stream=stream) is True
+        assert client.request("unsubscribe", stream=stream) is False
+
+
+def test_socket_permissions_and_stale_sockets(manager, tmp_path):
+    assert stat.S_IMODE(os.stat(manager.control_server.path).st_mode) & 0o077 == 0
+    # A second server does not take over the socket of a running one
+    with pytest.raises(FileExistsError, match="already listening"):
+        ControlServer(manager, manager.control_server.path).start()
+    with ControlClient(manager.control_server.path) as client:
+        assert client.request("ping") == "pong"
+
+    # A socket file left behind by a crashed run is replaced
+    path = str(tmp_path / "stale.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = ControlServer(manager, path)
+    server.start()
+    try:
+        with ControlClient(path) as client:
+            assert client.request("ping") == "pong"
+    finally:
+        server.stop()
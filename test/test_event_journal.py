@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from loguru import logger
+
+from models.event_journal import EventJournal, EventKind, read_journal
+from models.key_codes import MODIFIER_BITS
+from models.logging_setup import EventLogFilter, event_logger
+
+
+def test_journal_roundtrip(tmp_path):
+    path = str(tmp_path / "events.journal")
+    journal = EventJournal(path)
+    journal.write_key(EventKind.KeyPress, "e", ctrl=True, alt=False, shift=None)
+    journal.write_injection("hotkey", ("ctrl", "v"))
+    journal.write_injection("move_to", (10, 20))
+    journal.close()
+
+    records = list(read_journal(path))
+    assert [(record.event_kind, record.injected, record.key) for record in records] == [
+        (EventKind.KeyPress, False, "e"),
+        (EventKind.Hotkey, True, "ctrl+v"),
+        (EventKind.MouseMove, True, ""),
+    ]
+    assert records[0].modifiers == MODIFIER_BITS["ctrl"]
+    assert (records[2].x, records[2].y) == (10, 20)
+    assert records[0].timestamp <= records[1].timestamp <= records[2].timestamp
+
+
+def test_event_log_sampling_and_rate_limit():
+    messages = []
+    handler = logger.add(messages.append, level="DEBUG", filter=EventLogFilter("DEBUG", sample_every=2, max_per_second=3))
+    try:
+        for index in range(20):
+            event_logger.debug("Key pressed: {}", index)
+        logger.debug("Regular message")
+    finally:
+        logger.remove(handler)
+
+    texts = [message.record["message"] for message in messages]
+    # Every second message is sampled, then the rate limit allows 3 within the same second
+    assert texts[:3] == ["Key pressed: 0", "Key pressed: 2 (1 similar messages dropped)", "Key pressed: 4 (1 similar messages dropped)"]
+    assert texts[3:] == ["Regular message"]
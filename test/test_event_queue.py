@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+from threading import Thread
+from types import SimpleNamespace
+
+from hypothesis import given, strategies as st
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend
+from models.event_queue import SpscQueue
+from models.manager import Manager
+from models.other import ScriptCommand
+
+
+@given(st.lists(st.integers(min_value=1, max_value=20), max_size=30))
+def test_batches_keep_the_order_across_wrap_arounds(batch_sizes):
+    queue = SpscQueue(8)
+    expected = 0
+    pushed = 0
+    for batch_size in batch_sizes:
+        for _ in range(batch_size):
+            if queue.push(pushed, timestamp=pushed * 10):
+                pushed += 1
+        events, timestamps = queue.pop_batch(max_events=5)
+        assert events == list(range(expected, expected + len(events)))
+        assert timestamps == [event * 10 for event in events]
+        expected += len(events)
+    assert len(queue) == pushed - expected
+    assert queue.pushed + queue.dropped == sum(batch_sizes)
+
+
+def test_overflow_drops_newest_events():
+    queue = SpscQueue(4)
+    assert all(queue.push(event) for event in range(4))
+    assert not queue.push(4)
+    assert (queue.dropped, queue.high_water, len(queue)) == (1, 4, 4)
+    assert queue.pop_batch()[0] == [0, 1, 2, 3]
+
+
+def test_consumer_thread_receives_all_events_in_order():
+    queue = SpscQueue(64)
+    received = []
+
+    def consume():
+        while True:
+            events, _ = queue.pop_batch(16)
+            received.extend(events)
+            if not events:
+                if queue.closed:
+                    return
+                queue.wait()
+
+    consumer = Thread(target=consume)
+    consumer.start()
+    for event in range(20000):
+        while not queue.push(event):
+            time.sleep(0)
+    queue.close()
+    consumer.join(timeout=5)
+    assert received == list(range(20000))
+
+
+def test_listener_hands_events_to_the_matcher_worker():
+    triggered = []
+    manager = Manager(backend=RecordingBackend(), start_listener=False, metrics=True)
+    listener = manager.keyboard_listener
+    try:
+        command = ScriptCommand()
+        manager.add_hotkey("ctrl+a", command)
+        manager.trigger_command = triggered.append
+        listener.start_worker()
+        listener.on_press(SimpleNamespace(name="ctrl_l"))
+        listener.on_press(SimpleNamespace(char="a"))
+        listener.on_release(SimpleNamespace(char="a"))
+        listener.on_release(SimpleNamespace(name="ctrl_l"))
+        # Stopping handles the queued events first
+        listener.stop()
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
+    assert triggered == [command]
+    assert listener.modifiers == 0
+    snapshot = manager.metrics.snapshot()
+    assert snapshot["histograms"]["key_queue_latency"]["count"] == 4
+    assert snapshot["gauges"]["key_queue_depth"] == 0
@@ -0,0 +1,117 @@
+import os
+import sys
+from collections import deque
+from typing import Deque, List
+
+from hypothesis import given
+import hypothesis.strategies as st
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.hotkey_matcher import HotkeyMatcher
+from models.other import KeyInfo, Command
+
+key_infos = st.builds(
+    KeyInfo,
+    key=st.sampled_from(["a", "b", "e"]),
+    ctrl=st.sampled_from([None, False, True]),
+    alt=st.sampled_from([None, False, True]),
+    shift=st.just(False),
+)
+pressed_keys = st.builds(
+    KeyInfo,
+    key=st.sampled_from(["a", "b", "e"]),
+    ctrl=st.booleans(),
+    alt=st.booleans(),
+    shift=st.just(False),
+)
+
+
+def pressed_keys_match_hotkey(hotkeys: List[KeyInfo], previous_hotkeys: Deque[KeyInfo]) -> bool:
+    """ Test oracle: does the combination match the most recently pressed keys (newest first)? """
+    if len(hotkeys) > len(previous_hotkeys):
+        return False
+    for hotkey, previous_hotkey in zip(reversed(hotkeys), previous_hotkeys):
+        if hotkey != previous_hotkey:
+            return False
+    return True
+
+
+def test_sequence_hotkey():
+    matcher = HotkeyMatcher()
+    command = Command()
+    matcher.add([KeyInfo("e", False, False, False)] * 3, command)
+    presses = [KeyInfo("e", False, False, False) for _ in range(4)]
+    assert [bool(matcher.feed(key_info)) for key_info in presses] == [False, False, True, True]
+    assert matcher.feed(KeyInfo("e", True, False, False)) == []
+
+
+def test_remove_command():
+    matcher = HotkeyMatcher()
+    short_command, long_command = Command(), Command()
+    short_command.hotkeys = [KeyInfo("e", False, False, False)]
+    long_command.hotkeys = [KeyInfo("a", False, False, False), KeyInfo("e", False, False, False)]
+    matcher.add(short_command.hotkeys, short_command)
+    matcher.add(long_command.hotkeys, long_command)
+    matcher.feed(KeyInfo("a", False, False, False))
+    assert matcher.feed(KeyInfo("e", False, False, False)) == [short_command, long_command]
+
+    matcher.remove(long_command)
+    matcher.feed(KeyInfo("a", False, False, False))
+    assert matcher.feed(KeyInfo("e", False, False, False)) == [short_command]
+    # The trie nodes that only led to the removed command are pruned
+    assert ("a", False, False, False) not in matcher._root.children
+
+
+def test_partial_sequence_survives_adding_and_removing_commands():
+    matcher = HotkeyMatcher()
+    sequence_command, other_command, late_command = Command(), Command(), Command()
+    a, b, c = KeyInfo("a", False, False, False), KeyInfo("b", False, False, False), KeyInfo("c", False, False, False)
+    sequence_command.hotkeys = [a, b, c]
+    other_command.hotkeys = [b]
+    matcher.add(sequence_command.hotkeys, sequence_command)
+    matcher.add(other_command.hotkeys, other_command)
+    matcher.feed(a)
+    matcher.feed(b)
+    # Registering a command while 'a, b' is typed does not forget the partial sequence
+    late_command.hotkeys = [b, c]
+    matcher.add(late_command.hotkeys, late_command)
+    matcher.remove(other_command)
+    assert matcher.feed(c) == [sequence_command, late_command]
+    matcher.reset()
+    assert matcher.feed(c) == []
+
+
+@given(st.lists(st.lists(key_infos, min_size=1, max_size=3), max_size=8), st.lists(pressed_keys, max_size=30))
+def test_matcher_equals_scanning_all_commands(hotkey_combinations, presses):
+    matcher = HotkeyMatcher()
+    commands = []
+    for hotkeys in hotkey_combinations:
+        command = Command()
+        command.hotkeys = hotkeys
+        commands.append(command)
+        matcher.add(hotkeys, command)
+
+    history = deque()
+    for key_info in presses:
+        history.appendleft(key_info)
+        expected = [command for command in commands if pressed_keys_match_hotkey(command.hotkeys, history)]
+        assert matcher.feed(key_info) == expected
+
+
+def test_state_limit_grows_with_registered_hotkeys():
+    matcher = HotkeyMatcher(max_cached_states=10)
+    keys = "abcdefghij"
+    for first in keys:
+        for second in keys:
+            matcher.add([KeyInfo(first), KeyInfo(second, ctrl=None)], Command())
+    assert matcher.state_limit > 10
+    presses = [KeyInfo(keys[(index * 7) % 10], ctrl=index % 3 == 0, alt=False, shift=False) for index in range(500)]
+    for key_info in presses:
+        matcher.feed(key_info)
+    transitions = len(matcher._transitions)
+    # Warm: the same key presses do not compute or reset anything anymore
+    for key_info in presses:
+        matcher.feed(key_info)
+    assert len(matcher._transitions) == transitions
+    assert len(matcher._states) <= matcher.state_limit
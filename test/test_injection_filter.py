@@ -0,0 +1,144 @@
+import os
+import sys
+from threading import Thread
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import PASTE_MODIFIER, RecordingBackend
+from models.injection_filter import SelfInjectionFilter
+from models.manager import Manager
+from models.other import ScriptCommand
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_expected_events_are_consumed_by_key_and_direction():
+    injection_filter = SelfInjectionFilter()
+    injection_filter.expect_injection([("hotkey", ("ctrl", "v")), ("key_down", ("a",)), ("move_to", (1, 2))])
+    assert len(injection_filter) == 5
+    # A key of the user that is not expected passes
+    assert not injection_filter.consume(True, "b")
+    assert not injection_filter.consume(False, "a")
+    assert injection_filter.consume(True, "ctrl_l")
+    assert injection_filter.consume(True, "v")
+    assert injection_filter.consume(True, "a")
+    assert not injection_filter.consume(True, "a")
+    assert injection_filter.consume(False, "v")
+    assert injection_filter.consume(False, "ctrl_r")
+    assert len(injection_filter) == 0
+
+    injection_filter.expect_injection([("type_text", ("A b",))])
+    assert [injection_filter.consume(True, key) for key in ["shift_l", "A", "space", "b", "c"]] == [True] * 4 + [False]
+    assert len(injection_filter) == 4
+
+
+def test_characters_keep_their_case():
+    injection_filter = SelfInjectionFilter()
+    injection_filter.expect_injection([("key_down", ("A",))])
+    # The user's "a" is not the injected "A"
+    assert not injection_filter.consume(True, "a")
+    assert injection_filter.consume(True, "A")
+    # Names of special keys differ in case between the listener and the backends
+    injection_filter.expect_injection([("key_down", ("ctrl",))])
+    assert injection_filter.consume(True, "Ctrl_L")
+
+
+def test_paste_expects_the_platform_paste_modifier():
+    injection_filter = SelfInjectionFilter()
+    injection_filter.expect_injection([("paste_text", ("long text",))])
+    assert [injection_filter.consume(True, key) for key in [PASTE_MODIFIER, "v"]] == [True, True]
+    # The listener's name of the macOS command key is "cmd"
+    injection_filter.expect_injection([("key_down", ("command",))])
+    assert injection_filter.consume(True, "cmd_l")
+    assert [injection_filter.consume(False, key) for key in ["v", PASTE_MODIFIER]] == [True, True]
+
+
+def test_expectations_expire():
+    clock = FakeClock()
+    injection_filter = SelfInjectionFilter(ttl_ms=100, max_expected=10, clock=clock)
+    injection_filter.expect([(True, "a")])
+    clock.now = 0.2
+    # The injected event never arrived, a later key press of the user is not swallowed
+    assert not injection_filter.consume(True, "a")
+    assert injection_filter.expired == 1
+
+    injection_filter.expect([(True, "b")] * 5)
+    clock.now = 0.35
+    injection_filter.expect([(True, "c")])
+    assert len(injection_filter) == 1
+    # Never holds more than 'max_expected'
+    for _ in range(5):
+        injection_filter.expect([(True, "d")] * 8)
+        assert len(injection_filter) <= 10
+
+
+def test_only_overflow_evicts_the_oldest_expectations():
+    clock = FakeClock()
+    injection_filter = SelfInjectionFilter(ttl_ms=100, max_expected=10, clock=clock)
+    injection_filter.expect([(True, "a")])
+    clock.now = 0.09
+    injection_filter.expect([(True, "b")] * 8)
+    clock.now = 0.1
+    # Nothing expired and the table is not over capacity, nothing is dropped
+    injection_filter.expect([(True, "c")])
+    assert len(injection_filter) == 10
+    assert injection_filter.expired == 0
+
+    injection_filter.expect([(True, "d")] * 3)
+    assert len(injection_filter) == 10
+    assert injection_filter.expired == 0
+    assert injection_filter.evicted == 3
+    # The oldest expectations were dropped: the one of 'a' and two of 'b'
+    assert not injection_filter.consume(True, "a")
+    assert [injection_filter.consume(True, "b") for _ in range(7)] == [True] * 6 + [False]
+
+def test_concurrent_injections():
+    injection_filter = SelfInjectionFilter()
+    keys = "abcdefgh"
+
+    def inject(key):
+        for _ in range(500):
+            injection_filter.expect_injection([("key_down", (key,)), ("key_up", (key,))])
+
+    threads = [Thread(target=inject, args=(key,)) for key in keys]
+    for thread in threads:
+        thread.start()
+    consumed = 0
+    while any(thread.is_alive() for thread in threads) or len(injection_filter):
+        for key in keys:
+            consumed += injection_filter.consume(True, key) + injection_filter.consume(False, key)
+    for thread in threads:
+        thread.join()
+    assert consumed == len(keys) * 1000
+    assert injection_filter.expired == 0
+
+
+def test_listener_ignores_injected_keys():
+    triggered = []
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    try:
+        command = ScriptCommand()
+        manager.add_hotkey("a", command)
+        manager.trigger_command = triggered.append
+        listener = manager.keyboard_listener
+        manager.injection_filter.expect_injection([("key_down", ("a",)), ("key_up", ("a",))])
+
+        listener.on_press(SimpleNamespace(char="a"))
+        listener.on_release(SimpleNamespace(char="a"))
+        assert not triggered
+        listener.on_press(SimpleNamespace(char="a"))
+        assert triggered == [command]
+        # Tagged by the platform
+        listener.on_press(SimpleNamespace(char="a"), injected=True)
+        listener.on_press(SimpleNamespace(char="a"), injected=False)
+        assert triggered == [command, command]
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
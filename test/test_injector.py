@@ -0,0 +1,118 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend
+from models.injector import Injector
+
+
+class SlowBackend(RecordingBackend):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def execute_batch(self, events):
+        self.batches.append(len(events))
+        time.sleep(0.05)
+        return super().execute_batch(events)
+
+
+@pytest.mark.asyncio
+async def test_slow_injection_does_not_block_loop():
+    injector = Injector(SlowBackend())
+    injector.start()
+    try:
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        task = asyncio.ensure_future(ticker())
+        await injector.inject(("key_down", ("a",)), ("key_up", ("a",)))
+        task.cancel()
+        assert ticks > 10
+    finally:
+        injector.stop()
+
+
+@pytest.mark.asyncio
+async def test_waiting_submissions_are_injected_separately():
+    backend = SlowBackend()
+    injector = Injector(backend)
+    injector.start()
+    try:
+        first = injector.submit([("move_to", (1, 1))])
+        await asyncio.sleep(0.01)
+        # These are queued while the first batch is injected
+        rest = [injector.submit([("move_to", (i, i))]) for i in range(2, 6)]
+        await asyncio.gather(first, *rest)
+        assert backend.batches == [1, 1, 1, 1, 1]
+        assert await injector.call("position") == (5, 5)
+    finally:
+        injector.stop()
+
+
+@pytest.mark.asyncio
+async def test_errors_are_propagated():
+    injector = Injector(RecordingBackend())
+    injector.start()
+    try:
+        with pytest.raises(AttributeError):
+            await injector.call("does_not_exist")
+    finally:
+        injector.stop()
+
+
+class FailingBackend(SlowBackend):
+    def key_down(self, key: str):
+        if key == "fail":
+            raise ValueError(key)
+        return super().key_down(key)
+
+
+@pytest.mark.asyncio
+async def test_failing_submission_does_not_affect_others():
+    backend = FailingBackend()
+    injector = Injector(backend)
+    injector.start()
+    try:
+        first = injector.submit([("move_to", (1, 1))])
+        await asyncio.sleep(0.01)
+        # Queued together while the first batch is injected
+        failing = injector.submit([("key_down", ("fail",))])
+        later = injector.submit([("key_down", ("a",))])
+        results = await asyncio.gather(first, failing, later, return_exceptions=True)
+        assert isinstance(results[1], ValueError)
+        assert not isinstance(results[2], Exception)
+        assert [(event.action, event.args) for event in backend.events] == [
+            ("move_to", (1, 1)),
+            ("key_down", ("a",)),
+        ]
+        # Only the key that was pressed is held
+        assert injector.held == [("key_up", ("a",))]
+    finally:
+        injector.stop()
+
+
+@pytest.mark.asyncio
+async def test_overlapping_holds_are_counted():
+    backend = RecordingBackend()
+    injector = Injector(backend, threaded=False)
+    await injector.inject(("key_down", ("shift",)), ("mouse_down", ()), ("key_down", ("shift",)))
+    await injector.inject(("key_up", ("shift",)))
+    # 'shift' was pressed twice and released once, so it is still held
+    assert injector.held == [("mouse_up", ("left",)), ("key_up", ("shift",))]
+    await injector.inject(("key_up", ("shift",)), ("key_up", ("shift",)))
+    assert injector.held == [("mouse_up", ("left",))]
+    await injector.inject(("key_down", ("a",)), ("key_down", ("a",)))
+    await injector.release_held()
+    assert injector.held == []
+    assert [event.action for event in backend.events[-2:]] == ["key_up", "mouse_up"]
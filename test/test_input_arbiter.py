@@ -0,0 +1,103 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend
+from models.input_arbiter import InputArbiter, action_priority
+from models.keyboard_presser import KeyboardAction
+from models.manager import Manager
+from models.metrics import Metrics
+from models.other import KeyInfo
+
+
+async def hold(arbiter: InputArbiter, keys, log: list, name: str, seconds: float = 0.02, priority=(0, False)):
+    action_priority.set(priority)
+    async with arbiter.keys(keys):
+        log.append(f"{name} start")
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            log.append(f"{name} end")
+
+
+@pytest.mark.asyncio
+async def test_only_conflicting_leases_are_serialized():
+    arbiter = InputArbiter()
+    log = []
+    await asyncio.gather(hold(arbiter, ["a"], log, "a1"), hold(arbiter, ["b"], log, "b"), hold(arbiter, ["a"], log, "a2"))
+    assert log == ["a1 start", "b start", "a1 end", "b end", "a2 start", "a2 end"]
+
+    # A held modifier changes every other key press, plain presses wait for it
+    log.clear()
+    await asyncio.gather(hold(arbiter, ["shift", "x"], log, "shift"), hold(arbiter, ["y"], log, "y"))
+    assert log == ["shift start", "shift end", "y start", "y end"]
+    assert arbiter.owned == {} and arbiter.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_conflicts_are_only_counted_with_enabled_metrics():
+    for enabled in [False, True]:
+        arbiter = InputArbiter(metrics=Metrics(enabled=enabled))
+        await asyncio.gather(hold(arbiter, ["a"], [], "a1"), hold(arbiter, ["a"], [], "a2"))
+        assert arbiter.metrics.counters["arbiter_conflicts"] == int(enabled)
+
+
+@pytest.mark.asyncio
+async def test_waiting_leases_are_granted_by_priority():
+    arbiter = InputArbiter()
+    log = []
+    first = asyncio.ensure_future(hold(arbiter, ["a"], log, "first"))
+    await asyncio.sleep(0)
+    low = asyncio.ensure_future(hold(arbiter, ["a"], log, "low"))
+    await asyncio.sleep(0)
+    high = asyncio.ensure_future(hold(arbiter, ["a"], log, "high", priority=(5, False)))
+    await asyncio.gather(first, low, high)
+    assert log == ["first start", "first end", "high start", "high end", "low start", "low end"]
+
+
+@pytest.mark.asyncio
+async def test_preemption_cancels_lower_priority_owner():
+    arbiter = InputArbiter()
+    log = []
+    low = asyncio.ensure_future(hold(arbiter, ["a"], log, "low", seconds=10))
+    await asyncio.sleep(0)
+    await hold(arbiter, ["a"], log, "high", priority=(1, True))
+    with pytest.raises(asyncio.CancelledError):
+        await low
+    assert log == ["low start", "low end", "high start", "high end"]
+
+
+@pytest.mark.asyncio
+async def test_leases_are_reentrant_within_a_task():
+    arbiter = InputArbiter()
+    async with arbiter.keys(["ctrl", "c"]):
+        async with arbiter.keys(["c"]):
+            assert arbiter.owned["key:c"] == 1
+    assert arbiter.owned == {}
+
+
+@pytest.mark.asyncio
+async def test_actions_holding_the_same_key_do_not_interleave():
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    try:
+        actions = [
+            KeyboardAction(manager, hotkeys_to_press=[KeyInfo(key, duration=20)], repeat_delay=0)
+            for key in ["a", "a", "b"]
+        ]
+        await asyncio.gather(*(action.execute() for action in actions))
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
+    events = [(event.action, event.args[0]) for event in manager.backend.events]
+    assert events == [
+        ("key_down", "a"),
+        ("key_down", "b"),
+        ("key_up", "a"),
+        ("key_up", "b"),
+        ("key_down", "a"),
+        ("key_up", "a"),
+    ]
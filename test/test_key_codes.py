@@ -0,0 +1,62 @@
+import os
+import sys
+
+from hypothesis import given
+import hypothesis.strategies as st
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.key_codes import KeyHistory, HeldKeys, encode, decode, describe, modifier_mask
+from models.other import KeyInfo
+
+
+@given(st.text(min_size=1, max_size=5), st.booleans(), st.booleans(), st.booleans())
+def test_encode_decode(key, ctrl, alt, shift):
+    code = encode(key, modifier_mask(ctrl, alt, shift))
+    assert decode(code) == (key, ctrl, alt, shift)
+    assert KeyInfo(key, ctrl, alt, shift).code == code
+
+
+def test_describe():
+    assert describe(KeyInfo("e", ctrl=True, shift=True).code) == "ctrl+shift+e"
+
+
+@given(st.lists(st.integers(min_value=0, max_value=2 ** 40)), st.integers(min_value=1, max_value=5))
+def test_key_history(codes, size):
+    history = KeyHistory(size)
+    for code in codes:
+        history.push(code)
+    assert list(history) == list(reversed(codes))[:size]
+
+
+def test_key_history_timestamps():
+    history = KeyHistory(4)
+    milliseconds = 1_000_000
+    for timestamp in [0, 100, 150, 400, 450]:
+        history.push(encode("e"), timestamp * milliseconds)
+    assert history.timestamp(0) == 450 * milliseconds
+    assert history.sequence_fits(2, max_gap=50 * milliseconds)
+    assert not history.sequence_fits(3, max_gap=200 * milliseconds)
+    assert history.sequence_fits(3, max_gap=250 * milliseconds, window=300 * milliseconds)
+    assert not history.sequence_fits(4, window=300 * milliseconds)
+    # The first press was pushed out of the history
+    assert not history.sequence_fits(5)
+
+    history.expire(150 * milliseconds)
+    assert len(history) == 3
+    assert not history.sequence_fits(4)
+    history.expire(10 ** 12)
+    assert len(history) == 0
+
+
+def test_held_keys_ignore_repeated_presses():
+    held_keys = HeldKeys()
+    assert held_keys.press(1, 10)
+    serial = held_keys.serial(1)
+    assert not held_keys.press(1, 20)
+    assert held_keys.serial(1) == serial
+    assert held_keys.release(1, 25) == 10
+    assert held_keys.held_duration(1, serial) == 15
+    assert 1 not in held_keys and held_keys.release(1) is None
+    assert held_keys.press(1, 30)
+    assert held_keys.serial(1) != serial
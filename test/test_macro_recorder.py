@@ -0,0 +1,133 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend
+from models.event_journal import EventKind, read_journal
+from models.key_codes import encode
+from models.keyboard_listener import PRESSED
+from models.macro_recorder import MacroRecorder, MacroReplayer
+from models.manager import Manager
+
+
+def test_recorder_streams_key_and_mouse_events(tmp_path):
+    path = str(tmp_path / "macro.journal")
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    try:
+        recorder = MacroRecorder(manager, path)
+        recorder.start(record_mouse=False)
+        manager.keyboard_listener.on_press(SimpleNamespace(name="shift"))
+        manager.keyboard_listener.on_press(SimpleNamespace(char="A"))
+        manager.keyboard_listener.on_release(SimpleNamespace(char="A"))
+        manager.keyboard_listener.on_release(SimpleNamespace(name="shift_r"))
+        manager.keyboard_listener.on_press(SimpleNamespace(name="page_up"))
+        recorder.on_click(5, 6, SimpleNamespace(name="left"), True)
+        recorder.on_scroll(5, 6, 0, -2)
+        recorder.stop()
+        assert not manager.keyboard_listener.observers
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
+
+    records = list(read_journal(path))
+    assert [(record.event_kind, record.key) for record in records] == [
+        (EventKind.KeyPress, "shift"),
+        (EventKind.KeyPress, "a"),
+        (EventKind.KeyRelease, "a"),
+        (EventKind.KeyRelease, "shift"),
+        # Names of the backends, the recording can be replayed
+        (EventKind.KeyPress, "pageup"),
+        (EventKind.MouseDown, "left"),
+        (EventKind.MouseScroll, ""),
+    ]
+    assert (records[5].x, records[5].y) == (5, 6)
+    assert (records[6].x, records[6].y) == (0, -2)
+
+
+@pytest.mark.asyncio
+async def test_replay_keeps_recorded_offsets(tmp_path):
+    path = str(tmp_path / "macro.journal")
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    try:
+        recorder = MacroRecorder(manager, path)
+        recorder.start(record_mouse=False)
+        start = 1_000_000_000
+        recorder.journal.write(EventKind.KeyPress, "a", timestamp=start)
+        recorder.journal.write(EventKind.KeyRelease, "a", timestamp=start + 40_000_000)
+        recorder.journal.write(EventKind.MouseMove, x=10, y=20, timestamp=start + 60_000_000)
+        recorder.journal.write(EventKind.MouseUp | 0x80, "left", timestamp=start + 70_000_000)
+        recorder.journal.write(EventKind.MouseScroll, x=0, y=3, timestamp=start + 100_000_000)
+        recorder.stop()
+
+        stats = await MacroReplayer(manager, path, speed=2).replay()
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
+
+    events = manager.backend.events
+    # The injected record is skipped
+    assert [(event.action, event.args) for event in events] == [
+        ("key_down", ("a",)),
+        ("key_up", ("a",)),
+        ("move_to", (10, 20)),
+        ("scroll", (0, 3)),
+    ]
+    # Offsets are halved by the replay speed
+    assert events[1].timestamp - events[0].timestamp == pytest.approx(0.020, abs=0.01)
+    assert events[3].timestamp - events[0].timestamp == pytest.approx(0.050, abs=0.01)
+    assert stats.events == 4
+
+
+def test_recorded_keys_keep_the_time_they_were_queued(tmp_path):
+    path = str(tmp_path / "macro.journal")
+    journal_path = str(tmp_path / "manager.journal")
+    manager = Manager(backend=RecordingBackend(), start_listener=False, journal_path=journal_path)
+    try:
+        recorder = MacroRecorder(manager, path)
+        recorder.start(record_mouse=False)
+        listener = manager.keyboard_listener
+        # As the matcher worker hands on events with the timestamps of the hook thread
+        listener.handle_event(encode("b", PRESSED), timestamp=1_000)
+        listener.handle_event(encode("b", 0), timestamp=5_000)
+        recorder.on_scroll(0, 0, 0, 1)
+        recorder.stop()
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
+        manager.journal.close()
+
+    records = list(read_journal(path))
+    assert [record.timestamp for record in records[:2]] == [1_000, 5_000]
+    # Mouse events are stamped with the same clock as key events
+    assert 0 < manager.clock_ns() - records[2].timestamp < 10 ** 9
+    (key_press,) = [record for record in read_journal(journal_path) if record.event_kind == EventKind.KeyPress]
+    assert key_press.timestamp == 1_000
+
+
+@pytest.mark.asyncio
+async def test_recorded_special_keys_are_replayed_with_backend_names(tmp_path):
+    path = str(tmp_path / "macro.journal")
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    try:
+        recorder = MacroRecorder(manager, path)
+        recorder.start(record_mouse=False)
+        for name in ["page_up", "caps_lock"]:
+            manager.keyboard_listener.on_press(SimpleNamespace(name=name))
+            manager.keyboard_listener.on_release(SimpleNamespace(name=name))
+        recorder.stop()
+
+        await MacroReplayer(manager, path, speed=100).replay()
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
+
+    assert [(event.action, event.args) for event in manager.backend.events] == [
+        ("key_down", ("pageup",)),
+        ("key_up", ("pageup",)),
+        ("key_down", ("capslock",)),
+        ("key_up", ("capslock",)),
+    ]
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend
+from models.keyboard_presser import KeyboardAction, KeyboardCommand
+from models.manager import Manager
+from models.other import KeyInfo, ScriptCommand
+
+
+def actions(backend: RecordingBackend):
+    return [(event.action, event.args) for event in backend.events]
+
+
+@pytest.mark.asyncio
+async def test_shutdown_releases_held_keys():
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    manager.add_hotkey(
+        "alt+f",
+        KeyboardCommand(keyboard_action=KeyboardAction(manager, hotkeys_to_press=[KeyInfo("f", ctrl=True, duration=10000)])),
+    )
+    manager.keyboard_on_press(KeyInfo("f", alt=True))
+    while len(manager.backend.events) < 2:
+        await asyncio.sleep(0.001)
+    assert manager.injector.held == [("key_up", ("f",)), ("key_up", ("ctrl",))]
+
+    start = time.perf_counter()
+    asyncio.get_event_loop().call_later(0.01, manager.request_exit)
+    await manager.run()
+    assert time.perf_counter() - start < 1
+    assert actions(manager.backend) == [
+        ("key_down", ("ctrl",)),
+        ("key_down", ("f",)),
+        ("key_up", ("f",)),
+        ("key_up", ("ctrl",)),
+    ]
+    assert manager.injector.held == []
+
+
+@pytest.mark.asyncio
+async def test_shutdown_releases_keys_of_actions_that_do_not_finish():
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+
+    async def stuck():
+        await manager.keyboard_presser.key_down("a")
+        await manager.mouse_clicker.mouse_down("left")
+        while True:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                # Ignores being cancelled, the drain timeout has to end it
+                pass
+
+    manager.add_hotkey("alt+s", ScriptCommand(functions=[stuck]))
+    manager.keyboard_on_press(KeyInfo("s", alt=True))
+    while len(manager.backend.events) < 2:
+        await asyncio.sleep(0.001)
+
+    manager.exit = True
+    await manager.run(drain_timeout=0.1)
+    assert actions(manager.backend)[2:] == [("mouse_up", ("left",)), ("key_up", ("a",))]
+
+
+def test_windowed_sequences_and_double_taps():
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    triggered = []
+    manager.trigger_command = triggered.append
+    try:
+        sequence = ScriptCommand(window_ms=500)
+        manager.add_hotkey("e,e,e", sequence)
+        double_tap = ScriptCommand(trigger="double_tap")
+        manager.add_hotkey("d", double_tap)
+
+        e, d = KeyInfo("e", False, False, False), KeyInfo("d", False, False, False)
+        for milliseconds in [0, 1000, 1200, 1400]:
+            manager.keyboard_on_press(e, milliseconds * 1_000_000)
+            manager.keyboard_on_release(e, milliseconds * 1_000_000)
+        # Only the last three presses were within the window
+        assert triggered == [sequence]
+
+        triggered.clear()
+        for milliseconds in [2000, 2100, 2200, 2300, 3000]:
+            manager.keyboard_on_press(d, milliseconds * 1_000_000)
+            manager.keyboard_on_release(d, milliseconds * 1_000_000)
+        # Four taps are two double taps, the last tap is too late
+        assert triggered == [double_tap, double_tap]
+
+        # The history only keeps presses as long as the longest registered sequence can take
+        assert manager._history_horizon == 500_000_000
+        longer = ScriptCommand(max_gap_ms=400)
+        manager.add_hotkey("a,b,c", longer)
+        assert manager._history_horizon == 800_000_000
+        manager.remove_hotkey(longer)
+        assert manager._history_horizon == 500_000_000
+        manager.remove_hotkey(sequence)
+        manager.remove_hotkey(double_tap)
+        assert manager._history_horizon == 0
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
+
+
+def test_release_and_long_press_triggers():
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    triggered = []
+    manager.trigger_command = triggered.append
+    try:
+        released = ScriptCommand(trigger="release")
+        manager.add_hotkey("ctrl+r", released)
+        long_press = ScriptCommand(trigger="long_press", hold_ms=50)
+        manager.add_hotkey("l", long_press)
+
+        manager.keyboard_on_press(KeyInfo("r", True, False, False))
+        # Repeated presses of the operating system's key repeat do not add more releases
+        manager.keyboard_on_press(KeyInfo("r", True, False, False))
+        assert triggered == []
+        manager.keyboard_on_release(KeyInfo("r", False, False, False))
+        assert triggered == [released]
+
+        triggered.clear()
+        # Released too early
+        manager.keyboard_on_press(KeyInfo("l", False, False, False))
+        time.sleep(0.01)
+        manager.keyboard_on_release(KeyInfo("l", False, False, False))
+        manager.keyboard_on_press(KeyInfo("l", False, False, False))
+        time.sleep(0.2)
+        assert triggered == [long_press]
+        manager.keyboard_on_release(KeyInfo("l", False, False, False))
+
+        triggered.clear()
+        # The release was handled before the long press timer ran, but its timestamp shows the key was held long enough
+        pressed_at = manager.clock_ns()
+        manager.keyboard_on_press(KeyInfo("l", False, False, False), pressed_at)
+        manager.keyboard_on_release(KeyInfo("l", False, False, False), pressed_at + 100_000_000)
+        time.sleep(0.2)
+        assert triggered == [long_press]
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
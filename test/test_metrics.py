@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+from hypothesis import given
+import hypothesis.strategies as st
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend
+from models.keyboard_presser import KeyboardCommand, KeyboardAction
+from models.manager import Manager
+from models.metrics import LatencyHistogram
+from models.other import KeyInfo
+
+
+@given(st.lists(st.integers(min_value=0, max_value=10 ** 9), min_size=1, max_size=200))
+def test_histogram_relative_error(values):
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    assert histogram.total == len(values)
+    assert histogram.max == max(values)
+    median = sorted(values)[max(1, int(0.5 * len(values) + 0.5)) - 1]
+    assert abs(histogram.percentile(0.5) - median) <= median / 64
+
+
+def test_manager_metrics():
+    manager = Manager(backend=RecordingBackend(), start_listener=False, metrics=True)
+    try:
+        manager.add_hotkey("alt+1", KeyboardCommand(keyboard_action=KeyboardAction(manager, hotkeys_to_press=[KeyInfo("a")])))
+        manager.keyboard_on_press(KeyInfo("2", False, True, False))
+        manager.keyboard_on_press(KeyInfo("1", False, True, False))
+        end = time.monotonic() + 1
+        while manager.metrics.counters["injected_events"] < 1 and time.monotonic() < end:
+            time.sleep(0.001)
+
+        snapshot = manager.metrics.snapshot()
+        assert snapshot["counters"]["key_events"] == 2
+        assert snapshot["counters"]["matches"] == 1
+        assert snapshot["counters"]["triggers"] == 1
+        assert snapshot["counters"]["injected_events"] == 1
+        assert snapshot["histograms"]["match_latency"]["count"] == 2
+        assert snapshot["histograms"]["trigger_to_start"]["count"] == 1
+        assert "auto_clicker_key_events_total 2" in manager.metrics.prometheus_text()
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.scheduler import DeadlineScheduler
+
+
+@pytest.mark.asyncio
+async def test_deadlines_do_not_drift():
+    scheduler = DeadlineScheduler(spin_threshold_ms=1)
+    scheduler.start()
+    start = time.monotonic()
+    for _ in range(100):
+        # Simulate slow input injection, relative sleeps would add this up
+        time.sleep(0.001)
+        scheduler.event_done()
+        await scheduler.wait(3)
+    elapsed = time.monotonic() - start
+
+    assert 0.3 <= elapsed < 0.36
+    assert scheduler.stats.events == 100
+    assert scheduler.stats.steps == 100
+    assert scheduler.stats.requested == pytest.approx(0.3)
+    assert scheduler.stats.achieved_rate == pytest.approx(scheduler.stats.requested_rate, rel=0.1)
+
+
+@pytest.mark.asyncio
+async def test_resync_after_falling_behind():
+    scheduler = DeadlineScheduler(spin_threshold_ms=0, max_lag_ms=10)
+    scheduler.start()
+    time.sleep(0.05)
+    await scheduler.wait(1)
+    assert scheduler.stats.max_error >= 40
+    # The schedule restarted, the next step is not fired immediately to catch up
+    start = time.monotonic()
+    await scheduler.wait(5)
+    assert time.monotonic() - start >= 0.004
+
+
+@pytest.mark.asyncio
+async def test_absolute_deadlines():
+    scheduler = DeadlineScheduler(spin_threshold_ms=1)
+    scheduler.start()
+    start = time.monotonic()
+    await scheduler.wait_until(0.01)
+    # A slow step does not move the following deadlines
+    time.sleep(0.015)
+    await scheduler.wait_until(0.02)
+    await scheduler.wait_until(0.04)
+    assert 0.04 <= time.monotonic() - start < 0.05
+    # A deadline in the past returns right away and counts as late
+    await scheduler.wait_until(0.03)
+    assert scheduler.stats.steps == 4
+    assert scheduler.stats.max_error >= 5
+    assert scheduler.stats.requested == pytest.approx(0.04)
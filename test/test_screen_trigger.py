@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend
+from models.manager import Manager
+from models.other import ScriptCommand
+from models.screen_trigger import (
+    PixelColor,
+    RegionChanged,
+    RegionHash,
+    ScreenTrigger,
+    SyntheticFrameSource,
+    TemplateMatch,
+    hash_distance,
+    perceptual_hash,
+)
+
+
+def noise_screen(seed: int = 0) -> np.ndarray:
+    return np.random.RandomState(seed).randint(0, 256, size=(200, 300, 3), dtype=np.uint8)
+
+
+def test_pixel_color_fires_once_when_color_appears():
+    screen = np.zeros((100, 100, 3), dtype=np.uint8)
+    source = SyntheticFrameSource(screen)
+    trigger = ScreenTrigger((10, 10, 20, 20), PixelColor((255, 0, 0), tolerance=10), ScriptCommand())
+    assert not trigger.poll(source)
+    screen[15, 15] = (250, 5, 0)
+    assert trigger.poll(source)
+    # Still matching: the command is not triggered again
+    assert not trigger.poll(source)
+    screen[15, 15] = (0, 0, 0)
+    assert not trigger.poll(source)
+    # Outside of the region
+    screen[50, 50] = (255, 0, 0)
+    assert not trigger.poll(source)
+
+
+def test_interval_adapts_to_changes():
+    screen = noise_screen()
+    source = SyntheticFrameSource(screen)
+    trigger = ScreenTrigger((0, 0, 50, 50), RegionChanged(), ScriptCommand(), min_interval_ms=10, max_interval_ms=100)
+    for _ in range(10):
+        trigger.poll(source)
+    assert trigger.interval == trigger.max_interval
+    screen[:] = noise_screen(1)
+    assert trigger.poll(source)
+    assert trigger.interval == trigger.min_interval
+
+
+def test_perceptual_hash():
+    screen = noise_screen()
+    frame_hash = perceptual_hash(screen)
+    noisy = np.clip(screen.astype(np.int16) + np.random.RandomState(2).randint(-3, 4, screen.shape), 0, 255)
+    assert hash_distance(perceptual_hash(noisy.astype(np.uint8)), frame_hash) <= 5
+    assert hash_distance(perceptual_hash(noise_screen(3)), frame_hash) > 10
+    assert RegionHash(frame_hash).matches(screen)
+
+
+def test_region_too_small_for_condition_is_rejected():
+    # The hash needs 8 x 9 pixels
+    with pytest.raises(AssertionError):
+        ScreenTrigger((0, 0, 8, 8), RegionHash(0), ScriptCommand())
+    with pytest.raises(AssertionError):
+        ScreenTrigger((0, 0, 20, 20), RegionChanged(), ScriptCommand(), downsample=4)
+    with pytest.raises(AssertionError):
+        ScreenTrigger((0, 0, 20, 20), TemplateMatch(noise_screen()[:30, :10]), ScriptCommand())
+    ScreenTrigger((0, 0, 9, 8), RegionHash(0), ScriptCommand())
+
+
+def test_template_match_finds_position():
+    screen = noise_screen()
+    template = screen[120:140, 200:230].copy()
+    condition = TemplateMatch(template, max_difference=1)
+    trigger = ScreenTrigger((100, 100, 200, 100), condition, ScriptCommand())
+    assert trigger.poll(SyntheticFrameSource(screen))
+    assert condition.position == (100, 20)
+    assert not TemplateMatch(noise_screen(4)[:20, :30]).matches(screen)
+
+    # Downsampled, the position is found up to the downsampling factor
+    condition = TemplateMatch(template, max_difference=20)
+    trigger = ScreenTrigger((100, 100, 200, 100), condition, ScriptCommand(), downsample=2)
+    assert trigger.poll(SyntheticFrameSource(screen))
+    assert condition.position == (100, 20)
+
+
+def test_manager_triggers_command_from_screen():
+    screen = np.zeros((100, 100, 3), dtype=np.uint8)
+    triggered = []
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    try:
+        command = ScriptCommand(functions=[lambda: triggered.append(time.perf_counter())])
+        trigger = ScreenTrigger((0, 0, 10, 10), PixelColor((0, 255, 0)), command, min_interval_ms=1, max_interval_ms=5)
+        source = SyntheticFrameSource(screen)
+        manager.add_screen_trigger(trigger, frame_source=source)
+        time.sleep(0.05)
+        assert not triggered
+        screen[5, 5] = (0, 255, 0)
+        end = time.perf_counter() + 2
+        while not triggered and time.perf_counter() < end:
+            time.sleep(0.001)
+        assert len(triggered) == 1
+
+        manager.remove_screen_trigger(trigger)
+        time.sleep(0.01)
+        grabs = source.grabs
+        time.sleep(0.05)
+        assert source.grabs == grabs
+    finally:
+        manager.screen_watcher.stop()
+        manager.executor.stop()
+        manager.injector.stop()
@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.backends import RecordingBackend
+from models.manager import Manager
+from models.metrics import Metrics
+from models.other import KeyInfo, ScriptCommand
+from models.script_runner import ScriptRunner, ScriptRunnerFull, LOOP, THREAD, PROCESS
+
+
+@pytest.mark.asyncio
+async def test_script_command_runs_functions_on_the_loop_by_default():
+    loop_thread = threading.current_thread()
+    threads = []
+
+    async def coroutine_function():
+        threads.append(threading.current_thread())
+        await asyncio.sleep(0.01)
+        return "coroutine"
+
+    def function():
+        threads.append(threading.current_thread())
+        return "function"
+
+    command = ScriptCommand(functions=[coroutine_function, function])
+    assert [command.runs_in(function) for function in command.functions] == [LOOP, LOOP]
+    assert await command.execute() == ["coroutine", "function"]
+    assert threads == [loop_thread, loop_thread]
+
+    # Declared explicitly, the function runs in the thread pool
+    assert await ScriptCommand(functions=[function], run_in=THREAD).execute() == ["function"]
+    assert threads[2] is not loop_thread
+
+
+@pytest.mark.asyncio
+async def test_exceptions_and_timeouts_are_raised():
+    def failing():
+        raise ValueError("script failed")
+
+    runner = ScriptRunner(max_threads=1)
+    try:
+        with pytest.raises(ValueError):
+            await ScriptCommand(functions=[failing]).execute(runner)
+        with pytest.raises(asyncio.TimeoutError):
+            await ScriptCommand(functions=[lambda: time.sleep(0.2)], run_in=THREAD, timeout=20).execute(runner)
+        with pytest.raises(asyncio.TimeoutError):
+            await ScriptCommand(functions=[asyncio.sleep(1)], timeout=20).execute(runner)
+    finally:
+        runner.stop()
+
+
+@pytest.mark.asyncio
+async def test_thread_pool_rejects_scripts_when_full():
+    release = threading.Event()
+    # Disabled metrics are not counted
+    runner = ScriptRunner(max_threads=1, max_pending=2, metrics=Metrics())
+    try:
+        blocked = [asyncio.ensure_future(runner.run(release.wait, THREAD)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert runner.pending(THREAD) == 2
+        with pytest.raises(ScriptRunnerFull):
+            await runner.run(release.wait, THREAD)
+        release.set()
+        assert await asyncio.gather(*blocked) == [True, True]
+        assert runner.pending(THREAD) == 0
+        assert runner.metrics.counters["scripts_rejected"] == 0
+    finally:
+        runner.stop()
+
+
+@pytest.mark.asyncio
+async def test_process_pool_restarts_after_timeout():
+    runner = ScriptRunner(max_processes=1)
+    runner.warm()
+    try:
+        worker_pid = await runner.run(os.getpid, PROCESS)
+        assert worker_pid != os.getpid()
+        with pytest.raises(asyncio.TimeoutError):
+            await runner.run(functools.partial(time.sleep, 10), PROCESS, timeout=0.1)
+        assert runner.pending(PROCESS) == 0
+        # A new pool is started for the next script
+        assert await runner.run(os.getpid, PROCESS, timeout=10) not in (worker_pid, os.getpid())
+    finally:
+        runner.stop()
+
+
+def test_manager_returns_script_results():
+    manager = Manager(backend=RecordingBackend(), start_listener=False)
+    try:
+        command = ScriptCommand(functions=[lambda: threading.current_thread().name], run_in=THREAD)
+        manager.add_hotkey("alt+s", command)
+        handle = manager.trigger_command(command)
+        (thread_name,) = handle.result(timeout=1)
+        assert thread_name.startswith("ScriptRunner")
+    finally:
+        manager.executor.stop()
+        manager.injector.stop()
+        manager.script_runner.stop()
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.keyboard_presser import KeyboardAction, KeyboardCommand
+from models.other import KeyInfo, ScriptCommand, TRIGGER_LONG_PRESS
+from models.simulation import Simulation
+
+
+def keyboard_command(simulation: Simulation, *hotkeys: KeyInfo, **action_options) -> KeyboardCommand:
+    action = KeyboardAction(simulation.manager, hotkeys_to_press=list(hotkeys), **action_options)
+    return KeyboardCommand(keyboard_action=action)
+
+
+def test_toggled_macro_runs_for_half_an_hour_in_virtual_time():
+    start = time.perf_counter()
+    with Simulation() as simulation:
+        simulation.manager.add_hotkey(
+            "alt+1", keyboard_command(simulation, KeyInfo("a"), repeat_delay=1000, toggled_state=True)
+        )
+        simulation.tap(KeyInfo("1", alt=True), at_ms=100)
+        simulation.run_until(30 * 60 * 1000)
+        timeline = simulation.timeline()
+    assert time.perf_counter() - start < 10
+    assert len(timeline) == 2 * 1800
+    assert timeline[:4] == [
+        (100.0, "key_down", ("a",)),
+        (100.0, "key_up", ("a",)),
+        (1100.0, "key_down", ("a",)),
+        (1100.0, "key_up", ("a",)),
+    ]
+    assert timeline[-1] == (1799100.0, "key_up", ("a",))
+
+
+def test_long_hold_is_released_after_its_duration_and_on_shutdown():
+    with Simulation() as simulation:
+        simulation.manager.add_hotkey(
+            "alt+h", keyboard_command(simulation, KeyInfo("h", shift=True, duration=10 * 60 * 1000), repeat_delay=0)
+        )
+        simulation.tap(KeyInfo("h", alt=True), at_ms=0)
+        simulation.tap(KeyInfo("h", alt=True), at_ms=15 * 60 * 1000)
+        simulation.run_until(20 * 60 * 1000)
+    assert simulation.timeline() == [
+        (0.0, "key_down", ("shift",)),
+        (0.0, "key_down", ("h",)),
+        (600000.0, "key_up", ("h",)),
+        (600000.0, "key_up", ("shift",)),
+        (900000.0, "key_down", ("shift",)),
+        (900000.0, "key_down", ("h",)),
+        # Still held when the simulation is shut down
+        (1200000.0, "key_up", ("h",)),
+        (1200000.0, "key_up", ("shift",)),
+    ]
+
+
+def test_overlapping_triggers_and_retriggers():
+    with Simulation() as simulation:
+        manager = simulation.manager
+        manager.add_hotkey("alt+a", keyboard_command(simulation, KeyInfo("x", duration=300), repeat_delay=0))
+        manager.add_hotkey("alt+b", keyboard_command(simulation, KeyInfo("y"), repeat_delay=100, repeat_amount=2))
+        # Retriggering 'alt+a' while it holds 'x' waits for the first hold to release the key
+        simulation.feed(
+            [
+                (0, KeyInfo("a", alt=True), True),
+                (0, KeyInfo("a", alt=True), False),
+                (50, KeyInfo("b", alt=True), True),
+                (50, KeyInfo("b", alt=True), False),
+                (100, KeyInfo("a", alt=True), True),
+                (100, KeyInfo("a", alt=True), False),
+            ]
+        )
+        simulation.run_until(2000)
+    assert simulation.timeline() == [
+        (0.0, "key_down", ("x",)),
+        (50.0, "key_down", ("y",)),
+        (50.0, "key_up", ("y",)),
+        (150.0, "key_down", ("y",)),
+        (150.0, "key_up", ("y",)),
+        (250.0, "key_down", ("y",)),
+        (250.0, "key_up", ("y",)),
+        (300.0, "key_up", ("x",)),
+        (300.0, "key_down", ("x",)),
+        (600.0, "key_up", ("x",)),
+    ]
+
+
+def test_long_press_trigger_on_the_virtual_clock():
+    with Simulation() as simulation:
+        command = keyboard_command(simulation, KeyInfo("l"), repeat_delay=0)
+        command.trigger = TRIGGER_LONG_PRESS
+        command.hold_ms = 2000
+        simulation.manager.add_hotkey("f5", command)
+        # Too short, then long enough
+        simulation.tap(KeyInfo("f5"), at_ms=0, hold_ms=1000)
+        simulation.tap(KeyInfo("f5"), at_ms=5000, hold_ms=3000)
+        simulation.run_until(10000)
+    assert simulation.timeline() == [(7000.0, "key_down", ("l",)), (7000.0, "key_up", ("l",))]
+
+
+def test_manager_run_exits_on_the_virtual_clock():
+    with Simulation() as simulation:
+        manager = simulation.manager
+
+        async def ping():
+            await manager.keyboard_presser.press_hotkey(KeyInfo("p"))
+
+        manager.add_hotkey("alt+p", ScriptCommand(functions=[ping], start_delay=500))
+        simulation.tap(KeyInfo("p", alt=True), at_ms=0)
+        simulation.loop.call_at(3600, manager.request_exit)
+        simulation.run(manager.run())
+        assert simulation.now_ms == 3600 * 1000
+    assert simulation.timeline() == [(500.0, "key_down", ("p",)), (500.0, "key_up", ("p",))]
+    assert manager.injector.held == []
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from hypothesis import given
+import hypothesis.strategies as st
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from models.trajectory import trajectory, PATHS, LINEAR, EASE_IN_OUT, BEZIER, HUMAN
+
+
+@given(
+    st.integers(min_value=-3000, max_value=3000),
+    st.integers(min_value=-3000, max_value=3000),
+    st.integers(min_value=1, max_value=500),
+    st.sampled_from(PATHS),
+)
+def test_trajectory_ends_at_target(dx, dy, steps, path):
+    offsets = trajectory(dx, dy, steps, path)
+    assert offsets.shape == (steps, 2)
+    assert tuple(offsets[-1]) == (dx, dy)
+
+
+def test_trajectory_shapes():
+    assert trajectory(100, 0, 4, LINEAR).tolist() == [[25, 0], [50, 0], [75, 0], [100, 0]]
+    eased = trajectory(100, 0, 10, EASE_IN_OUT)[:, 0]
+    # Slow at the start and at the end, fast in the middle
+    assert eased[0] < 10 and eased[4] == 50 and eased[-2] > 90
+    assert np.all(np.diff(eased) >= 0)
+    # Curved paths leave the straight line
+    assert np.abs(trajectory(1000, 0, 50, BEZIER)[:, 1]).max() > 50
+    assert np.abs(trajectory(1000, 0, 50, HUMAN, seed=1)[:, 1]).max() > 5
+
+
+def test_trajectories_are_cached():
+    offsets = trajectory(300, -200, 60, HUMAN, seed=3)
+    assert trajectory(300, -200, 60, HUMAN, seed=3) is offsets
+    assert trajectory(300, -200, 60, HUMAN, seed=4) is not offsets
+    with pytest.raises(ValueError):
+        offsets[0, 0] = 1